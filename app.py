@@ -1,7 +1,14 @@
-from functions.fetchKeywords import fetchKeywords
-from functions.apiToDataFrame import apiToDataFrame
+from functions.fetchQueue import cancelJob, jobStatus, listJobs, startWorker, submitJob
 from functions.analyzeDataFrame import analyzeDataFrame
+from functions.analyzeBrands import analyzeBrands
+from functions.prepareAnalysis import prepareAnalysis
+from functions.streamRecords import streamRecords
+from functions.resultStore import STORE_PATH, isResultStore, storeDigest, writeStoreOnce
+from functions.exportResults import FORMATS, exportFile, referencesTable, resultHash
+from functions.extractColumns import ITEM_TYPES
 import streamlit as st
+import hashlib
+import os
 import pandas as pd
 import json
 import io
@@ -20,6 +27,338 @@ st.markdown("Phân tích dữ liệu Google AI Overviews trên 1 bộ từ khóa
 # Initialize session state
 if 'dataframe' not in st.session_state:
     st.session_state.dataframe = None
+    st.session_state.data_hash = None
+
+
+# Optional debug panel: time, rows and peak memory of every pipeline stage
+debug = st.sidebar.checkbox("Debug: thời gian & bộ nhớ từng bước", help="Đo từng bước xử lý (chậm hơn một chút khi bật)")
+
+# Format of every download button
+EXPORT_LABELS = {'csv': "CSV", 'csv.gz': "CSV nén (gzip)", 'parquet': "Parquet"}
+export_format = st.sidebar.selectbox("Định dạng file tải xuống", list(FORMATS), format_func=EXPORT_LABELS.get,
+                                     help="CSV nén và Parquet nhỏ hơn nhiều với bộ từ khóa lớn")
+
+# Organic results and featured snippets are kept with the AI overviews, for the brand's organic rank column
+capture_items = st.sidebar.checkbox("Lấy cả thứ hạng organic & featured snippet", help="Áp dụng cho data tải/lấy sau khi bật")
+item_types = ITEM_TYPES if capture_items else ()
+
+
+def show_profile(stages, title):
+    if not debug or not stages:
+        return
+    with st.expander(f"Debug - {title}"):
+        profile_df = pd.DataFrame(stages)
+        st.dataframe(profile_df, use_container_width=True)
+        st.caption(f"Tổng: {profile_df['seconds'].sum():.2f}s, bộ nhớ đỉnh: {profile_df['peak_memory_mb'].max():.1f} MB")
+
+
+def show_problem(result):
+    # analysis functions return their problems instead of displaying them
+    if result.get('status') == 'no_data':
+        st.warning(result['message'])
+    else:
+        st.error(result.get('message', "Analysis completed but no results were generated."))
+
+
+# Brand-independent analysis, computed once per dataset and keyed by its content hash
+@st.cache_resource(show_spinner=False, max_entries=4)
+def prepare_analysis(data_hash, profile, _dataframe):
+    return prepareAnalysis(_dataframe, profile=profile)
+
+
+# Brand results, cached per dataset and brand so reruns (page changes, tabs, downloads) don't recompute them
+@st.cache_resource(show_spinner=False, max_entries=8)
+def brand_result(data_hash, brand_name, brand_domain, profile, _prepared):
+    return analyzeDataFrame(None, brand_name, brand_domain, prepared=_prepared, profile=profile)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def brands_result(data_hash, brands, _prepared):
+    return analyzeBrands(None, list(brands), prepared=_prepared)
+
+
+# Exports are written to disk in chunks only when a download button is clicked, once per result, table and format
+def read_export(df, result_key, name):
+    with open(exportFile(df, resultHash(*result_key), name, export_format), 'rb') as file:
+        return file.read()
+
+
+def download_table(label, df, result_key, name, file_name):
+    # df can be a function building the table, it only runs for the first download
+    extension, mime = FORMATS[export_format]
+    st.download_button(
+        label=label,
+        data=lambda: read_export(df, result_key, name),
+        file_name=file_name + extension,
+        mime=mime,
+        on_click="ignore",
+        key=f"download_{name}"
+    )
+
+
+PAGE_SIZES = [25, 50, 100, 500]
+
+
+def reset_page(key):
+    st.session_state[f"{key}_page"] = 1
+
+
+@st.fragment
+def show_table(df, key, search_column, list_columns=()):
+    """
+    - Server-side filter, sort and pagination, only the rows of the current page are sent to the browser
+    - Runs as a fragment: changing page, filter or sort reruns just this table
+    """
+    col1, col2, col3 = st.columns([3, 3, 1])
+    with col1:
+        query = st.text_input("Lọc", key=f"{key}_query", placeholder=f"Tìm theo {search_column}", on_change=reset_page, args=(key,))
+    sortable = [column for column in df.columns if column not in list_columns]
+    with col2:
+        sort_by = st.selectbox("Sắp xếp theo", ["(mặc định)"] + sortable, key=f"{key}_sort", on_change=reset_page, args=(key,))
+    with col3:
+        descending = st.toggle("Giảm dần", key=f"{key}_descending", on_change=reset_page, args=(key,))
+
+    view = df
+    if query:
+        view = view[view[search_column].astype(str).str.contains(query, case=False, regex=False, na=False)]
+    if sort_by in sortable:
+        view = view.sort_values(sort_by, ascending=not descending, kind='stable', na_position='last')
+
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("Số dòng mỗi trang", PAGE_SIZES, key=f"{key}_page_size", on_change=reset_page, args=(key,))
+    pages = max(1, -(-len(view) // page_size))
+    ## a narrower filter can leave the remembered page past the end
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with col2:
+        page = st.number_input(f"Trang (1-{pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+
+    start = (page - 1) * page_size
+    page_df = view.iloc[start:start + page_size].copy()
+    # list values are joined into text for the visible rows only
+    for column in list_columns:
+        if column in page_df.columns:
+            page_df[column] = page_df[column].map(lambda values: ", ".join(map(str, values)) if isinstance(values, list) else values)
+    st.dataframe(page_df, use_container_width=True, hide_index=True)
+    st.caption(f"Dòng {start + 1 if len(view) else 0}-{start + len(page_df)} / {len(view)}" + (f" (lọc từ {len(df)})" if len(view) != len(df) else ""))
+
+
+# Competitor chart, only built when its tab is open and cached per result
+@st.cache_resource(show_spinner=False, max_entries=8)
+def competitor_figure(result_key, brand_name, _competitors_df):
+    competitors_df = _competitors_df
+    # Prepare data for visualization
+    viz_df = competitors_df.copy()
+    viz_df['total_engagement'] = viz_df['cited_count'] + viz_df['mentioned']
+
+    # Find user's brand and separate it
+    user_brand_row = viz_df[viz_df['brand'].str.lower() == brand_name.lower()]
+    other_brands = viz_df[viz_df['brand'].str.lower() != brand_name.lower()]
+
+    # Take top 15 other brands for readability
+    other_brands_top = other_brands.head(15)
+
+    # Combine user brand (at top) with other top brands
+    if not user_brand_row.empty:
+        chart_data = pd.concat([user_brand_row, other_brands_top]).reset_index(drop=True)
+        # Add star to user brand name for extra visibility
+        chart_data.loc[0, 'brand'] = f"{chart_data.loc[0, 'brand']}"
+    else:
+        chart_data = other_brands_top
+
+    # Create colors: highlight user brand
+    colors = []
+    for brand in chart_data['brand']:
+        if brand.lower() == brand_name.lower():
+            colors.append('#FF6B6B')  # Red for user brand
+        else:
+            colors.append('#4ECDC4')  # Teal for competitors
+
+    # Create colors for highlighting user brand
+    citation_colors = []
+    mention_colors = []
+    text_colors = []
+
+    for brand in chart_data['brand']:
+        if brand.lower() == brand_name.lower():
+            # Your brand - bright, distinctive colors
+            citation_colors.append('#FFD700')  # Gold for citations
+            mention_colors.append('#FF6B35')   # Orange for mentions
+            text_colors.append('black')
+        else:
+            # Competitors - muted colors
+            citation_colors.append('#87CEEB')  # Light blue
+            mention_colors.append('#F08080')  # Light coral
+            text_colors.append('white')
+
+    # Create horizontal bar chart
+    fig = go.Figure()
+
+    # Add bars for mentions with individual colors (first, so they appear below)
+    fig.add_trace(go.Bar(
+        name='Mentions',
+        y=chart_data['brand'],
+        x=chart_data['mentioned'],
+        orientation='h',
+        marker_color=mention_colors,
+        marker_line=dict(
+            color=['#CC5500' if brand.lower() == brand_name.lower() else '#E57373'
+                   for brand in chart_data['brand']],
+            width=[3 if brand.lower() == brand_name.lower() else 1
+                   for brand in chart_data['brand']]
+        ),
+        text=chart_data['mentioned'],
+        textposition='auto',
+        textfont=dict(
+            color=['black' if brand.lower() == brand_name.lower() else 'white'
+                   for brand in chart_data['brand']],
+            size=[14 if brand.lower() == brand_name.lower() else 12
+                  for brand in chart_data['brand']]
+        )
+    ))
+
+    # Add bars for citations with individual colors (second, so they appear above)
+    fig.add_trace(go.Bar(
+        name='Citations',
+        y=chart_data['brand'],
+        x=chart_data['cited_count'],
+        orientation='h',
+        marker_color=citation_colors,
+        marker_line=dict(
+            color=['#B8860B' if brand.lower() == brand_name.lower() else '#5DADE2'
+                   for brand in chart_data['brand']],
+            width=[3 if brand.lower() == brand_name.lower() else 1
+                   for brand in chart_data['brand']]
+        ),
+        text=chart_data['cited_count'],
+        textposition='auto',
+        textfont=dict(
+            color=['black' if brand.lower() == brand_name.lower() else 'white'
+                   for brand in chart_data['brand']],
+            size=[14 if brand.lower() == brand_name.lower() else 12
+                  for brand in chart_data['brand']]
+        )
+    ))
+
+    # Update layout
+    fig.update_layout(
+        title=f"Competitor Citations vs Mentions (Your Brand: {brand_name})",
+        xaxis_title="Count",
+        yaxis_title="Brands",
+        barmode='group',
+        height=max(400, len(chart_data) * 40),
+        showlegend=True,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        yaxis=dict(
+            tickfont=dict(size=12),
+            categoryorder='array',
+            categoryarray=list(reversed(chart_data['brand']))
+        )
+    )
+
+    # Highlight user brand with different styling
+    if not user_brand_row.empty:
+        user_brand_index = chart_data[chart_data['brand'].str.lower() == brand_name.lower()].index[0]
+        fig.add_shape(
+            type="rect",
+            x0=-max(chart_data['cited_count'].max(), chart_data['mentioned'].max()) * 0.05,
+            y0=user_brand_index - 0.4,
+            x1=max(chart_data['cited_count'].max(), chart_data['mentioned'].max()) * 1.05,
+            y1=user_brand_index + 0.4,
+            line=dict(color="#FFD700", width=3),
+            fillcolor="rgba(255, 215, 0, 0.1)"
+        )
+
+    return fig
+
+
+# Text summary of a brand result, only built when its download button is clicked
+@st.cache_data(show_spinner=False, max_entries=8)
+def analysis_summary(result_key, brand_name, brand_domain, _result):
+    result = _result
+    competitors_df = result.get('competitors_df')
+
+    # Calculate summary stats
+    total_citations = competitors_df['cited_count'].sum()
+    total_mentions = competitors_df['mentioned'].sum()
+    top_competitor = competitors_df.iloc[0] if not competitors_df.empty else None
+
+    # Create formatted strings for rates
+    citation_rate = f"{top_competitor['prompt_cited_rate']:.1%}" if top_competitor is not None else 'N/A'
+    mention_rate = f"{top_competitor['mention_rate']:.1%}" if top_competitor is not None else 'N/A'
+
+    # Combine summary stats
+    summary_text = f"""
+AI Overviews Analysis Summary
+Brand: {brand_name} ({brand_domain})
+====================================
+
+Keywords Analyzed: {result.get('keywords_analyzed', 0)}
+AI Overviews Found: {result.get('ai_overviews_found', 0)}
+Competitors Identified: {result.get('competitors_identified', 0)}
+
+Total Citations Across All Competitors: {total_citations}
+Total Mentions Across All Competitors: {total_mentions}
+
+Top Competitor by Total Engagement:
+{top_competitor['brand'] if top_competitor is not None else 'No data'}
+- Citations: {top_competitor['cited_count'] if top_competitor is not None else 'N/A'}
+- Mentions: {top_competitor['mentioned'] if top_competitor is not None else 'N/A'}
+- Citation Rate: {citation_rate}
+- Mention Rate: {mention_rate}
+
+Top 5 Competitors Summary:
+{competitors_df[['brand', 'cited_count', 'mentioned', 'prompt_cited_rate', 'mention_rate']].head().to_string(index=False) if not competitors_df.empty else 'No data'}
+    """
+    return summary_text
+
+
+def show_job(job_id):
+    job = jobStatus(job_id)
+    if job is None:
+        return
+
+    if job['status'] in ('queued', 'running'):
+        st.progress(job['progress'])
+        if job['status'] == 'queued':
+            st.text(f"Đang chờ trong hàng đợi - {job['total']} từ khóa")
+        else:
+            eta = f", còn khoảng {job['eta']:.0f}s" if job['eta'] is not None else ""
+            st.text(f"Fetching keywords: {job['completed']}/{job['total']} completed ({job['progress']:.0%}) - "
+                    f"{job['cached']} from cache/checkpoint, {job['throughput']:.1f} keywords/s{eta}")
+        if st.button("Hủy", key=f"cancel_job_{job_id}"):
+            cancelJob(job_id)
+            st.rerun()
+
+    elif job['status'] == 'done':
+        ## the finished job's store becomes the dataset once, then the whole page reruns to show the analysis
+        if st.session_state.get('loaded_job') != job_id:
+            st.session_state.dataframe = job['store_path']
+            st.session_state.data_hash = storeDigest(job['store_path'])
+            st.session_state.upload_hash = None
+            st.session_state.loaded_job = job_id
+            st.rerun()
+
+        summary = job['summary'] or {}
+        cache_info = summary.get('cache', {})
+        st.success(f"✓ Completed fetching {job['total']} keywords ({cache_info.get('cached', 0)} from cache, {cache_info.get('fetched', 0)} fetched)")
+
+        # tasks rejected by the API are reported without failing the whole run
+        failed = summary.get('failed', [])
+        if failed:
+            st.warning(f"{len(failed)} keywords failed: " + ", ".join(f"{f['keyword']} ({f['status_code']} {f['status_message']})" for f in failed[:20]))
+        show_profile(summary.get('profile'), "fetchKeywords")
+
+    elif job['status'] == 'failed':
+        st.error(f"Error fetching data: {job['error']}")
+    else:
+        st.warning(f"Đã hủy lần tải #{job_id} ({job['completed']}/{job['total']} từ khóa)")
+
+
+# progress of a queued or running job, polled without rerunning the rest of the page
+job_progress = st.fragment(run_every=1)(show_job)
+
 
 # DEFINING MODES
 route = st.radio(
@@ -39,6 +378,9 @@ dataframe = None
 if route == "Fetch Keywords":
     st.subheader("Live API Fetch")
 
+    # fetches run as jobs of a background worker shared by every session, they keep going across reruns and page reloads
+    startWorker()
+
     with st.form("keyword_form"):
         keywords_input = st.text_area(
             "Điền từ khóa (mỗi dòng 1 từ, hoặc ngăn cách bằng dấu phẩy):",
@@ -49,6 +391,12 @@ if route == "Fetch Keywords":
             location_code = st.text_input("Mã địa điểm (4 chữ số):", placeholder="2740")
         with col2:
             language_code = st.text_input("Mã ngôn ngữ:", placeholder="vi")
+        backend = st.radio(
+            "Cách lấy data:",
+            ["live", "queued"],
+            horizontal=True,
+            help="live: nhận kết quả ngay từng từ khóa. queued: gửi task theo lô rồi tải về khi xong, rẻ hơn cho bộ từ khóa lớn nhưng chậm hơn"
+        )
 
         submit_button = st.form_submit_button("Lấy Data")
 
@@ -58,24 +406,24 @@ if route == "Fetch Keywords":
         keywords = [k.strip() for k in keywords_input.replace('\n', ',').split(',') if k.strip()]
 
         if keywords:
-            # Create progress bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-
-            def update_progress(completed, total):
-                progress = completed / total
-                progress_bar.progress(progress)
-                status_text.text(f"Fetching keywords: {completed}/{total} completed ({progress:.0%})")
+            st.session_state.fetch_job = submitJob(keywords, location_code, language_code, backend=backend, profile=debug, item_types=list(item_types))
+
+    ## earlier jobs can be picked up again, e.g. after reloading the page
+    jobs = {job['job_id']: job for job in listJobs(10)}
+    if jobs:
+        job_ids = list(jobs)
+        current = st.session_state.get('fetch_job')
+        st.session_state.fetch_job = st.selectbox(
+            "Lần tải",
+            job_ids,
+            index=job_ids.index(current) if current in job_ids else 0,
+            format_func=lambda job_id: f"#{job_id} - {jobs[job_id]['status']} - {jobs[job_id]['total']} từ khóa"
+        )
 
-            try:
-                status_text.text(f"Starting to fetch {len(keywords)} keywords...")
-                api_result = fetchKeywords(keywords, location_code, language_code, progress_callback=update_progress)
-                st.session_state.dataframe = apiToDataFrame(api_result)
-                progress_bar.progress(1.0)
-                status_text.text(f"Successfully fetched data for {len(keywords)} keywords!")
-                st.success(f"✓ Completed fetching {len(keywords)} keywords")
-            except Exception as e:
-                st.error(f"Error fetching data: {str(e)}")
+        if jobs[st.session_state.fetch_job]['status'] in ('queued', 'running'):
+            job_progress(st.session_state.fetch_job)
+        else:
+            show_job(st.session_state.fetch_job)
 
     # Set dataframe from session state
     if st.session_state.dataframe is not None:
@@ -87,16 +435,25 @@ elif route == "Upload JSON":
 
     uploaded_file = st.file_uploader(
         "Tải lên file JSON",
-        type=['json'],
-        help="Tải file JSON có sẵn"
+        type=['json', 'ndjson', 'jsonl', 'gz', 'zst'],
+        help="Tải file JSON có sẵn (api-result.json, api-result.ndjson, có thể nén .gz/.zst)"
     )
 
     ### if uploaded file is not empty
     if uploaded_file is not None:
         try:
-            # Read the uploaded JSON file
-            data = json.load(uploaded_file)
-            st.session_state.dataframe = data
+            # Stream the uploaded file record by record into a columnar store of its own, named by the file content
+            ## sessions never share a store path, so a cache miss always reads this session's data
+            ## the content hash is computed once per uploaded file, not on every rerun
+            if st.session_state.get('upload_digest', (None,))[0] != uploaded_file.file_id:
+                st.session_state.upload_digest = (uploaded_file.file_id, hashlib.sha256(uploaded_file.getvalue()).hexdigest())
+            upload_hash = (st.session_state.upload_digest[1], item_types)
+            ## a store evicted by newer uploads is written again
+            if st.session_state.get('upload_hash') != upload_hash or not isResultStore(st.session_state.dataframe):
+                store_path = os.path.join(STORE_PATH, '-'.join(upload_hash[:1] + item_types))
+                st.session_state.dataframe = writeStoreOnce(streamRecords(uploaded_file, item_types=item_types), store_path, item_types)
+                st.session_state.data_hash = storeDigest(st.session_state.dataframe)
+                st.session_state.upload_hash = upload_hash
             st.success("Tải lên file thành công")
         except Exception as e:
             st.error(f"Lỗi loading JSON file: {str(e)}")
@@ -109,32 +466,110 @@ elif route == "Upload JSON":
 if dataframe is not None:
     st.subheader("Kết quả phân tích")
 
-    with st.form("analysis_form"):
-        col1, col2 = st.columns(2)
-        with col1:
-            brand_name = st.text_input("Tên brand:", placeholder="SEONGON")
-        with col2:
-            brand_domain = st.text_input("Domain brand:", placeholder="seongon.com")
-
-        analyze_button = st.form_submit_button("Phân tích Data")
-
-    if analyze_button and brand_name and brand_domain:
+    analysis_mode = st.radio("Chế độ phân tích:", ["Một brand", "Nhiều brand"], horizontal=True)
+    brands_button = False
+
+    if analysis_mode == "Một brand":
+        with st.form("analysis_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                brand_name = st.text_input("Tên brand:", placeholder="SEONGON")
+            with col2:
+                brand_domain = st.text_input("Domain brand:", placeholder="seongon.com")
+
+            # the submitted analysis is remembered, so paging, tabs and downloads keep showing it
+            if st.form_submit_button("Phân tích Data") and brand_name and brand_domain:
+                st.session_state.analysis = ('brand', brand_name, brand_domain)
+    else:
+        with st.form("brands_form"):
+            brands_input = st.text_area(
+                "Danh sách brand (mỗi dòng: tên brand, domain):",
+                placeholder="SEONGON, seongon.com\nBrand B, brandb.com"
+            )
+
+            brands_button = st.form_submit_button("Phân tích Data")
+
+    ## MULTI-BRAND MODE: every brand in one pass over the same dataset
+    if brands_button and brands_input:
+        brands = []
+        for line in brands_input.splitlines():
+            name, _, domain = line.partition(',')
+            if name.strip() and domain.strip():
+                brands.append((name.strip(), domain.strip()))
+
+        if not brands:
+            st.warning("Điền ít nhất 1 brand theo dạng: tên brand, domain")
+        else:
+            st.session_state.analysis = ('brands', tuple(brands))
+
+    analysis = st.session_state.get('analysis')
+    ## exports and figures are cached under the dataset and the analysis that produced them
+    result_key = (st.session_state.data_hash, analysis)
+
+    if analysis is not None and analysis[0] == 'brands' and analysis_mode == "Nhiều brand":
         with st.spinner("Đang phân tích data..."):
             try:
-                # Debug: Show data structure info
-                if isinstance(dataframe, pd.DataFrame):
-                    # Show a sample of the data structure
-                    if not dataframe.empty:
-                        st.json({"sample_data_structure": str(type(dataframe.iloc[0, 0]))})
+                prepared = prepare_analysis(st.session_state.data_hash, debug, dataframe)
+                result = brands_result(st.session_state.data_hash, analysis[1], prepared)
+                show_profile(prepared.get('profile'), "prepareAnalysis")
+
+                if result.get('status') == 'success':
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Số từ khóa", result.get('keywords_analyzed', 0))
+                    with col2:
+                        st.metric("Số AI Overviews", result.get('ai_overviews_found', 0))
+                    with col3:
+                        st.metric("Số brand", result.get('brands_analyzed', 0))
+
+                    brands_df = result.get('brands_df')
+                    rank_matrix = result.get('rank_matrix')
+
+                    # only the open tab is rendered
+                    tab1, tab2, tab3 = st.tabs(["Share of Voice", "Tổng quan theo brand", "Thứ hạng theo từ khóa"], key="brands_tabs", on_change="rerun")
+
+                    with tab1:
+                        if tab1.open:
+                            # Share of voice chart (citations + mentions among the listed brands)
+                            fig = px.bar(
+                                brands_df.iloc[::-1],
+                                x='share_of_voice',
+                                y='brand',
+                                orientation='h',
+                                text=brands_df.iloc[::-1]['share_of_voice'].map(lambda x: f"{x:.1%}"),
+                                title="Share of Voice trên AI Overviews",
+                                height=max(400, len(brands_df) * 30)
+                            )
+                            st.plotly_chart(fig, use_container_width=True)
+
+                    with tab2:
+                        if tab2.open:
+                            st.subheader("Tổng quan theo brand")
+                            st.dataframe(brands_df, use_container_width=True)
+                            download_table("Tải file", brands_df, result_key, "brands", "brands_summary")
+
+                    with tab3:
+                        if tab3.open:
+                            st.subheader("Thứ hạng trích dẫn theo từ khóa")
+                            show_table(rank_matrix, "rank_matrix", "keyword")
+                            download_table("Tải file", rank_matrix, result_key, "rank_matrix", "brands_rank_matrix")
+                else:
+                    show_problem(result)
 
-                # Pass the brand info as globals
-                import builtins
-                builtins.brand_name_input = brand_name
-                builtins.brand_domain_input = brand_domain
+            except Exception as e:
+                st.error(f"Unexpected error during analysis: {str(e)}")
+                st.error("Please check your data format and try again.")
 
-                result = analyzeDataFrame(dataframe)
+    if analysis is not None and analysis[0] == 'brand' and analysis_mode == "Một brand":
+        _, brand_name, brand_domain = analysis
+        with st.spinner("Đang phân tích data..."):
+            try:
+                # Only the brand rank is recomputed when the brand changes
+                prepared = prepare_analysis(st.session_state.data_hash, debug, dataframe)
+                result = brand_result(st.session_state.data_hash, brand_name, brand_domain, debug, prepared)
+                show_profile(result.get('profile'), "analyzeDataFrame")
 
-                if result is not None and isinstance(result, dict) and result.get('status') == 'success':
+                if result.get('status') == 'success':
                     # Display analysis summary
                     col1, col2, col3 = st.columns(3)
                     with col1:
@@ -148,211 +583,78 @@ if dataframe is not None:
                     keywords_df = result.get('keywords_df')
                     competitors_df = result.get('competitors_df')
 
-                    # Display results in tabs
-                    tab1, tab2 = st.tabs(["Phân tích từ khóa", "Phân tích đối thủ"])
+                    # Display results in tabs, only the open one is rendered
+                    tab1, tab2 = st.tabs(["Phân tích từ khóa", "Phân tích đối thủ"], key="brand_tabs", on_change="rerun")
 
                     with tab1:
-                        st.subheader("Kết quả của phân tích trên từng từ khóa")
-                        if keywords_df is not None and not keywords_df.empty:
-                            # Show only readable format
-                            display_df = keywords_df.drop(columns=['aio_references']) if 'aio_references' in keywords_df.columns else keywords_df
-                            if 'aio_references_display' in display_df.columns:
-                                display_df = display_df.rename(columns={'aio_references_display': 'aio_references'})
-
-                            st.dataframe(display_df, use_container_width=True)
-
-                            # Download button
-                            csv_keywords = keywords_df.to_csv(index=False)
-                            st.download_button(
-                                label="Tải file",
-                                data=csv_keywords,
-                                file_name="keywords_analysis.csv",
-                                mime="text/csv",
-                                key="download_keywords"
-                            )
-                        else:
-                            st.warning("Không có data từ khóa")
-
-                    with tab2:
-                        st.subheader("Kết quả phân tích đối thủ cạnh tranh tổng quan")
-                        if competitors_df is not None and not competitors_df.empty:
-                            # Add explanation of the combined metrics
-                            st.info("""
-                            **Chú thích**
-                            - **Citations**: Số lần được làm nguồn trích dẫn trong AI Overviews
-                            - **Mentions**: Số lần được AI Overviews brand mention
-                            """)
-
-                            # Display key metrics
-                            col1, col2, col3, col4 = st.columns(4)
-                            with col1:
-                                total_citations = competitors_df['cited_count'].sum()
-                                st.metric("Tổng số trích dẫn", total_citations)
-                            with col2:
-                                total_mentions = competitors_df['mentioned'].sum()
-                                st.metric("Tổng số Brand Mention", total_mentions)
-                            with col3:
-                                avg_citation_rate = competitors_df['prompt_cited_rate'].mean()
-                                st.metric("Tỉ lệ trích dẫn trung bình", f"{avg_citation_rate:.1%}")
-                            with col4:
-                                avg_mention_rate = competitors_df['mention_rate'].mean()
-                                st.metric("Tỉ lệ Brand Mention trung bình", f"{avg_mention_rate:.1%}")
-
-                            # Create visualization
-                            st.subheader("Biểu đồ trực quan hóa danh sách thương hiệu được trích nguồn và mention trên AI Overviews")
-
-                            # Prepare data for visualization
-                            viz_df = competitors_df.copy()
-                            viz_df['total_engagement'] = viz_df['cited_count'] + viz_df['mentioned']
-
-                            # Find user's brand and separate it
-                            user_brand_row = viz_df[viz_df['brand'].str.lower() == brand_name.lower()]
-                            other_brands = viz_df[viz_df['brand'].str.lower() != brand_name.lower()]
-
-                            # Take top 15 other brands for readability
-                            other_brands_top = other_brands.head(15)
-
-                            # Combine user brand (at top) with other top brands
-                            if not user_brand_row.empty:
-                                chart_data = pd.concat([user_brand_row, other_brands_top]).reset_index(drop=True)
-                                # Add star to user brand name for extra visibility
-                                chart_data.loc[0, 'brand'] = f"{chart_data.loc[0, 'brand']}"
+                        if tab1.open:
+                            st.subheader("Kết quả của phân tích trên từng từ khóa")
+                            if keywords_df is not None and not keywords_df.empty:
+                                # Show only readable format
+                                display_df = keywords_df.drop(columns=['aio_references']) if 'aio_references' in keywords_df.columns else keywords_df
+                                if 'aio_references_display' in display_df.columns:
+                                    display_df = display_df.rename(columns={'aio_references_display': 'aio_references'})
+
+                                show_table(display_df, "keywords", "keyword", list_columns=['mentioned_brands'])
+
+                                # Download buttons, the nested references go to their own long table (one row per citation)
+                                download_table("Tải file", lambda: keywords_df.drop(columns=['aio_references']), result_key, "keywords", "keywords_analysis")
+                                download_table("Tải danh sách trích dẫn", lambda: referencesTable(prepared), result_key, "references", "aio_references")
                             else:
-                                chart_data = other_brands_top
-
-                            # Create colors: highlight user brand
-                            colors = []
-                            for brand in chart_data['brand']:
-                                if brand.lower() == brand_name.lower():
-                                    colors.append('#FF6B6B')  # Red for user brand
-                                else:
-                                    colors.append('#4ECDC4')  # Teal for competitors
-
-                            # Create colors for highlighting user brand
-                            citation_colors = []
-                            mention_colors = []
-                            text_colors = []
-
-                            for brand in chart_data['brand']:
-                                if brand.lower() == brand_name.lower():
-                                    # Your brand - bright, distinctive colors
-                                    citation_colors.append('#FFD700')  # Gold for citations
-                                    mention_colors.append('#FF6B35')   # Orange for mentions
-                                    text_colors.append('black')
-                                else:
-                                    # Competitors - muted colors
-                                    citation_colors.append('#87CEEB')  # Light blue
-                                    mention_colors.append('#F08080')  # Light coral
-                                    text_colors.append('white')
-
-                            # Create horizontal bar chart
-                            fig = go.Figure()
-
-                            # Add bars for mentions with individual colors (first, so they appear below)
-                            fig.add_trace(go.Bar(
-                                name='Mentions',
-                                y=chart_data['brand'],
-                                x=chart_data['mentioned'],
-                                orientation='h',
-                                marker_color=mention_colors,
-                                marker_line=dict(
-                                    color=['#CC5500' if brand.lower() == brand_name.lower() else '#E57373'
-                                           for brand in chart_data['brand']],
-                                    width=[3 if brand.lower() == brand_name.lower() else 1
-                                           for brand in chart_data['brand']]
-                                ),
-                                text=chart_data['mentioned'],
-                                textposition='auto',
-                                textfont=dict(
-                                    color=['black' if brand.lower() == brand_name.lower() else 'white'
-                                           for brand in chart_data['brand']],
-                                    size=[14 if brand.lower() == brand_name.lower() else 12
-                                          for brand in chart_data['brand']]
-                                )
-                            ))
-
-                            # Add bars for citations with individual colors (second, so they appear above)
-                            fig.add_trace(go.Bar(
-                                name='Citations',
-                                y=chart_data['brand'],
-                                x=chart_data['cited_count'],
-                                orientation='h',
-                                marker_color=citation_colors,
-                                marker_line=dict(
-                                    color=['#B8860B' if brand.lower() == brand_name.lower() else '#5DADE2'
-                                           for brand in chart_data['brand']],
-                                    width=[3 if brand.lower() == brand_name.lower() else 1
-                                           for brand in chart_data['brand']]
-                                ),
-                                text=chart_data['cited_count'],
-                                textposition='auto',
-                                textfont=dict(
-                                    color=['black' if brand.lower() == brand_name.lower() else 'white'
-                                           for brand in chart_data['brand']],
-                                    size=[14 if brand.lower() == brand_name.lower() else 12
-                                          for brand in chart_data['brand']]
-                                )
-                            ))
-
-                            # Update layout
-                            fig.update_layout(
-                                title=f"Competitor Citations vs Mentions (Your Brand: {brand_name})",
-                                xaxis_title="Count",
-                                yaxis_title="Brands",
-                                barmode='group',
-                                height=max(400, len(chart_data) * 40),
-                                showlegend=True,
-                                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                                yaxis=dict(
-                                    tickfont=dict(size=12),
-                                    categoryorder='array',
-                                    categoryarray=list(reversed(chart_data['brand']))
-                                )
-                            )
+                                st.warning("Không có data từ khóa")
 
-                            # Highlight user brand with different styling
-                            if not user_brand_row.empty:
-                                user_brand_index = chart_data[chart_data['brand'].str.lower() == brand_name.lower()].index[0]
-                                fig.add_shape(
-                                    type="rect",
-                                    x0=-max(chart_data['cited_count'].max(), chart_data['mentioned'].max()) * 0.05,
-                                    y0=user_brand_index - 0.4,
-                                    x1=max(chart_data['cited_count'].max(), chart_data['mentioned'].max()) * 1.05,
-                                    y1=user_brand_index + 0.4,
-                                    line=dict(color="#FFD700", width=3),
-                                    fillcolor="rgba(255, 215, 0, 0.1)"
-                                )
-
-                            st.plotly_chart(fig, use_container_width=True)
-
-                            # Chart interpretation
-                            if not user_brand_row.empty:
-                                user_citations = user_brand_row['cited_count'].iloc[0]
-                                user_mentions = user_brand_row['mentioned'].iloc[0]
-                                user_rank = competitors_df[competitors_df['brand'].str.lower() == brand_name.lower()].index[0] + 1
-
-                                st.info(f"""
-                                **Your Brand Performance:**
-                                - **{brand_name}** ranks #{user_rank} overall among all competitors
-                                - Citations: {user_citations} | Mentions: {user_mentions}
-                                - Your brand is highlighted in gold in the chart above
+                    with tab2:
+                        if tab2.open:
+                            st.subheader("Kết quả phân tích đối thủ cạnh tranh tổng quan")
+                            if competitors_df is not None and not competitors_df.empty:
+                                # Add explanation of the combined metrics
+                                st.info("""
+                                **Chú thích**
+                                - **Citations**: Số lần được làm nguồn trích dẫn trong AI Overviews
+                                - **Mentions**: Số lần được AI Overviews brand mention
                                 """)
 
-                            # Display the comprehensive dataframe
-                            st.subheader("Detailed Data Table")
-                            st.dataframe(competitors_df, use_container_width=True)
-
-                            # Download button
-                            csv_competitors = competitors_df.to_csv(index=False)
-                            st.download_button(
-                                label="Download Comprehensive Competitor Analysis CSV",
-                                data=csv_competitors,
-                                file_name="comprehensive_competitor_analysis.csv",
-                                mime="text/csv",
-                                key="download_competitors"
-                            )
-                        else:
-                            st.warning("No competitor data available")
+                                # Display key metrics
+                                col1, col2, col3, col4 = st.columns(4)
+                                with col1:
+                                    total_citations = competitors_df['cited_count'].sum()
+                                    st.metric("Tổng số trích dẫn", total_citations)
+                                with col2:
+                                    total_mentions = competitors_df['mentioned'].sum()
+                                    st.metric("Tổng số Brand Mention", total_mentions)
+                                with col3:
+                                    avg_citation_rate = competitors_df['prompt_cited_rate'].mean()
+                                    st.metric("Tỉ lệ trích dẫn trung bình", f"{avg_citation_rate:.1%}")
+                                with col4:
+                                    avg_mention_rate = competitors_df['mention_rate'].mean()
+                                    st.metric("Tỉ lệ Brand Mention trung bình", f"{avg_mention_rate:.1%}")
+
+                                # Create visualization
+                                st.subheader("Biểu đồ trực quan hóa danh sách thương hiệu được trích nguồn và mention trên AI Overviews")
+                                st.plotly_chart(competitor_figure(result_key, brand_name, competitors_df), use_container_width=True)
+
+                                # Chart interpretation
+                                user_brand_row = competitors_df[competitors_df['brand'].str.lower() == brand_name.lower()]
+                                if not user_brand_row.empty:
+                                    user_citations = user_brand_row['cited_count'].iloc[0]
+                                    user_mentions = user_brand_row['mentioned'].iloc[0]
+                                    user_rank = user_brand_row.index[0] + 1
+
+                                    st.info(f"""
+                                    **Your Brand Performance:**
+                                    - **{brand_name}** ranks #{user_rank} overall among all competitors
+                                    - Citations: {user_citations} | Mentions: {user_mentions}
+                                    - Your brand is highlighted in gold in the chart above
+                                    """)
+
+                                # Display the comprehensive dataframe
+                                st.subheader("Detailed Data Table")
+                                show_table(competitors_df, "competitors", "brand", list_columns=['unique_domains'])
+
+                                # Download button
+                                download_table("Download Comprehensive Competitor Analysis", competitors_df, result_key, "competitors", "comprehensive_competitor_analysis")
+                            else:
+                                st.warning("No competitor data available")
 
                     # Summary download - all files in one
                     st.subheader("Download toàn bộ file")
@@ -361,49 +663,17 @@ if dataframe is not None:
                     with col1:
                         # Create a summary of all results
                         if all(df is not None and not df.empty for df in [keywords_df, competitors_df]):
-                            # Calculate summary stats
-                            total_citations = competitors_df['cited_count'].sum()
-                            total_mentions = competitors_df['mentioned'].sum()
-                            top_competitor = competitors_df.iloc[0] if not competitors_df.empty else None
-
-                            # Create formatted strings for rates
-                            citation_rate = f"{top_competitor['prompt_cited_rate']:.1%}" if top_competitor is not None else 'N/A'
-                            mention_rate = f"{top_competitor['mention_rate']:.1%}" if top_competitor is not None else 'N/A'
-
-                            # Combine summary stats
-                            summary_text = f"""
-AI Overviews Analysis Summary
-Brand: {brand_name} ({brand_domain})
-====================================
-
-Keywords Analyzed: {result.get('keywords_analyzed', 0)}
-AI Overviews Found: {result.get('ai_overviews_found', 0)}
-Competitors Identified: {result.get('competitors_identified', 0)}
-
-Total Citations Across All Competitors: {total_citations}
-Total Mentions Across All Competitors: {total_mentions}
-
-Top Competitor by Total Engagement:
-{top_competitor['brand'] if top_competitor is not None else 'No data'}
-- Citations: {top_competitor['cited_count'] if top_competitor is not None else 'N/A'}
-- Mentions: {top_competitor['mentioned'] if top_competitor is not None else 'N/A'}
-- Citation Rate: {citation_rate}
-- Mention Rate: {mention_rate}
-
-Top 5 Competitors Summary:
-{competitors_df[['brand', 'cited_count', 'mentioned', 'prompt_cited_rate', 'mention_rate']].head().to_string(index=False) if not competitors_df.empty else 'No data'}
-                            """
-
                             st.download_button(
                                 label="Tải xuống",
-                                data=summary_text,
+                                data=lambda: analysis_summary(result_key, brand_name, brand_domain, result),
                                 file_name="analysis_summary.txt",
                                 mime="text/plain",
+                                on_click="ignore",
                                 key="download_summary"
                             )
 
                 else:
-                    st.warning("Analysis completed but no results were generated. Check the error messages above.")
+                    show_problem(result)
 
             except Exception as e:
                 st.error(f"Unexpected error during analysis: {str(e)}")
@@ -427,6 +697,7 @@ with st.sidebar:
 
     **Step 3:** Phân tích kết quả
     - Điền tên thương hiệu và domain
+    - Chế độ **Nhiều brand**: mỗi dòng 1 brand (tên brand, domain), tất cả được phân tích trong 1 lần
     - Tạo các bảng phân tích chi tiết
 
     ---------
@@ -444,6 +715,9 @@ with st.sidebar:
 
     st.header("Các file tải về")
     st.markdown("""
-    - `keywords.csv`: Kết quả phân tích từ khóa
-    - `competitor.csv`: Kết quả phân tích đối thủ
+    - `keywords_analysis`: Kết quả phân tích từ khóa
+    - `aio_references`: Danh sách trích dẫn, mỗi dòng 1 nguồn của 1 từ khóa (từ khóa, thứ hạng, nguồn, domain, url)
+    - `comprehensive_competitor_analysis`: Kết quả phân tích đối thủ
+    - `brands_summary`, `brands_rank_matrix`: Kết quả chế độ nhiều brand
+    - Định dạng CSV, CSV nén (.csv.gz) hoặc Parquet, chọn ở trên
     """)
\ No newline at end of file
@@ -0,0 +1,253 @@
+# Benchmark suite: times analysis, ingest and fetch stages on seeded synthetic DataForSEO data and writes the results as JSON
+#
+#   python benchmark.py                                  # 1k / 10k / 50k / 100k keywords
+#   python benchmark.py --scales 1000 --output bench.json --skip-fetch
+#   python benchmark.py --scales 100000 --skip-fetch --workers 1 2 4 8     # prepareAnalysis over more worker processes
+#   python benchmark.py --scales 1000 --latency 0.5 --latency-distribution lognormal --error-rate 0.05 --max-connections 30   # fetch under load
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import functions.fetchKeywords as fetch_module
+from functions.aggregateState import createState, updateState
+from functions.analyzeBrands import analyzeBrands
+from functions.analyzeDataFrame import analyzeDataFrame
+from functions.compactReferences import memoryUsage, referenceLists
+from functions.extractColumns import ITEM_TYPES, extractColumns
+from functions.loadAPI import loadAPI
+from functions.mentionScanner import buildMentionScanner
+from functions.mockServer import LATENCY_DISTRIBUTIONS, serverStats, startMockServer
+from functions.prepareAnalysis import prepareAnalysis
+from functions.resultStore import extractRecord, writeResultStore
+from functions.streamRecords import streamRecords
+from functions.syntheticSerp import AIO_RATE, MARKDOWN_WORDS, REFERENCES_PER_OVERVIEW, VOCABULARY_SIZE, competitorVocabulary, syntheticSerp
+
+# configure default scales, analysis worker processes, competitor names in the large-vocabulary stages and the most keywords sent through the mock server per fetch stage
+SCALES = [1000, 10000, 50000, 100000]
+WORKER_COUNTS = [1, 2, 4]
+SCANNER_NAMES = 10000
+FETCH_LIMIT = 10000
+
+
+def _timed(results, scale, group, stage, rows, function, *args, **kwargs):
+    # run one stage, record its wall time and throughput
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    results.append({
+        'scale': scale,
+        'group': group,
+        'stage': stage,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None
+    })
+    print(f"{scale:>8}  {group:<9} {stage:<34} {rows:>8} rows  {seconds:>9.3f}s")
+    return value
+
+
+def _write_inputs(records, directory):
+    # the three file layouts the app ingests: fetchKeywords' to_json, the NDJSON checkpoint, and a gzipped checkpoint
+    paths = {
+        'json': os.path.join(directory, 'api-result.json'),
+        'ndjson': os.path.join(directory, 'api-result.ndjson'),
+        'ndjson.gz': os.path.join(directory, 'api-result.ndjson.gz')
+    }
+    pd.DataFrame([[record] for record in records]).to_json(paths['json'])
+    lines = [json.dumps({'key': str(i), 'keyword': record['keyword'], 'result': [record]}, ensure_ascii=False) + '\n' for i, record in enumerate(records)]
+    with open(paths['ndjson'], 'w', encoding='utf-8') as file:
+        file.writelines(lines)
+    with gzip.open(paths['ndjson.gz'], 'wt', encoding='utf-8') as file:
+        file.writelines(lines)
+    return paths
+
+
+def _list_memory(lists):
+    # bytes of the old aio_references column: the lists, their {'rank', 'domain', 'source', 'url'} dicts and the values
+    total = 0
+    for refs in lists:
+        total += sys.getsizeof(refs)
+        for ref in refs or ():
+            total += sys.getsizeof(ref) + sum(sys.getsizeof(value) for value in ref.values())
+    return total
+
+
+def _memory(results, scale, stage, rows, size):
+    results.append({'scale': scale, 'group': 'memory', 'stage': stage, 'rows': rows, 'bytes': size})
+    print(f"{scale:>8}  {'memory':<9} {stage:<34} {rows:>8} rows  {size / 2 ** 20:>8.1f}MB")
+
+
+def _extract_loop(records):
+    # the per-record extraction prepareAnalysis used before extractColumns: one extractRecord call and list appends per reference
+    keywords, ref_record, ref_rank, ref_domain, ref_source, ref_url = [], [], [], [], [], []
+    for position, record in enumerate(records):
+        keyword, _, _, has_aio, markdown, refs = extractRecord(record)
+        keywords.append(keyword)
+        for rank, ref in enumerate(refs, start=1):
+            ref_record.append(position)
+            ref_rank.append(rank)
+            ref_domain.append(ref.get('domain', ''))
+            ref_source.append(ref.get('source', ''))
+            ref_url.append(ref.get('url', ''))
+    return keywords, ref_record
+
+
+def benchmarkScale(scale, options, results, fetch_limit=FETCH_LIMIT, skip_fetch=False, workdir='.', worker_counts=WORKER_COUNTS, scanner_names=SCANNER_NAMES):
+    seed = options['seed']
+    shape = {key: options[key] for key in ('aio_rate', 'references_per_overview', 'vocabulary_size', 'markdown_words')}
+    records = _timed(results, scale, 'generate', 'syntheticSerp', scale, syntheticSerp, scale, seed=seed, **shape)
+
+    # INGEST
+    paths = _write_inputs(records, workdir)
+    for layout, path in paths.items():
+        _timed(results, scale, 'ingest', f"streamRecords[{layout}]", scale, lambda: sum(1 for _ in streamRecords(path)))
+    _timed(results, scale, 'ingest', 'loadAPI[json]', scale, loadAPI, paths['json'])
+    store = _timed(results, scale, 'ingest', 'writeResultStore[ndjson]', scale, writeResultStore, streamRecords(paths['ndjson']), os.path.join(workdir, 'store'))
+
+    # EXTRACTION of keywords, overviews and references out of the raw records, plus organic / featured snippet items
+    _timed(results, scale, 'extract', 'extractRecord[loop]', scale, _extract_loop, records)
+    _timed(results, scale, 'extract', 'extractColumns', scale, extractColumns, records)
+    _timed(results, scale, 'extract', f"extractColumns[{', '.join(ITEM_TYPES)}]", scale, extractColumns, records, ITEM_TYPES)
+    _timed(results, scale, 'extract', 'writeResultStore[records, items]', scale, writeResultStore, records, os.path.join(workdir, 'items-store'), ITEM_TYPES)
+
+    # ANALYSIS
+    ## brands are taken from the generator's vocabulary, the most cited ones first
+    brands = [(name, domain) for name, domain in competitorVocabulary(options['vocabulary_size'], seed)[:10]]
+    prepared = _timed(results, scale, 'analysis', 'prepareAnalysis[records]', scale, prepareAnalysis, pd.DataFrame({'raw_data': records}), workers=1, profile=True)
+    ## per-stage breakdown from the pipeline's own instrumentation
+    for stage in prepared['profile']:
+        results.append({
+            'scale': scale,
+            'group': 'stage',
+            'stage': f"prepareAnalysis.{stage['stage']}",
+            'rows': stage['rows'],
+            'seconds': stage['seconds'],
+            'rows_per_second': round(stage['rows'] / stage['seconds'], 1) if stage['seconds'] else None
+        })
+    ## the clean / scan / citation pass sharded over each pool size, the output is the same for all of them
+    for workers in worker_counts:
+        prepared = _timed(results, scale, 'analysis', f"prepareAnalysis[store, workers={workers}]", scale, prepareAnalysis, store, workers=workers)
+    ## references held by the prepared dataset against the list-of-dict column they replaced
+    references = prepared['references']
+    _memory(results, scale, 'references[compact]', len(references['row']), memoryUsage(references))
+    _memory(results, scale, 'references[list of dicts]', len(references['row']), _list_memory(referenceLists(references)))
+    _timed(results, scale, 'analysis', 'analyzeDataFrame[brand]', scale, analyzeDataFrame, None, brands[0][0], brands[0][1], prepared=prepared)
+    _timed(results, scale, 'analysis', f"analyzeBrands[{len(brands)} brands]", scale, analyzeBrands, None, brands, prepared=prepared)
+
+    batch = max(1, scale // 100)
+    state = _timed(results, scale, 'analysis', 'updateState[all]', scale - batch, updateState, createState(), records[:-batch])
+    _timed(results, scale, 'analysis', 'updateState[+1%]', batch, updateState, state, records[-batch:])
+    ## a batch from another vocabulary seed, most of its cited names are new and are looked up in the earlier overviews
+    new_names = syntheticSerp(batch, seed=seed + 1, **shape)
+    _timed(results, scale, 'analysis', 'updateState[+1%, new names]', batch, updateState, state, new_names)
+
+    # LARGE VOCABULARY: real competitor lists run to thousands of names, the matcher is built by every worker and state update
+    vocabulary = [name for name, _ in competitorVocabulary(scanner_names, seed)]
+    scan = _timed(results, scale, 'vocabulary', f"buildMentionScanner[{scanner_names} names]", scanner_names, buildMentionScanner, vocabulary)
+    markdowns = prepared['aio_markdown']
+    _timed(results, scale, 'vocabulary', f"scan[{scanner_names} names]", len(markdowns), lambda: [scan(md) for md in markdowns])
+    del records, prepared, state, new_names, markdowns
+
+    # FETCH against the local mock server, no cache and no rate limit so only client overhead and latency count
+    if skip_fetch:
+        return
+    keywords = [f"benchmark keyword {i}" for i in range(min(scale, fetch_limit))]
+    server, mock_url = startMockServer(latency=options['latency'], seed=seed, **options['faults'], **shape)
+    url, headers = fetch_module.url, fetch_module.headers
+    fetch_module.url, fetch_module.headers = mock_url, {'Authorization': 'Basic bW9jazptb2Nr', 'Content-Type': 'application/json'}
+
+    ## every fetch stage also records its failed keywords and what the server saw: requests by outcome and latency percentiles
+    def fetch_stage(stage, **kwargs):
+        serverStats(server, reset=True)
+        summary = _timed(results, scale, 'fetch', stage, len(keywords), fetch_module.fetchKeywords, keywords, 2704, 'vi', use_cache=False,
+                         rate_limit=10 ** 6, checkpoint_file=os.path.join(workdir, 'fetch.ndjson'), load_result=False, **kwargs)
+        results[-1].update(failed=len(summary['failed']), server=serverStats(server))
+
+    try:
+        for engine, batch_size in (('threads', 1), ('async', 1), ('async', 100)):
+            fetch_stage(f"fetchKeywords[{engine}, batch {batch_size}]", engine=engine, batch_size=batch_size)
+        fetch_stage("fetchKeywords[queued]", backend='queued', poll_interval=0.1)
+    finally:
+        fetch_module.url, fetch_module.headers = url, headers
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the AI overview pipeline on synthetic DataForSEO data')
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help='keyword counts to run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--aio-rate', type=float, default=AIO_RATE, help='share of keywords with an AI overview')
+    parser.add_argument('--references', type=int, default=REFERENCES_PER_OVERVIEW, help='average references per overview')
+    parser.add_argument('--vocabulary', type=int, default=VOCABULARY_SIZE, help='number of distinct competitors')
+    parser.add_argument('--markdown-words', type=int, default=MARKDOWN_WORDS, help='words per overview markdown')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock server latency in seconds (mean for random distributions)')
+    parser.add_argument('--latency-distribution', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of mock requests answered with 429')
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help='share of mock requests answered with 500/502/503')
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help='share of mock responses cut off half way')
+    parser.add_argument('--max-connections', type=int, help='mock requests at once before it answers 429')
+    parser.add_argument('--fetch-limit', type=int, default=FETCH_LIMIT, help='most keywords fetched per fetch stage')
+    parser.add_argument('--workers', type=int, nargs='+', default=WORKER_COUNTS, help='analysis worker processes to time prepareAnalysis with')
+    parser.add_argument('--scanner-names', type=int, default=SCANNER_NAMES, help='competitor names in the large-vocabulary mention stages')
+    parser.add_argument('--skip-fetch', action='store_true')
+    parser.add_argument('--output', default='benchmark-results.json')
+    args = parser.parse_args()
+
+    options = {
+        'seed': args.seed,
+        'aio_rate': args.aio_rate,
+        'references_per_overview': args.references,
+        'vocabulary_size': args.vocabulary,
+        'markdown_words': args.markdown_words,
+        'latency': args.latency,
+        'faults': {
+            'latency_distribution': args.latency_distribution,
+            'error_rate': args.error_rate,
+            'server_error_rate': args.server_error_rate,
+            'truncate_rate': args.truncate_rate,
+            'max_connections': args.max_connections
+        }
+    }
+    results = []
+    output = os.path.abspath(args.output)
+
+    # everything the stages write (input files, store, checkpoints) goes to a throwaway directory
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for scale in args.scales:
+                benchmarkScale(scale, options, results, fetch_limit=args.fetch_limit, skip_fetch=args.skip_fetch, workdir=workdir, worker_counts=args.workers, scanner_names=args.scanner_names)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'options': options,
+            'fetch_limit': args.fetch_limit,
+            'worker_counts': args.workers,
+            'scanner_names': args.scanner_names
+        },
+        'results': results
+    }
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
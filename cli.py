@@ -0,0 +1,218 @@
+# Headless batch runner: fetch -> analyze -> export for a keyword file, without Streamlit (cron jobs, worker containers)
+#
+#   python cli.py keywords.txt --location 2704 --language vi --brand SEONGON --domain seongon.com
+#   python cli.py keywords.txt --location 2704 --language vi --brands brands.txt --format csv.gz parquet --output-dir nightly
+#   python cli.py --input api-result.ndjson --brand SEONGON --domain seongon.com     # analyze an existing result file, no fetch
+#   python cli.py --input all-markets.ndjson --location 2704 --language vi --brand SEONGON --domain seongon.com   # only that market of the file
+#   python cli.py --input api-result.ndjson --brand SEONGON --domain seongon.com --items organic featured_snippet   # + organic rank columns
+#   python cli.py keywords.txt --location 2704 --language vi --brand SEONGON --domain seongon.com --project weekly   # + diff with last week
+#   python cli.py keywords-batch-3.txt --location 2704 --language vi --state project.state.gz   # + competitor totals over every batch so far
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from functions.aggregateState import createState, loadState, saveState, stateResults, updateState
+from functions.analyzeBrands import analyzeBrands
+from functions.analyzeDataFrame import analyzeDataFrame
+from functions.exportResults import FORMATS, exportTable, referencesTable
+from functions.extractColumns import ITEM_TYPES
+from functions.fetchKeywords import BACKENDS, BATCH_SIZE, MAX_IN_FLIGHT, fetchKeywords
+from functions.pipelineProfile import PROFILE
+from functions.prepareAnalysis import WORKERS, prepareAnalysis
+from functions.resultStore import writeResultStore
+from functions.snapshotStore import SNAPSHOT_FILE, aioChanges, brandRankMovement, citationShareChange, previousRun, saveSnapshot
+from functions.streamRecords import checkpointRecords, streamRecords
+
+# configure how many failed keywords are listed in the summary (all of them are counted)
+FAILED_LISTED = 100
+
+
+def readKeywords(path):
+    # one keyword per line or comma separated, like the app's text area, duplicates are kept
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        return [k.strip() for k in file.read().replace('\n', ',').split(',') if k.strip()]
+
+
+def readBrands(path):
+    # one "brand name, domain" pair per line
+    brands = []
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        for line in file:
+            name, _, domain = line.partition(',')
+            if name.strip() and domain.strip():
+                brands.append((name.strip(), domain.strip()))
+    return brands
+
+
+def _export(df, path, formats):
+    # one file per format, written in chunks: list columns stay lists in Parquet and are written as JSON in CSV
+    return [exportTable(df, path + FORMATS[format][0], format) for format in formats]
+
+
+def _timed(timings, step, function, *args, **kwargs):
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    timings[step] = round(time.perf_counter() - start, 3)
+    print(f"{step:<10} {timings[step]:>9.2f}s", file=sys.stderr)
+    return value
+
+
+def run(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    timings = {}
+    summary = {
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'status': 'success',
+        'input': {
+            'keywords_file': args.keywords_file,
+            'input': args.input,
+            'location_code': args.location,
+            'language_code': args.language
+        },
+        'timings': timings,
+        'outputs': []
+    }
+    output = lambda name: os.path.join(args.output_dir, name)
+
+    # FETCH into an NDJSON checkpoint in the output directory (rerun with --resume after a crash)
+    if args.input:
+        read_records = lambda: streamRecords(args.input, item_types=args.items)
+    else:
+        if not (args.keywords_file and args.location and args.language):
+            raise SystemExit("keywords_file, --location and --language are required unless --input is given")
+        keywords = readKeywords(args.keywords_file)
+        checkpoint_file = output('api-result.ndjson')
+
+        def progress(completed, total, cached=0):
+            if completed == total or completed % 1000 == 0:
+                print(f"fetched {completed}/{total} ({cached} from cache/checkpoint)", file=sys.stderr)
+
+        fetched = _timed(timings, 'fetch', fetchKeywords, keywords, args.location, args.language, progress_callback=progress,
+                         engine=args.engine, backend=args.backend, max_in_flight=args.max_in_flight, batch_size=args.batch_size, use_cache=not args.no_cache,
+                         checkpoint_file=checkpoint_file, resume=args.resume, load_result=False, profile=args.profile)
+        summary['fetch'] = {
+            'keywords': len(keywords),
+            'cache': fetched['cache'],
+            'failed_count': len(fetched['failed']),
+            'failed': fetched['failed'][:FAILED_LISTED],
+            'checkpoint_file': checkpoint_file,
+            'profile': fetched['profile']
+        }
+        read_records = lambda: checkpointRecords(checkpoint_file, keywords, args.items)
+
+    # ANALYZE from the columnar store, the raw JSON is never held in memory as a whole
+    store = _timed(timings, 'store', writeResultStore, read_records(), output('api-result-store'), args.items)
+    ## an --input file can hold several markets, --location/--language pick one of them (a fetch only has its own)
+    filters = {'location_code': args.location, 'language_code': args.language} if args.input else {}
+    prepared = _timed(timings, 'prepare', prepareAnalysis, store, workers=args.workers, profile=args.profile, **filters)
+    summary['prepare_profile'] = prepared.get('profile')
+    if prepared['status'] != 'success':
+        summary['status'] = prepared['status']
+        summary['message'] = prepared['message']
+        print(prepared['message'], file=sys.stderr)
+    else:
+        summary['keywords_analyzed'] = prepared['keywords_analyzed']
+        summary['ai_overviews_found'] = prepared['ai_overviews_found']
+        summary['competitors_identified'] = prepared['competitors_identified']
+
+        if args.brand and args.domain:
+            result = _timed(timings, 'brand', analyzeDataFrame, None, args.brand, args.domain, prepared=prepared, profile=args.profile)
+            keywords_df = result['keywords_df']
+            brand_rank = keywords_df[f"{args.brand}_rank"]
+            summary['brand'] = {
+                'name': args.brand,
+                'domain': args.domain,
+                'cited_keywords': int(brand_rank.notna().sum()),
+                'average_rank': float(brand_rank.mean()) if brand_rank.notna().any() else None,
+                'prompt_cited_rate': float(brand_rank.notna().sum() / prepared['ai_overviews_found'])
+            }
+        else:
+            keywords_df = prepared['keywords_df']
+        competitors_df = prepared['competitors_df']
+        summary['top_competitors'] = competitors_df[['brand', 'cited_count', 'mentioned', 'prompt_cited_rate', 'mention_rate']].head(10).to_dict('records')
+
+        ## the nested references go to their own long table, one row per keyword and citation
+        summary['outputs'] += _timed(timings, 'export', lambda: _export(keywords_df.drop(columns=['aio_references']), output('keywords_analysis'), args.format)
+                                     + _export(referencesTable(prepared), output('aio_references'), args.format)
+                                     + _export(competitors_df, output('competitor_analysis'), args.format))
+
+        if args.brands:
+            result = _timed(timings, 'brands', analyzeBrands, None, readBrands(args.brands), prepared=prepared)
+            summary['brands'] = result['brands_df'].to_dict('records')
+            summary['outputs'] += _export(result['brands_df'], output('brands_summary'), args.format)
+            summary['outputs'] += _export(result['rank_matrix'], output('brands_rank_matrix'), args.format)
+
+        # SNAPSHOT the run and compare it with the previous run of the project (same location and language)
+        if args.project:
+            run_id = _timed(timings, 'snapshot', saveSnapshot, prepared, args.project, args.run_date, args.location, args.language, path=args.snapshot_file)
+            previous = previousRun(run_id, path=args.snapshot_file)
+            summary['snapshot'] = {'project': args.project, 'run_id': run_id, 'previous_run_id': previous}
+            if previous is not None:
+                shares = citationShareChange(previous, run_id, path=args.snapshot_file)
+                aio = aioChanges(previous, run_id, path=args.snapshot_file)
+                summary['snapshot']['aio_gained'] = int((aio['change'] == 'gained').sum())
+                summary['snapshot']['aio_lost'] = int((aio['change'] == 'lost').sum())
+                summary['snapshot']['top_share_gains'] = shares.head(5)[['competitor', 'share_change']].to_dict('records')
+                summary['snapshot']['top_share_losses'] = shares.tail(5).iloc[::-1][['competitor', 'share_change']].to_dict('records')
+                summary['outputs'] += _export(shares, output('citation_share_change'), args.format)
+                summary['outputs'] += _export(aio, output('aio_changes'), args.format)
+                if args.brand and args.domain:
+                    movement = brandRankMovement(previous, run_id, args.brand, args.domain, path=args.snapshot_file)
+                    summary['snapshot']['brand_rank_movement'] = movement['status'].value_counts().to_dict()
+                    summary['outputs'] += _export(movement, output('brand_rank_movement'), args.format)
+
+        # PROJECT STATE: add this run to the saved aggregate, refetched keywords replace their previous results
+        if args.state:
+            state = loadState(args.state) if os.path.exists(args.state) else createState()
+            _timed(timings, 'state', updateState, state, read_records(), replace=True)
+            saveState(state, args.state)
+            project = stateResults(state)
+            summary['state'] = {
+                'file': args.state,
+                'keywords_analyzed': project['keywords_analyzed'],
+                'ai_overviews_found': project['ai_overviews_found'],
+                'competitors_identified': project['competitors_identified'],
+                'top_competitors': project['competitors_df'][['brand', 'cited_count', 'mentioned', 'prompt_cited_rate', 'mention_rate']].head(10).to_dict('records')
+            }
+            summary['outputs'] += _export(project['competitors_df'], output('project_competitors'), args.format)
+
+    summary['finished'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with open(output('summary.json'), 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2, ensure_ascii=False, default=str)
+    print(f"Summary written to {output('summary.json')}", file=sys.stderr)
+    return 1 if summary['status'] == 'error' else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch, analyze and export AI overview data without the Streamlit app')
+    parser.add_argument('keywords_file', nargs='?', help='keywords, one per line or comma separated')
+    parser.add_argument('--location', help='DataForSEO location code, e.g. 2704 (with --input: only analyze this location)')
+    parser.add_argument('--language', help='DataForSEO language code, e.g. vi (with --input: only analyze this language)')
+    parser.add_argument('--brand', help='brand name for the brand rank column')
+    parser.add_argument('--domain', help='brand domain')
+    parser.add_argument('--brands', help='file with one "brand name, domain" per line for the multi-brand summary')
+    parser.add_argument('--input', help='analyze an existing result file (json/ndjson, .gz/.zst) instead of fetching')
+    parser.add_argument('--output-dir', default='output')
+    parser.add_argument('--format', nargs='+', choices=list(FORMATS), default=['csv'])
+    parser.add_argument('--engine', choices=['threads', 'async'], default='async')
+    parser.add_argument('--backend', choices=BACKENDS, default='live', help='queued posts tasks in bulk and collects them when ready (cheaper, slower)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='keywords per POST')
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument('--resume', action='store_true', help='skip keywords already in the output directory checkpoint')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the SERP cache')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='analysis worker processes')
+    parser.add_argument('--items', nargs='+', choices=ITEM_TYPES, default=[], help='also keep these SERP items for the brand organic rank / featured snippet columns')
+    parser.add_argument('--project', help='save the run as a snapshot of this project and compare it with its previous run')
+    parser.add_argument('--run-date', help='snapshot date, YYYY-MM-DD (today by default)')
+    parser.add_argument('--snapshot-file', default=SNAPSHOT_FILE)
+    parser.add_argument('--state', help='gzip JSON aggregate state of the project, created if missing, updated with this run')
+    parser.add_argument('--profile', action='store_true', default=PROFILE, help='add per-stage time and memory to the summary')
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# This module keeps the competitor metrics as a mergeable aggregate state, so keyword batches can be added, removed or replaced without a full recompute
+
+import gzip
+import json
+import pandas as pd
+from functions.mentionScanner import buildMentionScanner
+from functions.prepareAnalysis import clean_markdown_citations
+from functions.resultStore import extractRecord
+
+
+def createState():
+    return {
+        ## input rows seen so far, the row number of an overview is its position (same order as a full run)
+        'rows': 0,
+        ## keyword -> number of input rows, duplicates count for mentions like in the keywords table
+        'keywords': {},
+        ## keyword -> its first overview: position, cleaned markdown and references as [source, domain, rank]
+        ## the markdown is kept because a name first cited by a later batch still counts mentions in earlier overviews
+        'overviews': {},
+        ## source name -> cited_count, rank_sum, cited_in_prompts, mentioned, domains [[domain, count, position, rank], ...]
+        'competitors': {},
+        ## references + overviews without references (the cited_probability denominator)
+        'citation_rows': 0
+    }
+
+
+def _cite(state, overview, sign):
+    """
+    - Add (sign=1) or subtract (sign=-1) the citations of one overview
+    - Returns the names whose first citation was removed, their domain order has to be refreshed
+    """
+    competitors = state['competitors']
+    state['citation_rows'] += sign * (len(overview['references']) or 1)
+    stale = set()
+    cited = set()
+
+    for source, domain, rank in overview['references']:
+        if not isinstance(source, str) or source == '':
+            continue
+        entry = competitors.setdefault(source, {'cited_count': 0, 'rank_sum': 0, 'cited_in_prompts': 0, 'mentioned': 0, 'domains': []})
+        entry['cited_count'] += sign
+        entry['rank_sum'] += sign * rank
+        if source not in cited:
+            cited.add(source)
+            entry['cited_in_prompts'] += sign
+
+        slot = next((slot for slot in entry['domains'] if slot[0] == domain), None)
+        if slot is None:
+            entry['domains'].append([domain, sign, overview['position'], rank])
+            continue
+        slot[1] += sign
+        if sign > 0 and (overview['position'], rank) < (slot[2], slot[3]):
+            slot[2], slot[3] = overview['position'], rank
+        elif sign < 0 and slot[2] == overview['position']:
+            stale.add(source)
+
+    for source in cited:
+        if competitors[source]['cited_count'] == 0:
+            del competitors[source]
+            stale.discard(source)
+        else:
+            competitors[source]['domains'] = [slot for slot in competitors[source]['domains'] if slot[1] > 0]
+    return stale
+
+
+def _refresh_first(state, names):
+    # first citation of each domain of these names, from the remaining overviews in position order
+    if not names:
+        return
+    firsts = {}
+    for overview in sorted(state['overviews'].values(), key=lambda overview: overview['position']):
+        for source, domain, rank in overview['references']:
+            if source in names and (source, domain) not in firsts:
+                firsts[(source, domain)] = (overview['position'], rank)
+    for name in names:
+        for slot in state['competitors'].get(name, {'domains': []})['domains']:
+            slot[2], slot[3] = firsts[(name, slot[0])]
+
+
+def _scanner(state):
+    # the matcher over every competitor name, kept on the state (not saved) and rebuilt only when a name it doesn't know is cited
+    cached = state.get('_scanner')
+    if cached is None or not cached[0].issuperset(state['competitors']):
+        names = set(state['competitors'])
+        cached = state['_scanner'] = (names, buildMentionScanner(names))
+    return cached[1]
+
+
+def _mention(state, keywords, rows, new_names=(), new_rows=None, scan=None):
+    """
+    - Scan the overview of each keyword once and add rows[keyword] to the mention count of every competitor found in it
+    - Names in new_names get new_rows[keyword] instead (their earlier mentions were never counted)
+    - scan: a matcher over fewer names, the kept full-vocabulary one by default
+    """
+    scan = scan or _scanner(state)
+    competitors = state['competitors']
+    for keyword in keywords:
+        overview = state['overviews'].get(keyword)
+        if overview is None or not (rows.get(keyword) or new_names):
+            continue
+        for name in scan(overview['markdown']):
+            ## the kept matcher can still know names whose last citation was removed
+            if name not in competitors:
+                continue
+            count = new_rows[keyword] if name in new_names else rows.get(keyword, 0)
+            competitors[name]['mentioned'] += count
+
+
+def _add(state, rows):
+    """
+    - Append rows given as (keyword, overview or None) in input order, overview positions are assigned here
+    - The overviews of this batch's keywords are scanned once with the kept full-vocabulary matcher (see _scanner), O(batch)
+    - Competitors first cited by these rows must also be counted in every earlier overview: such a batch rebuilds the kept
+      matcher and rescans all other stored overviews with a matcher over just the new names, O(project) (a word index
+      over the overviews was tried: building it cost more than the scans it saved and doubled the state)
+    """
+    names_before = set(state['competitors'])
+    added_rows = {}
+    new_overviews = []
+    for keyword, overview in rows:
+        position = state['rows']
+        state['rows'] += 1
+        added_rows[keyword] = added_rows.get(keyword, 0) + 1
+
+        # Only the first overview of a keyword counts
+        if overview is not None and keyword not in state['overviews']:
+            overview = dict(overview, position=position)
+            state['overviews'][keyword] = overview
+            new_overviews.append(keyword)
+            _cite(state, overview, 1)
+
+    for keyword, count in added_rows.items():
+        state['keywords'][keyword] = state['keywords'].get(keyword, 0) + count
+
+    ## mentions: the added rows of known overviews, all rows of new overviews, all rows of every overview for new names
+    rows = {keyword: count for keyword, count in added_rows.items() if keyword in state['overviews']}
+    rows.update((keyword, state['keywords'][keyword]) for keyword in new_overviews)
+    new_names = {name for name in state['competitors'] if name not in names_before}
+    _mention(state, rows, rows, new_names, state['keywords'])
+    earlier = [keyword for keyword in state['overviews'] if keyword not in rows] if new_names else []
+    if earlier:
+        _mention(state, earlier, {}, new_names, state['keywords'], buildMentionScanner(new_names))
+    return state
+
+
+def updateState(state, records, replace=False):
+    """
+    - Add a batch of raw SERP records, work is proportional to the batch when every name it cites is already in the state
+    - A batch citing new names also rescans every stored overview and rebuilds the name matcher (see _add)
+    - replace=True first removes every keyword of the batch, so refetched keywords replace their old results
+    """
+    rows = []
+    for record in records:
+        keyword, _, _, has_aio, markdown, refs = extractRecord(record)
+        overview = None
+        if has_aio:
+            overview = {
+                'markdown': clean_markdown_citations(markdown) if markdown else None,
+                'references': [[ref.get('source', ''), ref.get('domain', ''), rank] for rank, ref in enumerate(refs, start=1)]
+            }
+        rows.append((keyword, overview))
+
+    if replace:
+        removeKeywords(state, [keyword for keyword, _ in rows])
+    return _add(state, rows)
+
+
+def removeKeywords(state, keywords):
+    # subtract every row of these keywords (their mentions first, while all names are still known)
+    removed = [keyword for keyword in dict.fromkeys(keywords) if keyword in state['keywords']]
+    _mention(state, removed, {keyword: -state['keywords'][keyword] for keyword in removed})
+
+    stale = set()
+    for keyword in removed:
+        del state['keywords'][keyword]
+        overview = state['overviews'].pop(keyword, None)
+        if overview is not None:
+            stale |= _cite(state, overview, -1)
+    _refresh_first(state, {name for name in stale if name in state['competitors']})
+    return state
+
+
+def mergeStates(state, other):
+    """
+    - Append another state as if its input rows came after this one's (a keyword in both keeps this state's overview)
+    - Cost is proportional to the other state, plus a rescan of this state's overviews when the other cites names this one doesn't
+    """
+    ## only overview order and row counts matter: overviews in position order, plain rows for the remaining count
+    rows = [(keyword, overview) for keyword, overview in sorted(other['overviews'].items(), key=lambda item: item[1]['position'])]
+    for keyword, count in other['keywords'].items():
+        rows.extend([(keyword, None)] * (count - (keyword in other['overviews'])))
+    return _add(state, rows)
+
+
+def stateResults(state):
+    """
+    - Competitor table and totals from the aggregate state, same values and order as prepareAnalysis on all rows
+    """
+    if not state['overviews']:
+        return None
+    n_aio = len(state['overviews'])
+    competitors = state['competitors']
+
+    ## first-seen order of names and of their domains, like the grouped pass over all references
+    names = sorted(competitors, key=lambda name: min((slot[2], slot[3]) for slot in competitors[name]['domains']))
+    brand_list_df = pd.DataFrame({
+        'brand': names,
+        'cited_count': [competitors[name]['cited_count'] for name in names],
+        'unique_domains': [[slot[0] for slot in sorted(competitors[name]['domains'], key=lambda slot: (slot[2], slot[3]))] for name in names],
+        'average_rank': [competitors[name]['rank_sum'] / competitors[name]['cited_count'] for name in names],
+        'cited_in_prompts': [competitors[name]['cited_in_prompts'] for name in names],
+        'mentioned': [competitors[name]['mentioned'] for name in names]
+    })
+    brand_list_df['cited_probability'] = brand_list_df['cited_count'] / state['citation_rows']
+    brand_list_df['prompt_cited_rate'] = brand_list_df['cited_in_prompts'] / n_aio
+    brand_list_df['mention_rate'] = brand_list_df['mentioned'] / n_aio
+    brand_list_df = brand_list_df.sort_values(by='cited_count', ascending=False).reset_index(drop=True)
+
+    # Same column order and engagement sort as the full analysis
+    column_order = [
+        'brand', 'cited_count', 'mentioned', 'unique_domains',
+        'average_rank', 'cited_probability', 'cited_in_prompts',
+        'prompt_cited_rate', 'mention_rate'
+    ]
+    competitors_df = brand_list_df[column_order]
+    competitors_df['total_engagement'] = competitors_df['cited_count'] + competitors_df['mentioned']
+    competitors_df = competitors_df.sort_values('total_engagement', ascending=False).drop(columns=['total_engagement']).reset_index(drop=True)
+
+    return {
+        'competitors_df': competitors_df,
+        'keywords_analyzed': sum(state['keywords'].values()),
+        'ai_overviews_found': n_aio,
+        'competitors_identified': len(brand_list_df)
+    }
+
+
+def saveState(state, path):
+    # gzip JSON, the state only holds plain dicts, lists, strings and numbers (the kept matcher is rebuilt after loading)
+    with gzip.open(path, 'wt', encoding='utf-8') as file:
+        json.dump({key: value for key, value in state.items() if key != '_scanner'}, file, ensure_ascii=False)
+
+
+def loadState(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        return json.load(file)
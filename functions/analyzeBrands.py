@@ -0,0 +1,89 @@
+# This function analyzes a list of client brands against the same keyword set in one pass over references and markdown
+
+import numpy as np
+import pandas as pd
+from functions.mentionScanner import buildMentionScanner
+from functions.prepareAnalysis import WORKERS, prepareAnalysis
+from functions.registrableDomain import matchDomain
+
+
+def analyzeBrands(dataframe, brands, prepared=None, workers=WORKERS, location_code=None, language_code=None):
+    """
+    - brands: list of (brand_name, brand_domain) pairs, same matching rules as analyzeDataFrame for each of them
+    - Returns a keyword x brand rank matrix and one summary row per brand (citations, mentions, share of voice)
+    """
+    if prepared is None:
+        prepared = prepareAnalysis(dataframe, workers=workers, location_code=location_code, language_code=language_code)
+    ## errors and 'no_data' from preparing the dataset are passed on as they are
+    if prepared['status'] != 'success':
+        return prepared
+
+    ## later duplicates of a brand name are ignored
+    unique_brands = {}
+    for name, domain in brands:
+        if name and name not in unique_brands:
+            unique_brands[name] = (name, domain)
+    brands = list(unique_brands.values())
+    names = [name for name, _ in brands]
+    references = prepared['references']
+    n_aio = prepared['ai_overviews_found']
+
+    # GET BRAND CITATION RANKING
+    ## distinct domain/source x brand hit tables, the extra last row is for missing values (code -1)
+    domain_hits = np.zeros((len(prepared['domain_index']['codes']) + 1, len(brands)), dtype=bool)
+    for column, (_, domain) in enumerate(brands):
+        domain_hits[:-1, column] = matchDomain(prepared['domain_index'], domain)
+    source_hits = np.array([[name in key for name, _ in brands] for key in prepared['source_keys']] + [[False] * len(brands)], dtype=bool).reshape(-1, len(brands))
+    hits = domain_hits[references['domain'].codes] | source_hits[references['source'].codes]
+
+    ## references are in rank order, so the first match of a brand in an overview is its lowest rank
+    ref_index, brand_index = np.nonzero(hits)
+    aio_rank = np.full((n_aio, len(brands)), np.inf)
+    np.minimum.at(aio_rank, (references['row'][ref_index], brand_index), references['rank'][ref_index])
+    aio_rank[np.isinf(aio_rank)] = np.nan
+    citations = np.bincount(brand_index, minlength=len(brands))
+
+    ## keywords without AI overview (row -1) get NaN
+    aio_rows = prepared['aio_rows']
+    keyword_rank = np.where((aio_rows >= 0)[:, None], aio_rank[np.maximum(aio_rows, 0)], np.nan)
+    rank_matrix = pd.DataFrame(keyword_rank, columns=names)
+    rank_matrix.insert(0, 'keyword', prepared['keywords_df']['keyword'].to_numpy())
+
+
+    # BRAND MENTIONS
+    ## one scan per overview for all brands, counted per keyword row like the competitor mentions
+    scan_mentions = buildMentionScanner(names)
+    aio_mentions = np.zeros((n_aio, len(brands)), dtype=bool)
+    column = {name: i for i, name in enumerate(names)}
+    for row, markdown in enumerate(prepared['aio_markdown']):
+        for name in scan_mentions(markdown):
+            aio_mentions[row, column[name]] = True
+    mentioned = aio_mentions[aio_rows[aio_rows >= 0]].sum(axis=0)
+
+
+    # BRAND SUMMARY
+    summary = pd.DataFrame({
+        'brand': names,
+        'domain': [domain for _, domain in brands],
+        'cited_count': citations,
+        'cited_in_prompts': np.sum(~np.isnan(aio_rank), axis=0),
+        'average_rank': pd.DataFrame(aio_rank).mean().to_numpy(),
+        'mentioned': mentioned
+    })
+    summary['prompt_cited_rate'] = summary['cited_in_prompts'] / n_aio
+    summary['mention_rate'] = summary['mentioned'] / n_aio
+    summary['citation_share'] = summary['cited_count'] / max(len(references['row']), 1)
+
+    ## share of voice among the analyzed brands, on citations + mentions like the competitor chart
+    engagement = summary['cited_count'] + summary['mentioned']
+    summary['share_of_voice'] = engagement / engagement.sum() if engagement.sum() else 0.0
+    summary = summary.sort_values('share_of_voice', ascending=False, kind='stable').reset_index(drop=True)
+
+    return {
+        'status': 'success',
+        'rank_matrix': rank_matrix,
+        'brands_df': summary,
+        'keywords_analyzed': prepared['keywords_analyzed'],
+        'ai_overviews_found': n_aio,
+        'brands_analyzed': len(brands)
+    }
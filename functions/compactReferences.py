@@ -0,0 +1,60 @@
+# This function packs AI overview references into flat integer-coded arrays shared by every downstream metric
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+def categorical(values):
+    # strings are dictionary-encoded by Arrow (compiled, categories in first-seen order like a result store read), categoricals pass through
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        return pd.Categorical(values)
+    encoded = pa.array(values, type=pa.string(), from_pandas=True).dictionary_encode()
+    ## missing values get code -1, categories go through a plain Index (much faster than DictionaryArray.to_pandas on large dictionaries)
+    return pd.Categorical.from_codes(encoded.indices.fill_null(-1).to_numpy(), categories=pd.Index(encoded.dictionary.to_pandas()))
+
+
+def compactReferences(row, rank, domain, source, url, n_rows):
+    """
+    - row: keyword row of every reference (contiguous per row, in rank order), n_rows: number of keyword rows
+    - Returns int64 offsets per row, int32 row ids, int8 rank and dictionary-encoded (categorical) domain/source/url
+    """
+    row = np.asarray(row, dtype=np.int32)
+    rank = np.asarray(rank, dtype=np.int64)
+
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row, minlength=n_rows), out=offsets[1:])
+
+    return {
+        'offsets': offsets,
+        'row': row,
+        # ranks above 127 only happen on unusually long reference lists
+        'rank': rank.astype(np.int8 if rank.size == 0 or rank.max() <= np.iinfo(np.int8).max else np.int16),
+        'domain': categorical(domain),
+        'source': categorical(source),
+        'url': categorical(url)
+    }
+
+
+def referenceLists(references):
+    # rebuild [{'rank', 'domain', 'source', 'url'}, ...] per row (None when empty), only for display and download
+    offsets = references['offsets']
+    ranks = references['rank'].tolist()
+    columns = [np.asarray(references[name], dtype=object) for name in ('domain', 'source', 'url')]
+    domains, sources, urls = [np.where(pd.isna(column), None, column).tolist() for column in columns]
+
+    lists = []
+    for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        lists.append([
+            {'rank': ranks[i], 'domain': domains[i], 'source': sources[i], 'url': urls[i]}
+            for i in range(start, end)
+        ] or None)
+    return lists
+
+
+def memoryUsage(references):
+    # bytes held by the compact arrays (category dictionaries included)
+    total = 0
+    for value in references.values():
+        total += value.memory_usage(deep=True) if isinstance(value, pd.Categorical) else value.nbytes
+    return total
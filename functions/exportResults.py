@@ -0,0 +1,130 @@
+# This module writes result tables to CSV, gzipped CSV or Parquet chunk by chunk, caches every export on disk by result hash, and flattens AI overview references into a long table
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# configure where exports are cached, how many results keep their exports, and rows written per chunk
+EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+MAX_CACHED_RESULTS = 20
+CHUNK_ROWS = 50000
+
+# configure gzip level of csv.gz exports (6 writes about 1.5x faster than 9 for ~5% larger files)
+GZIP_LEVEL = 6
+
+# file extension and mime type of every export format
+FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet')
+}
+
+
+def referencesTable(prepared):
+    """
+    - One row per keyword and AI overview reference: keyword, rank, source, domain, url (keywords table order)
+    - Taken straight from prepareAnalysis' compact arrays, source/domain/url stay categorical
+    """
+    references = prepared['references']
+    offsets = references['offsets']
+    aio_rows = prepared['aio_rows']
+
+    ## the reference range of every keyword row, laid end to end
+    has_aio = aio_rows >= 0
+    starts = np.where(has_aio, offsets[np.where(has_aio, aio_rows, 0)], 0)
+    counts = np.where(has_aio, offsets[np.where(has_aio, aio_rows, 0) + 1] - starts, 0)
+    total = int(counts.sum())
+    keyword_index = np.repeat(np.arange(len(aio_rows)), counts)
+    reference_index = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+
+    return pd.DataFrame({
+        'keyword': prepared['keywords_df']['keyword'].to_numpy()[keyword_index],
+        'rank': references['rank'][reference_index],
+        'source': references['source'].take(reference_index),
+        'domain': references['domain'].take(reference_index),
+        'url': references['url'].take(reference_index)
+    })
+
+
+def _text_cells(chunk):
+    # list and dict cells are written as JSON instead of Python reprs
+    chunk = chunk.copy()
+    for column in chunk.columns[chunk.dtypes == object]:
+        chunk[column] = chunk[column].map(lambda value: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value)
+    return chunk
+
+
+def _plain_cells(chunk):
+    # categoricals are written as their values, Parquet dictionary-encodes each row group itself (the full categories per chunk would not)
+    categorical = [column for column in chunk.columns if isinstance(chunk[column].dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return chunk
+    return chunk.assign(**{column: np.asarray(chunk[column], dtype=object) for column in categorical})
+
+
+def _arrow_schema(df):
+    # every column's type comes from its first non-null values, so a chunk that starts with empty rows doesn't pin it to null
+    import pyarrow as pa
+
+    fields = []
+    for column in df.columns:
+        values = _plain_cells(df[[column]].dropna().head(1000))
+        field = pa.Schema.from_pandas(values, preserve_index=False).field(0)
+        fields.append(field.with_type(pa.string()) if field.type == pa.null() else field)
+    return pa.schema(fields)
+
+
+def exportTable(df, path, format='csv', chunk_rows=CHUNK_ROWS):
+    """
+    - Write df to path as 'csv', 'csv.gz' or 'parquet', chunk_rows rows at a time so no full-size copy is built
+    - CSV gets list/dict cells as JSON, Parquet keeps them as lists (one row group per chunk), returns path
+    """
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    chunks = range(0, max(len(df), 1), chunk_rows)
+
+    if format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = _arrow_schema(df)
+        with pq.ParquetWriter(path, schema) as writer:
+            for start in chunks:
+                writer.write_table(pa.Table.from_pandas(_plain_cells(df.iloc[start:start + chunk_rows]), schema=schema, preserve_index=False))
+        return path
+
+    with (gzip.open(path, 'wt', compresslevel=GZIP_LEVEL, encoding='utf-8', newline='') if format == 'csv.gz' else open(path, 'w', encoding='utf-8', newline='')) as file:
+        for start in chunks:
+            _text_cells(df.iloc[start:start + chunk_rows]).to_csv(file, header=start == 0, index=False)
+    return path
+
+
+def resultHash(*parts):
+    # short stable hash of whatever identifies a result (dataset hash, analysis parameters, ...)
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def exportFile(df, result_hash, name, format='csv', directory=EXPORT_DIR):
+    """
+    - Path of name's export for result_hash, written on the first request only (df may be a callable building the table)
+    - Files are written under a temporary name and renamed, exports of the oldest results beyond MAX_CACHED_RESULTS are removed
+    """
+    result_dir = os.path.join(directory, result_hash)
+    path = os.path.join(result_dir, name + FORMATS[format][0])
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(result_dir, exist_ok=True)
+    exportTable(df() if callable(df) else df, path + '.tmp', format)
+    os.replace(path + '.tmp', path)
+
+    ## drop the exports of the least recently written results
+    results = sorted((entry for entry in os.scandir(directory) if entry.is_dir()), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in results[MAX_CACHED_RESULTS:]:
+        if entry.name != result_hash:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return path
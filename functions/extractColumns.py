@@ -0,0 +1,103 @@
+# This function walks every SERP record's items once and fills typed column buffers: keywords, AI overview content and references, plus optional organic / featured snippet items
+
+from array import array
+import numpy as np
+
+# SERP item types that can be collected in the same pass as the AI overview
+ITEM_TYPES = ('organic', 'featured_snippet')
+
+
+def extractColumns(records, item_types=()):
+    """
+    - One pass over the records and their items, same rules as extractRecord: any '*ai_overview*' item flags the keyword,
+      the first 'ai_overview' item holds markdown and references
+    - item_types: also collect these items (type, rank_group, domain, url), e.g. for the organic rank of a brand (rank 0 = no rank_group)
+    - Returns per-record lists/arrays (keyword, location_code, language_code, has_aio, markdown) and the long
+      'references' and 'items' tables, whose 'record' column is the record position; numbers are numpy arrays
+    """
+    capture = set(item_types)
+    if not capture <= set(ITEM_TYPES):
+        raise ValueError(f"item_types must be among {', '.join(ITEM_TYPES)}")
+
+    keywords, location_codes, language_codes, markdowns = [], [], [], []
+    has_aio = bytearray()
+    ref_record, ref_rank = array('i'), array('h')
+    ref_domain, ref_source, ref_url = [], [], []
+    item_record, item_rank = array('i'), array('h')
+    item_type, item_domain, item_url = [], [], []
+
+    ## appends bound once, they run for every record and every reference of every overview
+    add_keyword, add_location, add_language, add_flag, add_markdown = (
+        keywords.append, location_codes.append, language_codes.append, has_aio.append, markdowns.append
+    )
+    add_ref_record, add_ref_rank = ref_record.append, ref_rank.append
+    add_ref_domain, add_ref_source, add_ref_url = ref_domain.append, ref_source.append, ref_url.append
+
+    for position, record in enumerate(records):
+        if not isinstance(record, dict):
+            add_keyword('Unknown')
+            add_location(None)
+            add_language(None)
+            add_flag(False)
+            add_markdown(None)
+            continue
+
+        flagged = False
+        overview = None
+        for item in record.get('items') or ():
+            if not isinstance(item, dict):
+                continue
+            kind = item.get('type')
+            if not isinstance(kind, str):
+                continue
+            if overview is None and 'ai_overview' in kind:
+                flagged = True
+                if kind == 'ai_overview':
+                    overview = item
+                    # nothing else to collect, the rest of the items can be skipped
+                    if not capture:
+                        break
+            elif kind in capture:
+                item_record.append(position)
+                item_type.append(kind)
+                item_rank.append(item.get('rank_group') or 0)
+                item_domain.append(item.get('domain'))
+                item_url.append(item.get('url'))
+
+        add_keyword(record.get('keyword', 'Unknown'))
+        add_location(record.get('location_code'))
+        add_language(record.get('language_code'))
+        add_flag(flagged)
+        if overview is None:
+            add_markdown(None)
+            continue
+        add_markdown(overview.get('markdown'))
+        for rank, ref in enumerate(overview.get('references') or (), start=1):
+            add_ref_record(position)
+            add_ref_rank(rank)
+            add_ref_domain(ref.get('domain', ''))
+            add_ref_source(ref.get('source', ''))
+            add_ref_url(ref.get('url', ''))
+
+    return {
+        'keyword': keywords,
+        'location_code': location_codes,
+        'language_code': language_codes,
+        'has_aio': np.frombuffer(has_aio, dtype=bool) if has_aio else np.zeros(0, dtype=bool),
+        'markdown': markdowns,
+        'references': {
+            'record': np.frombuffer(ref_record, dtype=np.int32) if ref_record else np.zeros(0, dtype=np.int32),
+            'rank': np.frombuffer(ref_rank, dtype=np.int16) if ref_rank else np.zeros(0, dtype=np.int16),
+            'domain': ref_domain,
+            'source': ref_source,
+            'url': ref_url
+        },
+        'items': {
+            'record': np.frombuffer(item_record, dtype=np.int32) if item_record else np.zeros(0, dtype=np.int32),
+            'type': item_type,
+            'rank': np.frombuffer(item_rank, dtype=np.int16) if item_rank else np.zeros(0, dtype=np.int16),
+            'domain': item_domain,
+            'url': item_url
+        } if capture else None,
+        'item_types': tuple(item_type for item_type in ITEM_TYPES if item_type in capture)
+    }
@@ -1,8 +1,17 @@
 import json, requests, pandas as pd
+from requests.adapters import HTTPAdapter
 from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import inspect
+import threading
+import time
 import os
+import uuid
 from dotenv import load_dotenv
 import tqdm
+from functions.serpCache import CACHE_TTL, cacheKey, readCache, writeCache
+from functions.rateLimiter import RATE_LIMIT, MAX_RETRIES, createLimiter, acquire, acquireAsync, release, backoffDelay
+from functions.pipelineProfile import PROFILE, finishProfile, markStage, startProfile
 load_dotenv()
 
 # initialize SEO API KEY
@@ -12,48 +21,484 @@ api_key = os.getenv('SEO_API_KEY')
 # configure concurrent workers
 MAX_WORKERS = 50
 
-# configure dataforseo API endpoint
-url = "https://api.dataforseo.com/v3/serp/google/organic/live/advanced"
+# configure async engine: requests in flight over one keep-alive connection pool
+MAX_IN_FLIGHT = 50
+
+# configure keywords packed into one POST (1 = one task per request)
+BATCH_SIZE = 1
+
+# configure seconds before a request is abandoned (live SERP calls can take close to a minute)
+REQUEST_TIMEOUT = 120
+
+# dataforseo status code of a successful task, and the codes worth retrying (rate/concurrency limits, internal errors)
+STATUS_OK = 20000
+TRANSIENT_STATUS = {40202, 40209, 50000, 50301}
+
+# queued backend: status of a task accepted by task_post, statuses of a task not finished yet ('Task Handed', 'Task In Queue')
+STATUS_CREATED = 20100
+TASK_PENDING_STATUS = {40601, 40602}
+
+# configure the queued backend: tasks per task_post call (the API takes up to 100), seconds between tasks_ready polls,
+# and how long to wait without any task becoming ready before the remaining ones are reported as failed
+TASK_POST_SIZE = 100
+POLL_INTERVAL = 5
+QUEUE_TIMEOUT = 3600
+
+# configure the fetch backends: 'live' answers every request with its results, 'queued' posts tasks and collects them once ready
+BACKENDS = ('live', 'queued')
+
+# configure the line-delimited checkpoint results are streamed to (one file per run unless a path is given), and how many results go to the cache per write
+CHECKPOINT_FILE = 'api-result-{run_id}.ndjson'
+CACHE_FLUSH_SIZE = 500
+
+# configure dataforseo API endpoint (the queued endpoints sit next to it, see _queued_endpoints), SEO_API_URL points it elsewhere (e.g. the mock server)
+url = os.getenv('SEO_API_URL', "https://api.dataforseo.com/v3/serp/google/organic/live/advanced")
 headers = {
     'Authorization': api_key,
     'Content-Type': 'application/json'
 }
 
-def fetchKeywords(keywords, location_code, language_code, progress_callback=None):
-    # fetch raw results
-    def dataforseo(keyword):
-        payload = json.dumps([{
+def fetchKeywords(keywords, location_code, language_code, progress_callback=None, engine='threads', max_in_flight=MAX_IN_FLIGHT, batch_size=BATCH_SIZE, use_cache=True, cache_ttl=CACHE_TTL, rate_limit=RATE_LIMIT, checkpoint_file=None, resume=False, load_result=True, profile=PROFILE, limiter=None, backend='live', poll_interval=POLL_INTERVAL):
+    # checkpoint_file: by default a new CHECKPOINT_FILE per run (returned in the summary), resume=True needs the path of the run to resume;
+    #   with load_result the default one is deleted once the results are loaded, otherwise the caller owns the file
+    # load_result=True returns every result as a DataFrame (and writes api-result.json), so the whole run is held in memory;
+    #   only load_result=False (the app's job queue, the CLI) keeps memory bounded by the in-flight window
+    # progress_callback(completed, total), callbacks taking a 'cached' argument also get cached=<keywords from cache/checkpoint>
+    # profile=True records time, rows and peak memory per stage in attrs['profile'] (or summary['profile'] without load_result)
+    # limiter: a createLimiter() shared with other runs, so they stay within one concurrency and rate budget
+    # backend='queued' posts TASK_POST_SIZE tasks per call and downloads them as tasks_ready lists them (always on the async engine)
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    keep_checkpoint = checkpoint_file is not None or not load_result
+    if checkpoint_file is None:
+        if resume:
+            raise ValueError("resume=True needs the checkpoint_file of the run to resume")
+        checkpoint_file = CHECKPOINT_FILE.format(run_id=f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    profile = startProfile(profile)
+    try:
+        return _fetch_keywords(keywords, location_code, language_code, progress_callback, engine, max_in_flight, batch_size, use_cache, cache_ttl, rate_limit, checkpoint_file, resume, load_result, profile, limiter, backend, poll_interval, keep_checkpoint)
+    finally:
+        finishProfile(profile)
+
+
+def _fetch_keywords(keywords, location_code, language_code, progress_callback, engine, max_in_flight, batch_size, use_cache, cache_ttl, rate_limit, checkpoint_file, resume, load_result, profile, limiter, backend, poll_interval, keep_checkpoint=True):
+    # build the task sent for each keyword
+    def task(keyword):
+        return {
             "keyword": keyword,
             "location_code": location_code,
             "language_code": language_code,
             "depth": 10,
             "group_organic_results": True,
             "load_async_ai_overview": True
-        }])
+        }
 
-        response = requests.request("POST", url, headers=headers, data=payload)
-        return response.text
+    keys = [cacheKey(keyword, task(keyword)) for keyword in keywords]
 
-    # get relevant information from raw results
-    def process_keyword(keyword):
-        data = dataforseo(keyword)
-        data = json.loads(data)
+    # every finished result is appended to the checkpoint right away, nothing accumulates in memory
+    done_keys = _prepare_checkpoint(checkpoint_file) if resume else set()
+    checkpoint = open(checkpoint_file, 'a' if resume else 'w', encoding='utf-8')
+    lock = threading.Lock()
+    pending_cache = {}
+    ## cache writes (zlib + SQLite) run one at a time on their own thread, never under the lock or on the event loop
+    cache_writer = ThreadPoolExecutor(max_workers=1)
+    cache_writes = []
 
-        return data['tasks'][0]['result']
+    def store(position, keyword, result, from_cache=False):
+        flush = None
+        with lock:
+            checkpoint.write(json.dumps({'key': keys[position], 'keyword': keyword, 'result': result}, ensure_ascii=False) + '\n')
+            checkpoint.flush()
+            done_keys.add(keys[position])
+            if use_cache and not from_cache:
+                pending_cache[keys[position]] = result
+                if len(pending_cache) >= CACHE_FLUSH_SIZE:
+                    flush = dict(pending_cache)
+                    pending_cache.clear()
+        if flush:
+            cache_writes.append(cache_writer.submit(writeCache, flush))
 
-    # create json file and download
-    api_data = []
-    completed = 0
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
-        for result in ex.map(process_keyword, keywords):
-            api_data.append(result)
-            completed += 1
-            if progress_callback:
-                progress_callback(completed, len(keywords))
+    # keywords already in the checkpoint are skipped, then fresh cached ones are served locally (read in chunks)
+    resumed_count = sum(1 for key in keys if key in done_keys)
+    todo = [(position, keyword) for position, keyword in enumerate(keywords) if keys[position] not in done_keys]
+    missing = []
+    cached_count = 0
+    for i in range(0, len(todo), CACHE_FLUSH_SIZE):
+        chunk = todo[i:i + CACHE_FLUSH_SIZE]
+        cached = readCache([keys[position] for position, _ in chunk], ttl=cache_ttl) if use_cache else {}
+        for position, keyword in chunk:
+            if keys[position] in done_keys:
+                continue
+            if keys[position] in cached:
+                store(position, keyword, cached[keys[position]], from_cache=True)
+                cached_count += 1
+            else:
+                # duplicate keywords are fetched once
+                done_keys.add(keys[position])
+                missing.append((position, keyword))
+    skipped_count = len(keywords) - len(missing)
+    markStage(profile, 'checkpoint_and_cache_lookup', len(keywords))
+
+    takes_cached = _takes_cached(progress_callback)
+
+    def report(completed):
+        if takes_cached:
+            progress_callback(skipped_count + completed, len(keywords), cached=skipped_count)
+        elif progress_callback:
+            progress_callback(skipped_count + completed, len(keywords))
+
+    if skipped_count:
+        report(0)
+
+    # pack keywords into batches of (position, keyword), one POST per batch
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+
+    # fetch raw results, transient failures are retried and permanent ones collected in failed
+    failed = []
+    try:
+        if backend == 'queued':
+            limiter = limiter or createLimiter(max_in_flight, rate=rate_limit)
+            asyncio.run(_fetch_queued(missing, task, store, failed, report, limiter, poll_interval))
+        elif engine == 'async':
+            limiter = limiter or createLimiter(max_in_flight, rate=rate_limit)
+            asyncio.run(_fetch_async(batches, task, store, failed, report, limiter))
+        else:
+            limiter = limiter or createLimiter(MAX_WORKERS, rate=rate_limit)
+            _fetch_threads(batches, task, store, failed, report, limiter)
+    finally:
+        checkpoint.close()
+        if pending_cache:
+            cache_writes.append(cache_writer.submit(writeCache, dict(pending_cache)))
+        cache_writer.shutdown(wait=True)
+    ## a failed cache write fails the run, like it did when it was written inline
+    for write in cache_writes:
+        write.result()
+    markStage(profile, 'fetch', len(missing))
+
+    summary = {
+        'checkpoint_file': checkpoint_file,
+        'failed': failed,
+        'cache': {'cached': cached_count, 'resumed': resumed_count, 'fetched': len(missing) - len(failed)},
+        'profile': profile['stages'] if profile else None
+    }
+    if not load_result:
+        return summary
+
+    # rebuild the keyword-ordered data from the checkpoint, failed keywords are left out
+    results = {entry['key']: entry['result'] for entry in _read_checkpoint(checkpoint_file)}
+    api_data = [results[key] for key in keys if key in results]
 
     ## save file
     api_dataframe = pd.DataFrame(api_data)
     file_name = 'api-result.json'
     api_dataframe.to_json(file_name)
+    markStage(profile, 'load_result', len(api_dataframe))
+
+    ## a per-run checkpoint nobody asked for is not left behind once its results are loaded
+    if not keep_checkpoint:
+        os.remove(checkpoint_file)
+        checkpoint_file = None
+    api_dataframe.attrs['checkpoint_file'] = checkpoint_file
+    api_dataframe.attrs['failed'] = summary['failed']
+    api_dataframe.attrs['cache'] = summary['cache']
+    api_dataframe.attrs['profile'] = summary['profile']
+    return api_dataframe
+
+
+def _takes_cached(callback):
+    # callback(completed, total) callbacks keep working, only those with a 'cached' parameter (or **kwargs) get the count
+    if callback is None:
+        return False
+    try:
+        parameters = inspect.signature(callback).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(parameter.name == 'cached' or parameter.kind == parameter.VAR_KEYWORD for parameter in parameters)
+
+
+def _read_checkpoint(path):
+    # one {'key', 'keyword', 'result'} object per line, a torn last line is ignored
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def _prepare_checkpoint(path):
+    # drop a partially written last line, then return the keys already fetched
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb+') as file:
+        content_end = file.seek(0, os.SEEK_END)
+        while content_end > 0:
+            file.seek(content_end - 1)
+            if file.read(1) == b'\n':
+                break
+            content_end -= 1
+        file.truncate(content_end)
+    return {entry['key'] for entry in _read_checkpoint(path)}
+
+
+def _payload(batch, task):
+    # the tag carries the keyword position so every task can be matched back to its keyword
+    return json.dumps([dict(task(keyword), tag=str(position)) for position, keyword in batch])
+
+
+def _retry_after(response_headers):
+    try:
+        return float(response_headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _transient(status_code):
+    # None = connection error, timeout or truncated body
+    return status_code is None or status_code == 429 or 500 <= status_code < 600 or status_code in TRANSIENT_STATUS
+
+
+def _demultiplex(data, batch, store):
+    # route data['tasks'][i]['result'] back to its keyword, one bad task doesn't fail the others
+    tasks = data.get('tasks') or []
+    tasks_by_tag = {str((t.get('data') or {}).get('tag')): t for t in tasks}
+
+    errors = []
+    for i, (position, keyword) in enumerate(batch):
+        task = tasks_by_tag.get(str(position))
+        if task is None and len(tasks) == len(batch):
+            # no tag echoed back, tasks come back in the posted order
+            task = tasks[i]
+
+        if task is None:
+            errors.append({'position': position, 'keyword': keyword, 'status_code': data.get('status_code'), 'status_message': data.get('status_message', 'Task missing from response')})
+        elif task.get('status_code') != STATUS_OK:
+            errors.append({'position': position, 'keyword': keyword, 'status_code': task.get('status_code'), 'status_message': task.get('status_message')})
+        else:
+            store(position, keyword, task['result'])
+    return errors
+
+
+def _settle(batch, status, body, retry_after, attempt, limiter, store, failed):
+    """
+    - Release the limiter slot, backing off on 429, 5xx, timeouts and rate-limit codes
+    - Store finished tasks, record permanent failures and return the entries worth another attempt
+    """
+    data = None
+    if status == 200:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            status, body = None, 'Malformed response body'
+
+    if isinstance(data, dict) and data.get('status_code') not in TRANSIENT_STATUS:
+        errors = _demultiplex(data, batch, store)
+    else:
+        status_code = data.get('status_code') if isinstance(data, dict) else status
+        message = data.get('status_message') if isinstance(data, dict) else (body if status is None else f"HTTP {status}")
+        errors = [{'position': position, 'keyword': keyword, 'status_code': status_code, 'status_message': message} for position, keyword in batch]
+
+    release(limiter, backoff=any(_transient(error['status_code']) for error in errors), retry_after=retry_after)
+
+    retry = []
+    for error in errors:
+        if _transient(error['status_code']) and attempt < MAX_RETRIES:
+            retry.append((error['position'], error['keyword']))
+        else:
+            failed.append(dict(error, attempts=attempt + 1))
+    return retry
+
+
+def _fetch_threads(batches, task, store, failed, report, limiter):
+    # one session shared by all workers so connections are reused instead of a new TCP+TLS handshake per keyword
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=MAX_WORKERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    def dataforseo(batch):
+        payload = _payload(batch, task)
+        try:
+            response = session.post(url, headers=headers, data=payload, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            return None, str(e), None
+        return response.status_code, response.text, _retry_after(response.headers)
+
+    # get relevant information from raw results, retrying transient failures with backoff
+    def process_batch(batch):
+        size = len(batch)
+        attempt = 0
+        while batch:
+            acquire(limiter)
+            status, body, retry_after = dataforseo(batch)
+            batch = _settle(batch, status, body, retry_after, attempt, limiter, store, failed)
+            if batch:
+                time.sleep(backoffDelay(attempt, retry_after))
+                attempt += 1
+        return size
+
+    completed = 0
+    with session, ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        for batch_completed in ex.map(process_batch, batches):
+            completed += batch_completed
+            report(completed)
+
+
+async def _fetch_async(batches, task, store, failed, report, limiter):
+    # aiohttp is only needed for this engine
+    import aiohttp
+
+    pending = iter(batches)
+    completed = 0
+
+    async def dataforseo(session, batch):
+        try:
+            async with session.post(url, data=_payload(batch, task)) as response:
+                return response.status, await response.text(), _retry_after(response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            return None, str(e) or type(e).__name__, None
+
+    async def worker(session):
+        nonlocal completed
+        for batch in pending:
+            size = len(batch)
+            attempt = 0
+            while batch:
+                await acquireAsync(limiter)
+                try:
+                    status, body, retry_after = await dataforseo(session, batch)
+                except asyncio.CancelledError:
+                    # a cancelled run gives its slot back, the limiter may be shared with other runs
+                    release(limiter)
+                    raise
+                batch = _settle(batch, status, body, retry_after, attempt, limiter, store, failed)
+                if batch:
+                    await asyncio.sleep(backoffDelay(attempt, retry_after))
+                    attempt += 1
+
+            # progress is reported in completion order
+            completed += size
+            report(completed)
+
+    # aiohttp rejects unset header values (requests silently drops them)
+    connector = aiohttp.TCPConnector(limit=limiter['max_concurrency'])
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    session_headers = {key: value for key, value in headers.items() if value is not None}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=session_headers) as session:
+        workers = [asyncio.ensure_future(worker(session)) for _ in range(min(limiter['max_concurrency'], len(batches)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            ## a failed progress callback (e.g. a cancelled job) stops the other workers before the session closes
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+
+
+def _queued_endpoints():
+    # task_post, tasks_ready and task_get live next to the live endpoint, so pointing url at another server moves them too
+    base = url.rsplit('/live/', 1)[0]
+    return f"{base}/task_post", f"{base}/tasks_ready", f"{base}/task_get/advanced/{{task_id}}"
+
+
+async def _fetch_queued(missing, task, store, failed, report, limiter, poll_interval):
+    """
+    - Post the keywords as tasks in bulk, then poll tasks_ready and download every ready task of this run concurrently
+    - Ready tasks posted by other runs on the same account are left alone, results go through the same store as the live backend
+    """
+    import aiohttp
+
+    task_post_url, tasks_ready_url, task_get_url = _queued_endpoints()
+    waiting = {}
+    completed = 0
+
+    # one paced call, retried with backoff on 429, 5xx, timeouts and rate-limit codes: (data, error, attempts)
+    async def call(session, method, endpoint, payload=None):
+        attempt = 0
+        while True:
+            await acquireAsync(limiter)
+            try:
+                async with session.request(method, endpoint, data=payload) as response:
+                    status, body, retry_after = response.status, await response.text(), _retry_after(response.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                status, body, retry_after = None, str(e) or type(e).__name__, None
+            except asyncio.CancelledError:
+                release(limiter)
+                raise
+
+            data = None
+            if status == 200:
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    status, body = None, 'Malformed response body'
+            if isinstance(data, dict):
+                error = None if data.get('status_code') == STATUS_OK else {'status_code': data.get('status_code'), 'status_message': data.get('status_message')}
+            else:
+                error = {'status_code': status, 'status_message': body if status is None else f"HTTP {status}"}
+
+            transient = error is not None and (_transient(error['status_code']) if data is None else error['status_code'] in TRANSIENT_STATUS)
+            release(limiter, backoff=transient, retry_after=retry_after)
+            if not transient or attempt >= MAX_RETRIES:
+                return data, error, attempt + 1
+            await asyncio.sleep(backoffDelay(attempt, retry_after))
+            attempt += 1
+
+    def finish(position, keyword, error=None, attempts=1):
+        nonlocal completed
+        if error is not None:
+            failed.append({'position': position, 'keyword': keyword, 'status_code': error['status_code'], 'status_message': error['status_message'], 'attempts': attempts})
+        completed += 1
+        report(completed)
+
+    async def post(session, chunk):
+        data, error, attempts = await call(session, 'POST', task_post_url, _payload(chunk, task))
+        tasks_by_tag = {str((t.get('data') or {}).get('tag')): t for t in (data or {}).get('tasks') or []}
+        for position, keyword in chunk:
+            posted = tasks_by_tag.get(str(position))
+            if error is None and posted is not None and posted.get('status_code') == STATUS_CREATED:
+                waiting[posted['id']] = (position, keyword)
+            else:
+                finish(position, keyword, error or {'status_code': (posted or {}).get('status_code'), 'status_message': (posted or {}).get('status_message', 'Task missing from response')}, attempts)
+
+    async def collect(session, task_id):
+        data, error, attempts = await call(session, 'GET', task_get_url.format(task_id=task_id))
+        result = ((data or {}).get('tasks') or [{}])[0]
+        if error is None and result.get('status_code') in TASK_PENDING_STATUS:
+            # listed as ready a little early, picked up again on a later poll
+            return False
+        position, keyword = waiting.pop(task_id)
+        if error is None and result.get('status_code') == STATUS_OK:
+            store(position, keyword, result['result'])
+            finish(position, keyword)
+        else:
+            finish(position, keyword, error or {'status_code': result.get('status_code'), 'status_message': result.get('status_message')}, attempts)
+        return True
+
+    connector = aiohttp.TCPConnector(limit=limiter['max_concurrency'])
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    session_headers = {key: value for key, value in headers.items() if value is not None}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=session_headers) as session:
+        await asyncio.gather(*(post(session, missing[i:i + TASK_POST_SIZE]) for i in range(0, len(missing), TASK_POST_SIZE)))
+
+        ## poll until every posted task is collected, or nothing became ready for QUEUE_TIMEOUT seconds
+        last_ready = time.monotonic()
+        while waiting:
+            data, error, attempts = await call(session, 'GET', tasks_ready_url)
+            if error is not None:
+                for position, keyword in list(waiting.values()):
+                    finish(position, keyword, error, attempts)
+                break
+
+            ready = [item.get('id') for ready_task in data.get('tasks') or [] for item in ready_task.get('result') or []]
+            ready = list(dict.fromkeys(task_id for task_id in ready if task_id in waiting))
+            if ready and any(await asyncio.gather(*(collect(session, task_id) for task_id in ready))):
+                last_ready = time.monotonic()
+                continue
 
-    return api_dataframe
\ No newline at end of file
+            if time.monotonic() - last_ready > QUEUE_TIMEOUT:
+                for position, keyword in list(waiting.values()):
+                    finish(position, keyword, {'status_code': None, 'status_message': f"Task not ready after {QUEUE_TIMEOUT}s"})
+                break
+            await asyncio.sleep(poll_interval)
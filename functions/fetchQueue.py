@@ -0,0 +1,197 @@
+# This module runs fetch jobs in a background worker fed by a persistent SQLite queue, all jobs share one concurrency budget
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from functions.fetchKeywords import MAX_IN_FLIGHT, fetchKeywords
+from functions.rateLimiter import RATE_LIMIT, createLimiter
+from functions.resultStore import writeResultStore
+from functions.streamRecords import checkpointRecords
+
+# configure the queue file and where job checkpoints and result stores go
+QUEUE_FILE = os.getenv('FETCH_QUEUE_FILE', 'fetch-queue.sqlite')
+JOBS_DIR = os.getenv('FETCH_JOBS_DIR', 'fetch-jobs')
+
+# configure the budget shared by every job of a worker: requests in flight, requests per second, jobs running at once
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', str(MAX_IN_FLIGHT)))
+MAX_RUNNING_JOBS = 4
+
+# configure seconds between queue polls / progress writes, and after how long without a heartbeat a running job is taken over
+POLL_INTERVAL = 1
+PROGRESS_INTERVAL = 1
+STALE_AFTER = 60
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY, status TEXT, keywords TEXT, location_code TEXT, language_code TEXT, options TEXT,
+            total INTEGER, completed INTEGER DEFAULT 0, cached INTEGER DEFAULT 0,
+            created_at REAL, started_at REAL, finished_at REAL, heartbeat_at REAL,
+            checkpoint_file TEXT, store_path TEXT, summary TEXT, error TEXT
+        )
+    """)
+    connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, job_id)")
+    return connection
+
+
+def _execute(path, query, params=()):
+    with _connect(path) as connection:
+        cursor = connection.execute(query, params)
+        rows = cursor.fetchall()
+    connection.close()
+    return rows
+
+
+def submitJob(keywords, location_code, language_code, path=QUEUE_FILE, **options):
+    """
+    - Queue a fetch of keywords, options are passed to fetchKeywords (engine is always async, batch_size, use_cache, ...)
+    - item_types=[...] also writes those SERP items (organic, featured_snippet) to the job's result store
+    - Returns the job_id, the job runs when a worker (startWorker) picks it up, in submission order
+    """
+    keywords = list(keywords)
+    with _connect(path) as connection:
+        job_id = connection.execute(
+            "INSERT INTO jobs (status, keywords, location_code, language_code, options, total, created_at) VALUES ('queued', ?, ?, ?, ?, ?, ?)",
+            (json.dumps(keywords, ensure_ascii=False), str(location_code), str(language_code), json.dumps(options), len(keywords), time.time())
+        ).lastrowid
+    connection.close()
+    return job_id
+
+
+def cancelJob(job_id, path=QUEUE_FILE):
+    # a queued job is dropped right away, a running one stops at its next progress update
+    _execute(path, "UPDATE jobs SET status = 'cancelled', finished_at = COALESCE(finished_at, ?) WHERE job_id = ? AND status IN ('queued', 'running')",
+             (time.time(), job_id))
+
+
+def jobStatus(job_id, path=QUEUE_FILE):
+    """
+    - Progress of a job: status, completed/total, keywords fetched per second since it started and the estimated seconds left
+    - None for an unknown job_id
+    """
+    rows = _execute(path, "SELECT job_id, status, total, completed, cached, created_at, started_at, finished_at, store_path, summary, error FROM jobs WHERE job_id = ?", (job_id,))
+    if not rows:
+        return None
+    job_id, status, total, completed, cached, created_at, started_at, finished_at, store_path, summary, error = rows[0]
+    elapsed = ((finished_at or time.time()) - started_at) if started_at else 0
+    throughput = (completed - cached) / elapsed if elapsed > 0 else 0
+    return {
+        'job_id': job_id,
+        'status': status,
+        'total': total,
+        'completed': completed,
+        'cached': cached,
+        'progress': completed / total if total else 1.0,
+        'elapsed': elapsed,
+        'throughput': throughput,
+        'eta': (total - completed) / throughput if throughput and status == 'running' else None,
+        'created_at': created_at,
+        'store_path': store_path,
+        'summary': json.loads(summary) if summary else None,
+        'error': error
+    }
+
+
+def listJobs(limit=20, path=QUEUE_FILE):
+    # latest jobs first
+    return [jobStatus(job_id, path) for job_id, in _execute(path, "SELECT job_id FROM jobs ORDER BY job_id DESC LIMIT ?", (limit,))]
+
+
+def _claim(path):
+    # atomically move the oldest queued job (or one whose worker stopped sending heartbeats) to running
+    now = time.time()
+    rows = _execute(path, """
+        UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), heartbeat_at = ?
+        WHERE job_id = (
+            SELECT job_id FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < ?) ORDER BY job_id LIMIT 1
+        )
+        RETURNING job_id, keywords, location_code, language_code, options, checkpoint_file
+    """, (now, now, now - STALE_AFTER))
+    return rows[0] if rows else None
+
+
+def _run_job(worker, job):
+    job_id, keywords, location_code, language_code, options, checkpoint_file = job
+    path = worker['path']
+    keywords = json.loads(keywords)
+    options = json.loads(options)
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    ## a job taken over from a stopped worker continues from its checkpoint
+    resume = checkpoint_file is not None and os.path.exists(checkpoint_file)
+    checkpoint_file = os.path.join(JOBS_DIR, f"job-{job_id}.ndjson")
+    store_path = os.path.join(JOBS_DIR, f"job-{job_id}-store")
+    _execute(path, "UPDATE jobs SET checkpoint_file = ? WHERE job_id = ?", (checkpoint_file, job_id))
+
+    last_update = [0]
+
+    def progress(completed, total, cached=0):
+        now = time.monotonic()
+        if completed < total and now - last_update[0] < PROGRESS_INTERVAL:
+            return
+        last_update[0] = now
+        status = _execute(path, "UPDATE jobs SET completed = ?, cached = ?, heartbeat_at = ? WHERE job_id = ? RETURNING status",
+                          (completed, cached, time.time(), job_id))
+        if status and status[0][0] == 'cancelled':
+            raise JobCancelled()
+
+    try:
+        options.pop('engine', None)
+        item_types = options.pop('item_types', ())
+        summary = fetchKeywords(keywords, location_code, language_code, progress_callback=progress, engine='async',
+                                checkpoint_file=checkpoint_file, resume=resume, load_result=False, limiter=worker['limiter'], **options)
+        writeResultStore(checkpointRecords(checkpoint_file, keywords, item_types), store_path, item_types)
+        _execute(path, "UPDATE jobs SET status = 'done', completed = total, finished_at = ?, store_path = ?, summary = ? WHERE job_id = ? AND status = 'running'",
+                 (time.time(), store_path, json.dumps(summary, ensure_ascii=False, default=str), job_id))
+    except JobCancelled:
+        pass
+    except Exception as e:
+        _execute(path, "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE job_id = ?", (time.time(), str(e), job_id))
+
+
+def _worker_loop(worker, max_jobs):
+    running = worker['running']
+    while not worker['stop'].is_set():
+        for job_id in [job_id for job_id, thread in running.items() if not thread.is_alive()]:
+            del running[job_id]
+        ## heartbeat for this worker's jobs, so other workers don't take them over
+        if running:
+            _execute(worker['path'], f"UPDATE jobs SET heartbeat_at = ? WHERE job_id IN ({','.join('?' * len(running))})", [time.time()] + list(running))
+
+        job = _claim(worker['path']) if len(running) < max_jobs else None
+        if job is None:
+            worker['stop'].wait(POLL_INTERVAL)
+            continue
+        thread = threading.Thread(target=_run_job, args=(worker, job), daemon=True, name=f"fetch-job-{job[0]}")
+        running[job[0]] = thread
+        thread.start()
+
+
+def startWorker(path=QUEUE_FILE, max_jobs=MAX_RUNNING_JOBS, concurrency=FETCH_CONCURRENCY, rate=RATE_LIMIT):
+    """
+    - Start the background worker of this process (later calls return the running one), every Streamlit session shares it
+    - Up to max_jobs jobs run at once, together they keep at most `concurrency` requests in flight and `rate` requests per second
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker['thread'].is_alive():
+            _worker = {'path': path, 'limiter': createLimiter(concurrency, rate=rate), 'running': {}, 'stop': threading.Event()}
+            _worker['thread'] = threading.Thread(target=_worker_loop, args=(_worker, max_jobs), daemon=True, name='fetch-queue-worker')
+            _worker['thread'].start()
+        return _worker
+
+
+def stopWorker():
+    # stop claiming new jobs, running ones finish in their own threads
+    if _worker is not None:
+        _worker['stop'].set()
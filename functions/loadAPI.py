@@ -1,10 +1,7 @@
-import json
 import pandas as pd
+from functions.streamRecords import streamRecords
 
-def loadAPI():
-    with open('api-result.json', 'r', encoding='utf-8', errors='replace') as file:
-        data = json.load(file) 
-    api_dataframe = pd.DataFrame(data)
+def loadAPI(source='api-result.json'):
+    # records are streamed and slimmed one by one instead of json.load-ing the whole file
+    api_dataframe = pd.DataFrame({'raw_data': list(streamRecords(source))})
     return api_dataframe
-
-loadAPI()
\ No newline at end of file
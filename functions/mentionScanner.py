@@ -0,0 +1,81 @@
+# This function builds one matcher over all competitor names so each markdown is scanned once
+
+import re
+import unicodedata
+
+
+def _normalize(text):
+    # Vietnamese text can arrive composed or decomposed, compare both in NFC
+    return unicodedata.normalize('NFC', text)
+
+
+def _fold(name):
+    # lowercase per character (IGNORECASE still applies), keep chars whose lowercase is longer than one char
+    return ''.join(c.lower() if len(c.lower()) == 1 else c for c in name)
+
+
+def _trie_pattern(node):
+    # turn a character trie into a nested alternation, longest match first
+    alternatives = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ''
+    pattern = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+    if '' in node:
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+def buildMentionScanner(names):
+    """
+    - Compile every name into a single case-insensitive whole-word pattern (same as \\b<name>\\b per name)
+    - Return scan(text) -> set of names mentioned in text
+    """
+    ## group names by their folded form, names differing only by case are matched by the same key
+    names_by_key = {}
+    for name in names:
+        if not name:
+            continue
+        key = _fold(_normalize(str(name)))
+        names_by_key.setdefault(key, []).append(name)
+
+    if not names_by_key:
+        return lambda text: set()
+
+    ## an end-of-name node holds its key, the ones passed on the way down are the names this key starts with
+    trie = {}
+    prefixes = {}
+    for key in sorted(names_by_key, key=len):
+        node = trie
+        passed = []
+        for char in key:
+            if '' in node:
+                passed.append(node[''])
+            node = node.setdefault(char, {})
+        node[''] = key
+        if passed:
+            prefixes[key] = passed
+
+    ## zero-width lookahead so overlapping mentions are all found, the regex returns the longest name per position
+    matcher = re.compile(r'(?=\b(' + _trie_pattern(trie) + r')\b)', re.IGNORECASE)
+
+    ## shorter names that are a prefix of a longer one can match at the same position, check those separately
+    patterns = {other: re.compile(re.escape(other) + r'\b', re.IGNORECASE) for others in prefixes.values() for other in others}
+    prefix_checks = {key: [(other, patterns[other]) for other in others] for key, others in prefixes.items()}
+
+    def scan(text):
+        if not text or not isinstance(text, str):
+            return set()
+        text = _normalize(text)
+        found = set()
+        for match in matcher.finditer(text):
+            key = _fold(match.group(1))
+            if key not in names_by_key:
+                # rare case-folding pairs (e.g. 'ſ' and 's') that lower() doesn't map together
+                key = next(k for k in names_by_key if re.fullmatch(re.escape(k), match.group(1), re.IGNORECASE))
+            found.add(key)
+            for other, pattern in prefix_checks.get(key, ()):
+                if other not in found and pattern.match(text, match.start()):
+                    found.add(other)
+        return {name for key in found for name in names_by_key[key]}
+
+    return scan
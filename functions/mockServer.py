@@ -0,0 +1,245 @@
+# This module runs a local stand-in for the DataForSEO live endpoint and the task_post/tasks_ready/task_get queue, answering every task with a synthetic SERP result
+#
+#   python -m functions.mockServer --port 8080 --latency 0.5 --latency-distribution lognormal --error-rate 0.05 --server-error-rate 0.01
+#   SEO_API_URL=http://127.0.0.1:8080/v3/serp/google/organic/live/advanced python cli.py keywords.txt --location 2704 --language vi ...
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from functions.syntheticSerp import competitorVocabulary, syntheticRecord
+
+# configure seconds the server waits before answering (the mean for the random distributions), roughly a live SERP call at test scale
+LATENCY = 0.05
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+LATENCY_SIGMA = 1.0
+
+# configure seconds before a posted task shows up in tasks_ready, and the most tasks one tasks_ready call lists (like the API)
+QUEUE_DELAY = 0.5
+READY_LIMIT = 1000
+
+# configure the Retry-After sent with 429 responses
+RETRY_AFTER = 1
+
+
+def startMockServer(port=0, latency=LATENCY, seed=0, queue_delay=QUEUE_DELAY, latency_distribution='fixed', latency_sigma=LATENCY_SIGMA,
+                    error_rate=0.0, server_error_rate=0.0, truncate_rate=0.0, max_connections=None, requests_per_connection=None, **options):
+    """
+    - Serve POST requests shaped like /v3/serp/google/organic/live/advanced on 127.0.0.1:port (0 = any free port)
+    - Also serves .../task_post, .../tasks_ready and .../task_get/advanced/<id>, a posted task is ready after queue_delay seconds
+    - Faults: error_rate of 429s (with Retry-After), server_error_rate of 500/502/503s, truncate_rate of bodies cut off mid-way,
+      429 for requests beyond max_connections at once, keep-alive connections closed after requests_per_connection requests
+    - Returns (server, url) with the live endpoint's url, stop it with server.shutdown(), read counters with serverStats(server)
+    """
+    if latency_distribution not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"latency_distribution must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+    vocabulary = competitorVocabulary(options.pop('vocabulary_size', 300), seed)
+    queue = {}
+    lock = threading.Lock()
+    rnd = random.Random(f"mock:{seed}")
+    stats = _new_stats()
+
+    def draw():
+        # (seconds to wait, fault, status) of one request, drawn under the lock so a seed replays the same sequence
+        with lock:
+            if latency_distribution == 'uniform':
+                delay = rnd.uniform(0, 2 * latency)
+            elif latency_distribution == 'exponential':
+                delay = rnd.expovariate(1 / latency) if latency > 0 else 0
+            elif latency_distribution == 'lognormal':
+                # mu chosen so the mean stays at latency, sigma sets how heavy the tail is
+                delay = rnd.lognormvariate(math.log(latency) - latency_sigma ** 2 / 2, latency_sigma) if latency > 0 else 0
+            else:
+                delay = latency
+            roll = rnd.random()
+            server_error = rnd.choice([500, 502, 503])
+        if roll < error_rate:
+            return delay, 'rate_limited', 429
+        if roll < error_rate + server_error_rate:
+            return delay, 'server_error', server_error
+        if roll < error_rate + server_error_rate + truncate_rate:
+            return delay, 'truncated', 200
+        return delay, 'ok', 200
+
+    def serp(task):
+        return [syntheticRecord(task.get('keyword', ''), seed=seed, location_code=task.get('location_code'),
+                                language_code=task.get('language_code'), vocabulary=vocabulary, **options)]
+
+    def response(tasks):
+        return {
+            'version': '0.1.mock',
+            'status_code': 20000,
+            'status_message': 'Ok.',
+            'tasks_count': len(tasks),
+            'tasks_error': sum(1 for task in tasks if task['status_code'] >= 40000),
+            'tasks': tasks
+        }
+
+    ## the queue: task_post stores tasks, tasks_ready lists the finished ones not collected yet, task_get hands out the results
+    def task_post(tasks):
+        now = time.monotonic()
+        posted = []
+        with lock:
+            for task in tasks:
+                task_id = str(uuid.uuid4())
+                queue[task_id] = {'data': task, 'ready_at': now + queue_delay, 'collected': False}
+                posted.append({'id': task_id, 'status_code': 20100, 'status_message': 'Task Created.', 'data': task, 'result': None})
+        return response(posted)
+
+    def tasks_ready():
+        now = time.monotonic()
+        with lock:
+            ready = [{'id': task_id, 'tag': entry['data'].get('tag'), 'endpoint_advanced': f"/v3/serp/google/organic/task_get/advanced/{task_id}"}
+                     for task_id, entry in queue.items() if not entry['collected'] and entry['ready_at'] <= now][:READY_LIMIT]
+        return response([{'id': str(uuid.uuid4()), 'status_code': 20000, 'status_message': 'Ok.', 'result_count': len(ready), 'result': ready}])
+
+    def task_get(task_id):
+        with lock:
+            entry = queue.get(task_id)
+            if entry is None:
+                return response([{'id': task_id, 'status_code': 40400, 'status_message': 'Not Found.', 'result': None}])
+            if entry['ready_at'] > time.monotonic():
+                return response([{'id': task_id, 'status_code': 40602, 'status_message': 'Task In Queue.', 'data': entry['data'], 'result': None}])
+            entry['collected'] = True
+        return response([{'id': task_id, 'status_code': 20000, 'status_message': 'Ok.', 'data': entry['data'], 'result': serp(entry['data'])}])
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            self.served = 0
+            with lock:
+                stats['connections'] += 1
+
+        def do_POST(self):
+            tasks = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'[]')
+            if self.path.endswith('/task_post'):
+                self.handle_request(lambda: task_post(tasks))
+            else:
+                self.handle_request(lambda: response([{'id': f"mock-{i}", 'status_code': 20000, 'status_message': 'Ok.', 'data': task, 'result': serp(task)}
+                                                      for i, task in enumerate(tasks)]))
+
+        def do_GET(self):
+            if self.path.endswith('/tasks_ready'):
+                self.handle_request(tasks_ready)
+            elif '/task_get/advanced/' in self.path:
+                task_id = self.path.rsplit('/', 1)[-1]
+                self.handle_request(lambda: task_get(task_id))
+            else:
+                self.send_error(404)
+
+        def handle_request(self, build):
+            start = time.monotonic()
+            self.served += 1
+            with lock:
+                stats['requests'] += 1
+                stats['in_flight'] += 1
+                stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+                over_limit = max_connections is not None and stats['in_flight'] > max_connections
+            try:
+                ## requests over the concurrency limit are turned away right away, like the API's simultaneous-request cap
+                if over_limit:
+                    outcome = 'rate_limited'
+                    self.reply(429, b'Too Many Requests', retry_after=RETRY_AFTER)
+                    return
+                delay, outcome, status = draw()
+                time.sleep(delay)
+                if outcome == 'rate_limited':
+                    self.reply(429, b'Too Many Requests', retry_after=RETRY_AFTER)
+                elif outcome == 'server_error':
+                    self.reply(status, f"HTTP {status}".encode('utf-8'))
+                else:
+                    ## a truncated body announces its full length, then the connection drops half way
+                    self.reply(200, json.dumps(build(), ensure_ascii=False).encode('utf-8'), truncate=outcome == 'truncated')
+            finally:
+                with lock:
+                    stats['in_flight'] -= 1
+                    stats[outcome] += 1
+                    stats['latencies'].append(time.monotonic() - start)
+
+        def reply(self, status, body, retry_after=None, truncate=False):
+            close = truncate or (requests_per_connection is not None and self.served >= requests_per_connection)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json' if status == 200 else 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            if retry_after is not None:
+                self.send_header('Retry-After', str(retry_after))
+            if close:
+                self.send_header('Connection', 'close')
+                self.close_connection = True
+            self.end_headers()
+            self.wfile.write(body[:len(body) // 2] if truncate else body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _Server(('127.0.0.1', port), Handler)
+    server.stats = stats
+    server.stats_lock = lock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v3/serp/google/organic/live/advanced"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients dropping connections (cancelled runs, timeouts) are expected under load, anything else is still printed
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def _new_stats():
+    return {'requests': 0, 'ok': 0, 'rate_limited': 0, 'server_error': 0, 'truncated': 0, 'connections': 0, 'in_flight': 0, 'peak_in_flight': 0, 'latencies': []}
+
+
+def serverStats(server, reset=False):
+    """
+    - Requests served by outcome (ok, rate_limited, server_error, truncated), connections opened, most requests at once
+    - Server-side latency percentiles in seconds, reset=True starts the counters over (e.g. between benchmark stages)
+    """
+    with server.stats_lock:
+        stats = dict(server.stats)
+        if reset:
+            server.stats.update(_new_stats(), in_flight=server.stats['in_flight'])
+    latencies = np.array(stats.pop('latencies'), dtype=float)
+    stats.pop('in_flight')
+    for percentile in (50, 95, 99):
+        stats[f"latency_p{percentile}"] = round(float(np.percentile(latencies, percentile)), 4) if len(latencies) else None
+    stats['latency_max'] = round(float(latencies.max()), 4) if len(latencies) else None
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the DataForSEO SERP API with synthetic results and fault injection')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=LATENCY, help='seconds per request (mean for random distributions)')
+    parser.add_argument('--latency-distribution', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--latency-sigma', type=float, default=LATENCY_SIGMA, help='lognormal sigma, higher = heavier tail')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help='share of requests answered with 500/502/503')
+    parser.add_argument('--truncate-rate', type=float, default=0.0, help='share of responses cut off half way')
+    parser.add_argument('--max-connections', type=int, help='requests at once before the server answers 429')
+    parser.add_argument('--requests-per-connection', type=int, help='keep-alive requests before the server closes the connection')
+    parser.add_argument('--queue-delay', type=float, default=QUEUE_DELAY, help='seconds before a posted task is ready')
+    args = parser.parse_args()
+
+    server, url = startMockServer(args.port, args.latency, args.seed, queue_delay=args.queue_delay, latency_distribution=args.latency_distribution,
+                                  latency_sigma=args.latency_sigma, error_rate=args.error_rate, server_error_rate=args.server_error_rate,
+                                  truncate_rate=args.truncate_rate, max_connections=args.max_connections,
+                                  requests_per_connection=args.requests_per_connection)
+    print(f"Mock DataForSEO API on {url} (export SEO_API_URL={url}), Ctrl+C prints the stats and stops")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(serverStats(server), indent=2))
+        server.shutdown()
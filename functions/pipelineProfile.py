@@ -0,0 +1,78 @@
+# This module records wall time, rows and peak memory of consecutive pipeline stages when profiling is switched on
+
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, memory is then only reported with profile='memory'
+    resource = None
+
+# configure profiling for every run: '1' for time + process peak memory, 'memory' for exact per-stage peaks (slower)
+PROFILE = os.getenv('PIPELINE_PROFILE', '').lower()
+PROFILE = False if PROFILE in ('', '0', 'false', 'no') else 'memory' if PROFILE == 'memory' else True
+
+
+def _peak_rss():
+    # high-water mark of the process resident memory in bytes (kilobytes on Linux, bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def startProfile(enabled=PROFILE):
+    """
+    - Returns None when disabled (markStage is then a no-op), else the profile stages are recorded in
+    - profile=True: peak memory is how much the process high-water mark grew during the stage (cheap, 0 once a bigger earlier stage set it)
+    - profile='memory': exact peak above the stage's starting point with tracemalloc, which slows Python code down about 3x
+    """
+    if not enabled:
+        return None
+    profile = {'stages': [], 'tracing': enabled == 'memory', 'started_tracing': False}
+    if profile['tracing']:
+        profile['started_tracing'] = not tracemalloc.is_tracing()
+        if profile['started_tracing']:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile['memory'] = tracemalloc.get_traced_memory()[0]
+    else:
+        profile['memory'] = _peak_rss()
+    profile['last'] = time.perf_counter()
+    return profile
+
+
+def markStage(profile, name, rows=None):
+    # close the stage that ran since the previous mark
+    if profile is None:
+        return
+    seconds = time.perf_counter() - profile['last']
+    if profile['tracing']:
+        current, peak = tracemalloc.get_traced_memory()
+        peak_memory = max(0, peak - profile['memory'])
+        tracemalloc.reset_peak()
+        profile['memory'] = current
+    else:
+        current = _peak_rss()
+        peak_memory = current - profile['memory'] if current is not None else None
+        profile['memory'] = current
+
+    profile['stages'].append({
+        'stage': name,
+        'seconds': round(seconds, 4),
+        'rows': rows,
+        'peak_memory_mb': round(peak_memory / 2 ** 20, 2) if peak_memory is not None else None
+    })
+    profile['last'] = time.perf_counter()
+
+
+def finishProfile(profile):
+    # stop tracing if this profile started it, return the list of stages (None when disabled)
+    if profile is None:
+        return None
+    if profile['started_tracing']:
+        tracemalloc.stop()
+    return profile['stages']
@@ -0,0 +1,412 @@
+# This function runs every brand-independent step of the analysis once per dataset (extraction, markdown, references, competitors, mentions)
+
+import os
+import re
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functions.compactReferences import categorical, compactReferences, referenceLists
+from functions.extractColumns import extractColumns
+from functions.mentionScanner import buildMentionScanner
+from functions.pipelineProfile import PROFILE, finishProfile, markStage, startProfile
+from functions.registrableDomain import domainIndex
+from functions.resultStore import isResultStore, readResultItems, readResultStore, recordMatches
+
+# configure worker processes for markdown cleaning, mention scanning and citation grouping (1 = everything in this process)
+WORKERS = int(os.getenv('ANALYSIS_WORKERS', '1'))
+
+
+## Write function to clean markdown
+def clean_markdown_citations(md: str) -> str:
+    """
+    - Remove citation-style links: [[label]](url)
+    - Replace normal links with their visible text (exclude images)
+    - Tidy whitespace created by removals
+    """
+    # 1) Drop citations like [[1]](http...) or [[abc]](http...)
+    md = re.sub(r'\s*\[\[[^\[\]]+\]\]\s*\([^)]+\)', '', md)
+
+    # 2) Turn [text](url) into "text", but keep images ![alt](url) intact
+    md = re.sub(r'(?<!!)\[([^\]]+)\]\([^)]+\)', r'\1', md)
+
+    # 2.1) Delete images ![alt](url)
+    md = re.sub(r'!\[([^\]]*)\]\([^)]+\)', '', md)
+
+    # 3) Tidy whitespace and spacing before punctuation
+    md = re.sub(r'[ \t]+', ' ', md)
+    md = re.sub(r'\s+([.,;:!?])', r'\1', md)
+
+    # 4) Trim per-line and overall
+    md = '\n'.join(line.strip() for line in md.splitlines())
+    return md.strip()
+
+
+def _cite_groups(citations):
+    # per source code in first-seen order: citations, rank sum, prompts citing it and domain codes in first-seen order
+    grouped = pd.DataFrame(citations).groupby('name', sort=False)
+    return pd.DataFrame({
+        'cited_count': grouped.size(),
+        'rank_sum': grouped['rank'].sum(),
+        'cited_in_prompts': grouped['prompt'].nunique(),
+        'domains': grouped['domain'].unique()
+    })
+
+
+def _shard_pass(shard):
+    """
+    - One pass over a contiguous shard of overviews: clean the markdown, scan it for every competitor, group its citations
+    - names: source names by code (None for sources never cited by name), weights: keyword rows per overview
+    - Returns the cleaned markdown, mentioned source codes (flat, with a count per overview) and the shard totals:
+      weighted mention counts per source code and the citation groups (a prompt never spans two shards)
+    """
+    names, markdowns, weights, citations = shard
+    # each worker compiles the scanner itself, compiled patterns don't travel between processes
+    scan_mentions = buildMentionScanner(names)
+    codes = {name: code for code, name in enumerate(names) if name}
+
+    cleaned, mentioned, lengths = [], [], []
+    for md in markdowns:
+        md = clean_markdown_citations(md) if md else None
+        found = [codes[name] for name in scan_mentions(md)]
+        cleaned.append(md)
+        mentioned.extend(found)
+        lengths.append(len(found))
+
+    mentioned = np.array(mentioned, dtype=np.int64)
+    lengths = np.array(lengths, dtype=np.int64)
+    counts = np.bincount(mentioned, weights=np.repeat(weights, lengths), minlength=len(names)).astype(np.int64)
+    return cleaned, mentioned, lengths, counts, _cite_groups(citations)
+
+
+def _shard_bounds(count, workers):
+    # one contiguous [start, end) range per worker
+    if workers <= 1 or count < 2 * workers:
+        return [(0, count)]
+    size = -(-count // workers)
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _map_shards(function, shards, workers):
+    """
+    - Run function on every shard in a process pool (in this process when there is a single shard)
+    - Results come back in shard order, so reducing them gives the same output as one serial call on all items
+    """
+    if len(shards) == 1:
+        return [function(shards[0])]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(function, shards))
+
+
+def prepareAnalysis(dataframe, workers=WORKERS, profile=PROFILE, item_types=(), location_code=None, language_code=None):
+    """
+    - dataframe: raw records (DataFrame or list) or a result store path
+    - location_code / language_code: only analyze the keywords fetched for them (pushed down to the Parquet reader for a store)
+    - item_types: SERP items collected from raw records besides the AI overview ('organic', 'featured_snippet'), used for the
+      brand's organic rank / featured snippet columns; a result store brings the items it was written with
+    - workers > 1 shards markdown cleaning, mention scanning and citation grouping over a process pool (one pass per shard,
+      the shards return totals that are added up here), results are identical
+    - profile=True adds the wall time, rows and peak memory of every stage under 'profile'
+    - Problems are returned, not displayed: {'status': 'error' or 'no_data', 'message': ...}, the caller decides how to show them
+    """
+    profile = startProfile(profile)
+    try:
+        prepared = _prepare(dataframe, workers, profile, item_types, location_code, language_code)
+    finally:
+        stages = finishProfile(profile)
+    prepared['profile'] = stages
+    return prepared
+
+
+def _prepare(dataframe, workers, profile, item_types, location_code, language_code):
+    # Handle different input formats
+    if dataframe is None:
+        return {'status': 'error', 'message': "No data provided for analysis"}
+
+    # A result store written by writeResultStore is read directly, no JSON parsing
+    if isResultStore(dataframe):
+        keywords, df_aio, references = readResultStore(dataframe, location_code, language_code)
+        df = keywords[['keyword']]
+
+        ## one row per keyword with an AI overview (first occurrence), its references mapped to that row
+        df_aio = df_aio.drop_duplicates('keyword').reset_index(drop=True)
+        references = references[references['keyword_id'].isin(df_aio['keyword_id'])]
+        references = compactReferences(
+            np.searchsorted(df_aio['keyword_id'].to_numpy(), references['keyword_id'].to_numpy()),
+            references['rank'], references['domain'], references['source'], references['url'],
+            len(df_aio)
+        )
+        df_aio = df_aio.rename(columns={'markdown': 'aio_markdown'})[['keyword', 'aio_markdown']]
+
+        ## captured SERP items mapped to their keywords table row
+        items = readResultItems(dataframe)
+        if items is not None:
+            keyword_ids = keywords['keyword_id'].to_numpy()
+            captured = items.attrs['item_types']
+            items = items[items['keyword_id'].isin(keyword_ids)]
+            items = {
+                'row': np.searchsorted(keyword_ids, items['keyword_id'].to_numpy()),
+                'type': categorical(items['type']),
+                'rank': items['rank'].to_numpy(),
+                'domain': categorical(items['domain']),
+                'item_types': captured
+            }
+
+    else:
+        # Convert to proper format: a DataFrame from fetchKeywords (records in the first column) or a list of records
+        if isinstance(dataframe, pd.DataFrame):
+            if dataframe.empty:
+                return {'status': 'error', 'message': "No data available for analysis"}
+            records = dataframe.iloc[:, 0].tolist()
+        else:
+            records = list(dataframe)
+
+        # Check if raw_data contains the expected structure
+        if not records:
+            return {'status': 'error', 'message': "Data format is not compatible for analysis"}
+        if location_code is not None or language_code is not None:
+            records = [record for record in records if recordMatches(record, location_code, language_code)]
+
+        ## CREATE SUB DATASET FOR AI OVERVIEWS, one pass over the records and their items into column buffers
+        try:
+            columns = extractColumns(records, item_types)
+        except Exception as e:
+            return {'status': 'error', 'message': f"Error processing AI overview data: {str(e)}"}
+
+        df = pd.DataFrame({'keyword': columns['keyword']})
+
+        # Only add once per keyword (the first overview wins), record -> df_aio row is -1 for the others
+        aio_records = np.flatnonzero(columns['has_aio'])
+        aio_records = aio_records[~df['keyword'].take(aio_records).duplicated().to_numpy()]
+        record_rows = np.full(len(df), -1, dtype=np.int64)
+        record_rows[aio_records] = np.arange(len(aio_records))
+        df_aio = pd.DataFrame({
+            'keyword': df['keyword'].take(aio_records).to_numpy(),
+            # markdown stays object, None for overviews without one
+            'aio_markdown': pd.Series(np.asarray(columns['markdown'], dtype=object)[aio_records], dtype=object)
+        })
+
+        refs = columns['references']
+        ref_rows = record_rows[refs['record']]
+        kept = ref_rows >= 0
+        ref_columns = [refs[name] for name in ('domain', 'source', 'url')]
+        ## references of repeated keywords' overviews are dropped
+        if not kept.all():
+            ref_columns = [np.asarray(column, dtype=object)[kept] for column in ref_columns]
+        references = compactReferences(ref_rows[kept], refs['rank'][kept], *ref_columns, len(df_aio))
+
+        ## captured SERP items, records are the keywords table rows
+        items = columns['items']
+        if items is not None:
+            items = {
+                'row': items['record'],
+                'type': categorical(items['type']),
+                'rank': items['rank'],
+                'domain': categorical(items['domain']),
+                'item_types': columns['item_types']
+            }
+
+    markStage(profile, 'read_input', len(df))
+
+    if df_aio.empty:
+        return {'status': 'no_data', 'message': "No AI Overview data found in the results. The analysis will be limited."}
+
+    # HANDLE REFERENCES
+    # references stay in the compact arrays, number of references per keyword comes from the offsets
+    df_aio['aio_references_count'] = np.diff(references['offsets'])
+
+
+    ## remerge df_aio with df on keyword, the number of rows should stay the same as df (8031 keywords)
+    df_aio['aio_row'] = np.arange(len(df_aio))
+    df_merged = pd.merge(df, df_aio[['keyword', 'aio_row', 'aio_references_count']], on='keyword', how='left')
+    merged_rows = [int(row) if pd.notna(row) else None for row in df_merged['aio_row']]
+    aio_rows = np.array([row if row is not None else -1 for row in merged_rows], dtype=np.int64)
+    markStage(profile, 'merge_keywords', len(df_merged))
+
+
+    # CLEAN MARKDOWN, SCAN MENTIONS AND GROUP CITATIONS in one pass per shard of overviews
+    ## one integer-coded row per named citation: 'prompt' is the df_aio row, source/domain are dictionary codes
+    source_codes = references['source'].codes
+    source_names = np.asarray(references['source'].categories, dtype=object)
+    domain_names = np.append(np.asarray(references['domain'].categories, dtype=object), None)
+    named = (source_codes >= 0) & (np.append(source_names, None)[source_codes] != '')
+    citations = {
+        'prompt': references['row'][named],
+        'name': source_codes[named],
+        'domain': references['domain'].codes[named],
+        'rank': references['rank'][named].astype(np.int64)
+    }
+
+    ## every source cited by name is a competitor, the overviews are scanned for all of them
+    cited = np.zeros(len(source_names), dtype=bool)
+    cited[citations['name']] = True
+    names = np.where(cited, source_names, None).tolist()
+    ## repeated keywords count the mentions of their overview again
+    weights = np.bincount(aio_rows[aio_rows >= 0], minlength=len(df_aio))
+
+    markdowns = df_aio['aio_markdown'].tolist()
+    shards = []
+    for start, end in _shard_bounds(len(df_aio), workers):
+        first, last = np.searchsorted(citations['prompt'], [start, end])
+        shards.append((names, markdowns[start:end], weights[start:end], {column: values[first:last] for column, values in citations.items()}))
+    shards = _map_shards(_shard_pass, shards, workers)
+
+    df_aio['aio_markdown'] = pd.Series([md for shard in shards for md in shard[0]], index=df_aio.index, dtype=object)
+    mentioned = np.concatenate([shard[1] for shard in shards]).tolist()
+    mention_offsets = np.concatenate([[0], np.cumsum(np.concatenate([shard[2] for shard in shards]))]).tolist()
+    mention_counts = np.sum([shard[3] for shard in shards], axis=0)
+    markStage(profile, 'clean_and_scan', len(df_aio))
+
+
+    ## prepare download dataframe, reference lists are only materialized here for display and download
+    df_download = df_merged.drop(columns=['aio_row'])
+    reference_lists = referenceLists(references)
+    df_download['aio_references'] = [reference_lists[row] if row is not None else np.nan for row in merged_rows]
+
+    # Convert aio_references to readable string format for display
+    def format_refs_for_display(refs):
+        # handle NaN (float), None, and non-iterable values safely
+        if refs is None:
+            return "No references"
+        # pandas uses float('nan') for missing values
+        if isinstance(refs, float) and pd.isna(refs):
+            return "No references"
+
+        # expected: list of dicts
+        if isinstance(refs, list) and refs:
+            # Create readable string format: "1. domain1.com, 2. domain2.com, ..."
+            formatted_refs = []
+            for ref in refs:
+                if isinstance(ref, dict):
+                    rank = ref.get('rank', '?')
+                    domain = ref.get('domain', 'unknown')
+                    formatted_refs.append(f"{rank}. {domain}")
+            return " | ".join(formatted_refs) if formatted_refs else "No valid references"
+
+        # if a single dict is present
+        if isinstance(refs, dict):
+            rank = refs.get('rank', '?')
+            domain = refs.get('domain', 'unknown')
+            return f"{rank}. {domain}"
+
+        # fallback
+        return "Invalid reference format"
+
+    df_download['aio_references_display'] = df_download['aio_references'].apply(format_refs_for_display)
+
+    # Keep original for download, but reorder columns to show display version
+    df_download = df_download[['keyword', 'aio_references_count', 'aio_references_display', 'aio_references']]
+    markStage(profile, 'keywords_table', len(df_download))
+
+
+    # COMPETITOR ANALYSIS
+    ## every citation plus one empty row per overview without references (the size of the old exploded table)
+    citation_rows = len(references['row']) + int((df_aio['aio_references_count'] == 0).sum())
+
+
+    ## add up the shards' citation groups (groups keep first-seen order, like the old per-brand loop)
+    groups = pd.concat([shard[4] for shard in shards])
+    domains = {}
+    for code, codes in zip(groups.index.tolist(), groups['domains']):
+        domains.setdefault(code, {}).update(dict.fromkeys(codes.tolist()))
+    grouped = groups.groupby(level=0, sort=False)
+
+    brand_list_df = pd.DataFrame({
+        'cited_count': grouped['cited_count'].sum(),
+        'rank_sum': grouped['rank_sum'].sum(),
+        ## number of prompts where the brand is cited
+        'cited_in_prompts': grouped['cited_in_prompts'].sum(),
+    })
+    brand_list_df['unique_domains'] = [domain_names[list(domains[code])].tolist() for code in brand_list_df.index]
+    brand_list_df['average_rank'] = brand_list_df['rank_sum'] / brand_list_df['cited_count']
+    brand_list_df.index = source_names[brand_list_df.index.to_numpy(dtype=np.int64)]
+    brand_list_df['cited_probability'] = brand_list_df['cited_count'] / citation_rows
+    brand_list_df['prompt_cited_rate'] = brand_list_df['cited_in_prompts'] / df_aio.shape[0]
+    brand_list_df = brand_list_df.rename_axis('brand').reset_index()
+    brand_list_df = brand_list_df[['brand', 'cited_count', 'unique_domains', 'average_rank', 'cited_probability', 'cited_in_prompts', 'prompt_cited_rate']]
+    brand_list_df = brand_list_df.sort_values(by='cited_count', ascending=False).reset_index(drop=True)
+    markStage(profile, 'competitor_aggregation', len(groups))
+
+
+    # Store competitor dataframe for return
+
+    # BRAND MENTIONS
+    # append all competitors into a single list called brand_competitor, with only name and domain, name is "brand" in brand_list_df, domain is "unique_domains" in brand_list_df
+
+    brand_competitor = []
+    for index, row in brand_list_df.iterrows():
+        brand_competitor.append({
+            "name": row['brand'],
+            "domain": row['unique_domains'] if row['unique_domains'] else None
+        })
+
+    df_competitor = pd.DataFrame(brand_competitor)
+
+
+    # inherit cited_in_prompts, average_rank, prompt_cited_rate from brand_list_df
+    df_competitor = pd.merge(df_competitor, brand_list_df[['brand', 'cited_in_prompts', 'average_rank', 'prompt_cited_rate']], left_on='name', right_on='brand', how='left')
+    df_competitor = df_competitor.drop(columns=['brand'])
+    df_competitor['cited_in_prompts'] = df_competitor['cited_in_prompts'].fillna(0).astype(int)
+
+
+    ## brand mentions were found by the shard pass: one case-insensitive whole-word matcher, one scan per overview
+    markStage(profile, 'competitor_list', len(df_competitor))
+    mentions_by_name = {source_names[code]: int(mention_counts[code]) for code in np.flatnonzero(cited)}
+    df_competitor['mentioned'] = [mentions_by_name.get(name, 0) for name in df_competitor.get('name', [])]
+
+    # per-keyword mention sets for the keywords table
+    names = source_names.tolist()
+    df_download['mentioned_brands'] = [
+        sorted(names[code] for code in mentioned[mention_offsets[row]:mention_offsets[row + 1]]) if row is not None else []
+        for row in merged_rows
+    ]
+    markStage(profile, 'mentions', len(df_aio))
+
+    df_competitor['prompt_cited_rate'] = df_competitor['cited_in_prompts'] / df_aio.shape[0]
+    df_competitor['mention_rate'] = df_competitor['mentioned'] / df_aio.shape[0]
+
+    # Create comprehensive competitor analysis by merging brand_list_df with mention data
+    # Merge the citation data from brand_list_df with mention data from df_competitor
+    comprehensive_competitors = pd.merge(
+        brand_list_df,
+        df_competitor[['name', 'mentioned', 'mention_rate']],
+        left_on='brand',
+        right_on='name',
+        how='left'
+    )
+
+    # Drop duplicate name column and fill NaN values
+    comprehensive_competitors = comprehensive_competitors.drop(columns=['name'])
+    comprehensive_competitors['mentioned'] = comprehensive_competitors['mentioned'].fillna(0).astype(int)
+    comprehensive_competitors['mention_rate'] = comprehensive_competitors['mention_rate'].fillna(0)
+
+    # Reorder columns for better readability
+    column_order = [
+        'brand', 'cited_count', 'mentioned', 'unique_domains',
+        'average_rank', 'cited_probability', 'cited_in_prompts',
+        'prompt_cited_rate', 'mention_rate'
+    ]
+    comprehensive_competitors = comprehensive_competitors[column_order]
+
+    # Sort by total engagement (citations + mentions)
+    comprehensive_competitors['total_engagement'] = comprehensive_competitors['cited_count'] + comprehensive_competitors['mentioned']
+    comprehensive_competitors = comprehensive_competitors.sort_values('total_engagement', ascending=False).drop(columns=['total_engagement']).reset_index(drop=True)
+    markStage(profile, 'competitor_table', len(comprehensive_competitors))
+
+    # Return everything the brand stage needs, nothing in here depends on the brand
+    return {
+        'status': 'success',
+        'keywords_df': df_download,
+        'competitors_df': comprehensive_competitors,
+        'references': references,
+        ## keywords table row -> df_aio row (-1 without AI overview)
+        'aio_rows': aio_rows,
+        'aio_markdown': df_aio['aio_markdown'].tolist(),
+        ## reference domain categories grouped by registrable domain, brand domains are matched with one lookup
+        'domain_index': domainIndex(references['domain'].categories),
+        'source_keys': [source.lower() for source in references['source'].categories],
+        ## organic / featured snippet items (row, type, rank, domain) when they were collected, None otherwise
+        'items': dict(items, domain_index=domainIndex(items['domain'].categories)) if items is not None else None,
+        'keywords_analyzed': len(df),
+        'ai_overviews_found': len(df_aio),
+        'competitors_identified': len(brand_list_df)
+    }
\ No newline at end of file
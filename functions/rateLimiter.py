@@ -0,0 +1,99 @@
+# This module paces API requests: a token bucket for the request rate and an AIMD window for concurrency
+
+import asyncio
+import random
+import threading
+import time
+
+# configure provider limits (dataforseo allows 2000 calls per minute)
+RATE_LIMIT = 30
+BURST = 50
+
+# configure retries
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+
+# seconds between two multiplicative decreases, so one burst of 429s only halves the window once
+BACKOFF_COOLDOWN = 2
+
+
+def createLimiter(max_concurrency, rate=RATE_LIMIT, burst=BURST, min_concurrency=1):
+    # the state shared by every worker of one fetch run
+    return {
+        'rate': rate,
+        'burst': burst,
+        'tokens': burst,
+        'refilled_at': time.monotonic(),
+        'limit': float(max_concurrency),
+        'max_concurrency': max_concurrency,
+        'min_concurrency': min_concurrency,
+        'in_flight': 0,
+        'backed_off_at': 0,
+        'lock': threading.Lock()
+    }
+
+
+def _reserve(limiter):
+    """
+    - Take a concurrency slot if the window has room, else return None
+    - Take a token (the bucket may go negative) and return the seconds to wait for it
+    """
+    with limiter['lock']:
+        if limiter['in_flight'] >= int(limiter['limit']):
+            return None
+        now = time.monotonic()
+        limiter['tokens'] = min(limiter['burst'], limiter['tokens'] + (now - limiter['refilled_at']) * limiter['rate'])
+        limiter['refilled_at'] = now
+        limiter['tokens'] -= 1
+        limiter['in_flight'] += 1
+        return max(0, -limiter['tokens'] / limiter['rate'])
+
+
+def acquire(limiter):
+    # blocking version for the thread engine
+    while True:
+        delay = _reserve(limiter)
+        if delay is not None:
+            time.sleep(delay)
+            return
+        time.sleep(0.05)
+
+
+async def acquireAsync(limiter):
+    # non-blocking version for the async engine
+    while True:
+        delay = _reserve(limiter)
+        if delay is not None:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # the slot was already taken, give it back
+                release(limiter)
+                raise
+            return
+        await asyncio.sleep(0.05)
+
+
+def release(limiter, backoff=False, retry_after=None):
+    """
+    - Additive increase: every success grows the window by 1/window (about +1 per round trip)
+    - Multiplicative decrease: a 429/timeout halves it and pauses the bucket for retry_after seconds
+    """
+    with limiter['lock']:
+        limiter['in_flight'] -= 1
+        if not backoff:
+            limiter['limit'] = min(limiter['max_concurrency'], limiter['limit'] + 1 / limiter['limit'])
+            return
+        now = time.monotonic()
+        if now - limiter['backed_off_at'] >= BACKOFF_COOLDOWN:
+            limiter['limit'] = max(limiter['min_concurrency'], limiter['limit'] / 2)
+            limiter['backed_off_at'] = now
+        if retry_after:
+            limiter['tokens'] = min(limiter['tokens'], -retry_after * limiter['rate'])
+
+
+def backoffDelay(attempt, retry_after=None):
+    # exponential backoff with full jitter, the server's Retry-After wins when it is longer
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after or 0)
@@ -0,0 +1,101 @@
+# This module maps hosts and URLs to their registrable domain (blog.seongon.com.vn -> seongon.com.vn) with a bundled public suffix list
+
+import functools
+import os
+import numpy as np
+from urllib.parse import urlsplit
+
+# configure the bundled offline copy of https://publicsuffix.org/list/public_suffix_list.dat and the size of the memo table
+SUFFIX_LIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+MEMO_SIZE = 65536
+
+_rules = None
+
+
+def _load_rules(path=SUFFIX_LIST):
+    # plain rules, wildcard rules ('*.ck' kept as 'ck') and exceptions ('!www.ck' kept as 'www.ck'), IDN rules also in punycode
+    rules, wildcards, exceptions = set(), set(), set()
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            rule = line.split()[0] if line.strip() else ''
+            if not rule or rule.startswith('//'):
+                continue
+            target = rules
+            if rule.startswith('!'):
+                target, rule = exceptions, rule[1:]
+            elif rule.startswith('*.'):
+                target, rule = wildcards, rule[2:]
+            target.add(rule)
+            try:
+                target.add(rule.encode('idna').decode('ascii'))
+            except UnicodeError:
+                pass
+    return rules, wildcards, exceptions
+
+
+def normalizeHost(value):
+    # lowercase host of a URL or bare domain: no scheme, credentials, port, path or trailing dot (a leading www. is kept, 'www.ck' is a registrable domain)
+    if not isinstance(value, str):
+        return ''
+    value = value.strip().lower()
+    host = (urlsplit(value).hostname or '') if '://' in value else value.split('/')[0].split('@')[-1].split(':')[0]
+    return host.strip('.')
+
+
+def _registrable(host):
+    # public suffix + one label, None for IPs, single labels and hosts that are a public suffix themselves
+    global _rules
+    if _rules is None:
+        _rules = _load_rules()
+    rules, wildcards, exceptions = _rules
+
+    labels = host.split('.')
+    if len(labels) < 2 or all(label.isdigit() for label in labels):
+        return None
+
+    ## the longest matching rule wins, exceptions beat wildcards, no match means the last label is the suffix
+    suffix = len(labels) - 1
+    for i in range(len(labels)):
+        candidate = '.'.join(labels[i:])
+        if candidate in exceptions:
+            suffix = i + 1
+            break
+        if candidate in rules or (i + 1 < len(labels) and '.'.join(labels[i + 1:]) in wildcards):
+            suffix = i
+            break
+    return '.'.join(labels[suffix - 1:]) if suffix > 0 else None
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def registrableDomain(value):
+    """
+    - Registrable domain of a host or URL, every distinct value is parsed once (bounded memo table)
+    - Values without one (IPs, 'localhost', a bare suffix like 'com.vn') come back as their normalized host
+    """
+    host = normalizeHost(value)
+    return _registrable(host) or host
+
+
+def domainIndex(domains):
+    """
+    - Group distinct domains (e.g. the reference domain categories) by registrable domain
+    - 'codes': registrable code of every input domain, 'registrable': the distinct registrable domains, 'lookup': registrable -> code
+    """
+    lookup = {}
+    codes = np.array([lookup.setdefault(registrableDomain(domain), len(lookup)) for domain in domains], dtype=np.int64)
+    return {'codes': codes, 'registrable': list(lookup), 'lookup': lookup}
+
+
+def matchDomain(index, brand_domain):
+    """
+    - Mask over the indexed domains that share brand_domain's registrable domain, one dict lookup
+    - A brand domain without a suffix ('seongon') is looked for inside the registrable domains instead, like a plain substring test
+    """
+    host = normalizeHost(brand_domain)
+    key = _registrable(host)
+    if not host:
+        return np.zeros(len(index['codes']), dtype=bool)
+    if key is None:
+        hits = np.array([host in registrable for registrable in index['registrable']] + [False], dtype=bool)
+        return hits[index['codes']]
+    return index['codes'] == index['lookup'].get(key, -1)
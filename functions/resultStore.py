@@ -0,0 +1,219 @@
+# This module writes fetched/ingested records to a normalized Parquet store and reads it back with column pruning and filters
+
+import hashlib
+import os
+import shutil
+import uuid
+from itertools import islice
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functions.extractColumns import extractColumns
+
+# configure store directory, how many content-named stores (uploads) are kept side by side, and rows buffered per Parquet row group
+STORE_PATH = 'api-result-store'
+MAX_STORES = 20
+ROW_GROUP_SIZE = 50000
+
+KEYWORDS_SCHEMA = pa.schema([
+    ('keyword_id', pa.int32()),
+    ('keyword', pa.string()),
+    ('location_code', pa.int32()),
+    ('language_code', pa.string()),
+    ('has_aio', pa.bool_()),
+    ('markdown', pa.string())
+])
+
+REFERENCES_SCHEMA = pa.schema([
+    ('keyword_id', pa.int32()),
+    ('rank', pa.int16()),
+    ('domain', pa.string()),
+    ('source', pa.string()),
+    ('url', pa.string())
+])
+
+# organic / featured snippet items, only written when the store is built with item_types
+ITEMS_SCHEMA = pa.schema([
+    ('keyword_id', pa.int32()),
+    ('type', pa.string()),
+    ('rank', pa.int16()),
+    ('domain', pa.string()),
+    ('url', pa.string())
+])
+
+
+def extractRecord(record):
+    """
+    - Pull keyword, location/language, AI overview flag, markdown and references out of one raw SERP record
+    - Same rules as analyzeDataFrame: any '*ai_overview*' item flags the keyword, the first 'ai_overview' item holds the content
+    """
+    if not isinstance(record, dict):
+        return 'Unknown', None, None, False, None, []
+
+    has_aio = False
+    overview = None
+    for item in record.get('items') or []:
+        if isinstance(item, dict) and isinstance(item.get('type'), str) and 'ai_overview' in item['type']:
+            has_aio = True
+            if item['type'] == 'ai_overview':
+                overview = item
+                break
+
+    markdown = overview.get('markdown') if overview else None
+    references = (overview.get('references') if overview else None) or []
+    return record.get('keyword', 'Unknown'), record.get('location_code'), record.get('language_code'), has_aio, markdown, references
+
+
+def recordMatches(record, location_code=None, language_code=None):
+    # the readResultStore filters applied to one raw record (location codes compare as numbers, '2704' == 2704)
+    if not isinstance(record, dict):
+        return location_code is None and language_code is None
+    if location_code is not None and str(record.get('location_code')) != str(int(location_code)):
+        return False
+    return language_code is None or record.get('language_code') == language_code
+
+
+def writeResultStore(records, path=STORE_PATH, item_types=()):
+    """
+    - Stream records into keywords.parquet and references.parquet, one row group (ROW_GROUP_SIZE records) at a time
+    - item_types: also write those SERP items ('organic', 'featured_snippet') to items.parquet
+    """
+    os.makedirs(path, exist_ok=True)
+    items_file = os.path.join(path, 'items.parquet')
+    ## a store rewritten without items must not keep the previous dataset's
+    if os.path.exists(items_file):
+        os.remove(items_file)
+
+    records = iter(records)
+    first_id = 0
+    writers = []
+    try:
+        keywords_writer = pq.ParquetWriter(os.path.join(path, 'keywords.parquet'), KEYWORDS_SCHEMA)
+        writers.append(keywords_writer)
+        references_writer = pq.ParquetWriter(os.path.join(path, 'references.parquet'), REFERENCES_SCHEMA)
+        writers.append(references_writer)
+        items_writer = None
+
+        # an empty record list still writes one (empty) row group
+        while True:
+            chunk = list(islice(records, ROW_GROUP_SIZE))
+            if not chunk and first_id:
+                break
+            columns = extractColumns(chunk, item_types)
+            keyword_ids = np.arange(first_id, first_id + len(chunk), dtype=np.int32)
+            location_codes = [int(code) if code not in (None, '') else None for code in columns['location_code']]
+
+            keywords_writer.write_table(pa.table([
+                keyword_ids, columns['keyword'], location_codes, columns['language_code'], columns['has_aio'], columns['markdown']
+            ], schema=KEYWORDS_SCHEMA))
+            refs = columns['references']
+            references_writer.write_table(pa.table([
+                keyword_ids[refs['record']], refs['rank'], refs['domain'], refs['source'], refs['url']
+            ], schema=REFERENCES_SCHEMA))
+
+            items = columns['items']
+            if items is not None:
+                if items_writer is None:
+                    schema = ITEMS_SCHEMA.with_metadata({'item_types': ','.join(columns['item_types'])})
+                    items_writer = pq.ParquetWriter(items_file, schema)
+                    writers.append(items_writer)
+                ## rank 0 (no rank_group) is stored as null
+                items_writer.write_table(pa.table([
+                    keyword_ids[items['record']], items['type'], pa.array(items['rank'], mask=items['rank'] == 0), items['domain'], items['url']
+                ], schema=items_writer.schema))
+
+            first_id += len(chunk)
+            if len(chunk) < ROW_GROUP_SIZE:
+                break
+    finally:
+        for writer in writers:
+            writer.close()
+
+    return path
+
+
+def writeStoreOnce(records, path, item_types=()):
+    """
+    - Write the store at path unless it already exists, for paths named by their content (e.g. the upload's hash)
+    - Written under a temporary name and renamed, readers never see a half-written store and an existing one is never rewritten
+    - Stores next to it beyond MAX_STORES are removed, least recently written or reused first
+    """
+    if isResultStore(path):
+        os.utime(path)
+        return path
+    temporary = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        writeResultStore(records, temporary, item_types)
+        os.replace(temporary, path)
+    except OSError:
+        ## another session wrote the same content first
+        if not isResultStore(path):
+            raise
+    finally:
+        shutil.rmtree(temporary, ignore_errors=True)
+
+    ## drop the least recently used stores, temporary directories of writes in progress are left alone
+    parent = os.path.dirname(path) or '.'
+    stores = sorted((entry for entry in os.scandir(parent) if entry.is_dir() and isResultStore(entry.path)), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in stores[MAX_STORES:]:
+        if os.path.abspath(entry.path) != os.path.abspath(path):
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return path
+
+
+def isResultStore(path):
+    return isinstance(path, (str, os.PathLike)) and os.path.isfile(os.path.join(path, 'keywords.parquet'))
+
+
+def storeDigest(path=STORE_PATH):
+    # content hash of both tables, used as the cache key of the analysis (the path is reused across datasets)
+    digest = hashlib.sha256()
+    for name in ('keywords.parquet', 'references.parquet', 'items.parquet'):
+        if name == 'items.parquet' and not os.path.exists(os.path.join(path, name)):
+            continue
+        with open(os.path.join(path, name), 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def readResultStore(path=STORE_PATH, location_code=None, language_code=None):
+    """
+    - Return (keywords, aio, references) DataFrames, reading only the columns analysis needs
+    - location/language filters and the has_aio flag are pushed down to the Parquet reader
+    """
+    filters = []
+    if location_code is not None:
+        filters.append(('location_code', '=', int(location_code)))
+    if language_code is not None:
+        filters.append(('language_code', '=', language_code))
+
+    keywords_file = os.path.join(path, 'keywords.parquet')
+    keywords = pq.read_table(keywords_file, columns=['keyword_id', 'keyword'], filters=filters or None).to_pandas()
+    aio = pq.read_table(keywords_file, columns=['keyword_id', 'keyword', 'markdown'], filters=filters + [('has_aio', '=', True)]).to_pandas()
+
+    # references of filtered-out keywords are skipped at read time as well
+    reference_filters = [('keyword_id', 'in', aio['keyword_id'].tolist())] if filters else None
+    # domain/source/url stay dictionary encoded and arrive as categoricals
+    references = pq.read_table(
+        os.path.join(path, 'references.parquet'), filters=reference_filters, read_dictionary=['domain', 'source', 'url']
+    ).to_pandas()
+
+    # missing markdown comes back as None, like in the raw records
+    aio['markdown'] = aio['markdown'].astype(object).where(aio['markdown'].notna(), None)
+    return keywords, aio, references
+
+
+def readResultItems(path=STORE_PATH):
+    """
+    - The organic / featured snippet items of a store written with item_types (None otherwise)
+    - type/domain/url arrive as categoricals, missing ranks as 0, the captured types are in df.attrs['item_types']
+    """
+    items_file = os.path.join(path, 'items.parquet')
+    if not os.path.exists(items_file):
+        return None
+    table = pq.read_table(items_file, read_dictionary=['type', 'domain', 'url'])
+    items = table.to_pandas()
+    items['rank'] = items['rank'].fillna(0).astype(np.int16)
+    items.attrs['item_types'] = tuple(filter(None, table.schema.metadata[b'item_types'].decode().split(',')))
+    return items
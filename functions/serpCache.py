@@ -0,0 +1,101 @@
+# This module keeps fetched SERP results in a local SQLite file so only missing or stale keywords hit the API
+
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+# configure cache file, time to live and size bound
+CACHE_FILE = os.getenv('SERP_CACHE_FILE', 'serp-cache.sqlite')
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 200000
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def _connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS serp (key TEXT PRIMARY KEY, result BLOB, size INTEGER, fetched_at REAL, used_at REAL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS serp_used_at ON serp (used_at)")
+    connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+    return connection
+
+
+def _count(connection, name, value):
+    connection.execute("INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, value))
+
+
+def cacheKey(keyword, task):
+    # normalized keyword + every other task field (location, language, depth flags)
+    keyword = ' '.join(str(keyword).split()).casefold()
+    params = {key: value for key, value in task.items() if key not in ('keyword', 'tag')}
+    ## the app passes the location as text ('2740') and the CLI as a number (2740), both are the same entry
+    if params.get('location_code') is not None:
+        params['location_code'] = int(params['location_code'])
+    return json.dumps([keyword, params], sort_keys=True, ensure_ascii=False)
+
+
+def readCache(keys, ttl=CACHE_TTL, path=CACHE_FILE):
+    """
+    - Return {key: result} for keys cached within ttl seconds
+    - Refresh their last use (for LRU eviction) and count hits and misses
+    """
+    found = {}
+    now = time.time()
+    with _connect(path) as connection:
+        unique_keys = list(dict.fromkeys(keys))
+        # sqlite caps the number of bound parameters per statement
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i:i + 500]
+            rows = connection.execute(
+                f"SELECT key, result FROM serp WHERE fetched_at >= ? AND key IN ({','.join('?' * len(chunk))})",
+                [now - ttl] + chunk
+            ).fetchall()
+            for key, result in rows:
+                found[key] = json.loads(zlib.decompress(result))
+            connection.executemany("UPDATE serp SET used_at = ? WHERE key = ?", [(now, key) for key, _ in rows])
+
+        _count(connection, 'hits', len(found))
+        _count(connection, 'misses', len(unique_keys) - len(found))
+    connection.close()
+    return found
+
+
+def writeCache(entries, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, path=CACHE_FILE):
+    # store {key: result}, then evict least recently used rows beyond the entry and byte bounds
+    now = time.time()
+    rows = []
+    for key, result in entries.items():
+        blob = zlib.compress(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+        rows.append((key, blob, len(blob), now, now))
+
+    with _connect(path) as connection:
+        connection.executemany("INSERT OR REPLACE INTO serp VALUES (?, ?, ?, ?, ?)", rows)
+
+        count, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM serp").fetchone()
+        if count > max_entries or total > max_bytes:
+            evicted = []
+            for key, size in connection.execute("SELECT key, size FROM serp ORDER BY used_at").fetchall():
+                if count <= max_entries and total <= max_bytes:
+                    break
+                evicted.append((key,))
+                count -= 1
+                total -= size
+            connection.executemany("DELETE FROM serp WHERE key = ?", evicted)
+            _count(connection, 'evictions', len(evicted))
+    connection.close()
+
+
+def cacheStats(path=CACHE_FILE):
+    # cumulative hit/miss/eviction counters plus current size
+    with _connect(path) as connection:
+        stats = dict(connection.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM serp").fetchone()
+    connection.close()
+    return {
+        'hits': stats.get('hits', 0),
+        'misses': stats.get('misses', 0),
+        'evictions': stats.get('evictions', 0),
+        'entries': entries,
+        'size_bytes': size
+    }
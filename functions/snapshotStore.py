@@ -0,0 +1,203 @@
+# This module keeps every analysis run as a snapshot in a local SQLite file (project/date/location) and compares runs without reloading raw JSON
+
+import os
+import sqlite3
+import time
+from datetime import date
+import numpy as np
+import pandas as pd
+from functions.registrableDomain import domainIndex, matchDomain
+
+# configure the snapshot file
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', 'snapshots.sqlite')
+
+
+def _connect(path):
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id INTEGER PRIMARY KEY, project TEXT, run_date TEXT, location_code INTEGER, language_code TEXT,
+            keywords INTEGER, ai_overviews INTEGER, created_at REAL,
+            UNIQUE (project, run_date, location_code, language_code)
+        );
+        CREATE TABLE IF NOT EXISTS keywords (
+            run_id INTEGER, keyword TEXT, has_aio INTEGER, references_count INTEGER,
+            PRIMARY KEY (run_id, keyword)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS refs (
+            run_id INTEGER, keyword TEXT, rank INTEGER, source TEXT, domain TEXT, registrable TEXT,
+            PRIMARY KEY (run_id, keyword, rank)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS refs_source ON refs (run_id, source);
+        CREATE INDEX IF NOT EXISTS refs_registrable ON refs (run_id, registrable);
+        CREATE TABLE IF NOT EXISTS mentions (
+            run_id INTEGER, keyword TEXT, source TEXT,
+            PRIMARY KEY (run_id, keyword, source)
+        ) WITHOUT ROWID;
+    """)
+    return connection
+
+
+def _values(categorical, codes):
+    # category values at codes, None for missing (code -1)
+    values = np.append(np.asarray(categorical.categories, dtype=object), None)
+    return values[codes].tolist()
+
+
+def saveSnapshot(prepared, project, run_date=None, location_code=None, language_code=None, path=SNAPSHOT_FILE):
+    """
+    - Store the keyword, reference and mention tables of a prepareAnalysis result as one run, returns its run_id
+    - A run is keyed by project, date (today by default), location and language, saving the same key again replaces it
+    """
+    run_date = str(run_date or date.today().isoformat())
+    location_code = int(location_code) if location_code not in (None, '') else None
+    keywords_df = prepared['keywords_df']
+    aio_rows = prepared['aio_rows']
+    references = prepared['references']
+
+    ## keyword of every overview row, then one row per keyword (the first occurrence, like the analysis)
+    aio_keywords = np.empty(prepared['ai_overviews_found'], dtype=object)
+    aio_keywords[aio_rows[aio_rows >= 0]] = keywords_df['keyword'].to_numpy()[aio_rows >= 0]
+    counts = np.diff(references['offsets'])
+    keyword_rows, mention_rows, seen = [], [], set()
+    for keyword, row, names in zip(keywords_df['keyword'].tolist(), aio_rows.tolist(), keywords_df['mentioned_brands'].tolist()):
+        if keyword in seen:
+            continue
+        seen.add(keyword)
+        keyword_rows.append((keyword, int(row >= 0), int(counts[row]) if row >= 0 else 0))
+        mention_rows.extend((keyword, name) for name in names)
+
+    domain_codes = references['domain'].codes
+    registrable = np.append(np.asarray(prepared['domain_index']['registrable'], dtype=object), None)
+    registrable = registrable[np.where(domain_codes >= 0, prepared['domain_index']['codes'][domain_codes], -1)].tolist()
+    reference_rows = zip(aio_keywords[references['row']].tolist(), references['rank'].tolist(),
+                         _values(references['source'], references['source'].codes), _values(references['domain'], domain_codes), registrable)
+
+    with _connect(path) as connection:
+        old = connection.execute("SELECT run_id FROM runs WHERE project = ? AND run_date = ? AND location_code IS ? AND language_code IS ?",
+                                 (project, run_date, location_code, language_code)).fetchone()
+        if old:
+            for table in ('runs', 'keywords', 'refs', 'mentions'):
+                connection.execute(f"DELETE FROM {table} WHERE run_id = ?", old)
+        run_id = connection.execute("INSERT INTO runs VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)",
+                                    (project, run_date, location_code, language_code, len(keyword_rows), prepared['ai_overviews_found'], time.time())).lastrowid
+        connection.executemany("INSERT INTO keywords VALUES (?, ?, ?, ?)", ((run_id,) + row for row in keyword_rows))
+        connection.executemany("INSERT INTO refs VALUES (?, ?, ?, ?, ?, ?)", ((run_id,) + row for row in reference_rows))
+        connection.executemany("INSERT INTO mentions VALUES (?, ?, ?)", ((run_id,) + row for row in mention_rows))
+    connection.close()
+    return run_id
+
+
+def listRuns(project=None, path=SNAPSHOT_FILE):
+    with _connect(path) as connection:
+        runs = pd.read_sql_query("SELECT * FROM runs WHERE ? IS NULL OR project = ? ORDER BY project, location_code, language_code, run_date",
+                                 connection, params=(project, project))
+    connection.close()
+    return runs
+
+
+def findRun(project, run_date=None, location_code=None, language_code=None, path=SNAPSHOT_FILE):
+    # run_id of a project run (the latest one without run_date), None when there is none
+    location_code = int(location_code) if location_code not in (None, '') else None
+    with _connect(path) as connection:
+        row = connection.execute(
+            "SELECT run_id FROM runs WHERE project = ? AND (? IS NULL OR run_date = ?) AND (? IS NULL OR location_code = ?) AND (? IS NULL OR language_code = ?) "
+            "ORDER BY run_date DESC, run_id DESC LIMIT 1",
+            (project, run_date, run_date, location_code, location_code, language_code, language_code)
+        ).fetchone()
+    connection.close()
+    return row[0] if row else None
+
+
+def previousRun(run_id, path=SNAPSHOT_FILE):
+    # the run before run_id with the same project, location and language
+    with _connect(path) as connection:
+        row = connection.execute(
+            "SELECT previous.run_id FROM runs current JOIN runs previous ON previous.project = current.project "
+            "AND previous.location_code IS current.location_code AND previous.language_code IS current.language_code "
+            "AND (previous.run_date < current.run_date OR (previous.run_date = current.run_date AND previous.run_id < current.run_id)) "
+            "WHERE current.run_id = ? ORDER BY previous.run_date DESC, previous.run_id DESC LIMIT 1",
+            (run_id,)
+        ).fetchone()
+    connection.close()
+    return row[0] if row else None
+
+
+def citationShareChange(before_run, after_run, by='source', path=SNAPSHOT_FILE):
+    """
+    - Citations and citation share (citations / all citations of the run) per competitor in both runs, by='source' or 'registrable' domain
+    - Competitors cited in only one of the runs have 0 on the other side, sorted by the share change
+    """
+    if by not in ('source', 'registrable'):
+        raise ValueError("by must be 'source' or 'registrable'")
+    with _connect(path) as connection:
+        counts = pd.read_sql_query(
+            f"SELECT run_id, {by} AS competitor, COUNT(*) AS citations FROM refs WHERE run_id IN (?, ?) AND {by} IS NOT NULL AND {by} != '' GROUP BY run_id, {by}",
+            connection, params=(before_run, after_run)
+        )
+    connection.close()
+
+    table = counts.pivot(index='competitor', columns='run_id', values='citations')
+    table = table.reindex(columns=[before_run, after_run]).fillna(0).astype(np.int64)
+    result = pd.DataFrame({'competitor': table.index, 'citations_before': table[before_run].to_numpy(), 'citations_after': table[after_run].to_numpy()})
+    for side in ('before', 'after'):
+        total = result[f"citations_{side}"].sum()
+        result[f"share_{side}"] = result[f"citations_{side}"] / total if total else 0.0
+    result['share_change'] = result['share_after'] - result['share_before']
+    result['citations_change'] = result['citations_after'] - result['citations_before']
+    return result.sort_values('share_change', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def aioChanges(before_run, after_run, path=SNAPSHOT_FILE):
+    # keywords of both runs whose AI overview appeared ('gained') or disappeared ('lost')
+    with _connect(path) as connection:
+        changes = pd.read_sql_query(
+            "SELECT after.keyword, before.has_aio AS had_aio, after.has_aio, "
+            "CASE WHEN after.has_aio THEN 'gained' ELSE 'lost' END AS change "
+            "FROM keywords after JOIN keywords before ON before.run_id = ? AND before.keyword = after.keyword "
+            "WHERE after.run_id = ? AND before.has_aio != after.has_aio ORDER BY change, after.keyword",
+            connection, params=(before_run, after_run)
+        )
+    connection.close()
+    changes[['had_aio', 'has_aio']] = changes[['had_aio', 'has_aio']].astype(bool)
+    return changes
+
+
+def brandRankMovement(before_run, after_run, brand_name, brand_domain, path=SNAPSHOT_FILE):
+    """
+    - Best citation rank of the brand per keyword in both runs, same matching rules as analyzeDataFrame
+    - movement = rank_before - rank_after (positive is better), status: up, down, same, new (cited now only) or lost
+    """
+    with _connect(path) as connection:
+        ## the brand's sources and registrable domains are picked out of the distinct ones in both runs with the analysis' rules
+        def distinct(column):
+            return [value for value, in connection.execute(
+                f"SELECT DISTINCT {column} FROM refs WHERE run_id IN (?, ?) AND {column} IS NOT NULL", (before_run, after_run)
+            )]
+
+        sources = [source for source in distinct('source') if brand_name in source.lower()]
+        domains = distinct('registrable')
+        domains = [domain for domain, hit in zip(domains, matchDomain(domainIndex(domains), brand_domain)) if hit]
+
+        ranks = pd.read_sql_query(
+            f"SELECT run_id, keyword, MIN(rank) AS rank FROM refs WHERE run_id IN (?, ?) "
+            f"AND (source IN ({','.join('?' * len(sources))}) OR registrable IN ({','.join('?' * len(domains))})) GROUP BY run_id, keyword",
+            connection, params=[before_run, after_run] + sources + domains
+        )
+        keywords = pd.read_sql_query(
+            "SELECT keyword FROM keywords WHERE run_id = ? UNION SELECT keyword FROM keywords WHERE run_id = ?",
+            connection, params=(before_run, after_run)
+        )
+    connection.close()
+
+    table = ranks.pivot(index='keyword', columns='run_id', values='rank').reindex(columns=[before_run, after_run]).astype(float)
+    movement = keywords.join(table, on='keyword').rename(columns={before_run: 'rank_before', after_run: 'rank_after'})
+    movement = movement[movement['rank_before'].notna() | movement['rank_after'].notna()].reset_index(drop=True)
+    movement['movement'] = movement['rank_before'] - movement['rank_after']
+    movement['status'] = np.select(
+        [movement['rank_before'].isna(), movement['rank_after'].isna(), movement['movement'] > 0, movement['movement'] < 0],
+        ['new', 'lost', 'up', 'down'], 'same'
+    )
+    order = {'up': 0, 'down': 1, 'new': 2, 'lost': 3, 'same': 4}
+    return movement.sort_values(['status', 'movement'], key=lambda column: column.map(order) if column.name == 'status' else -column,
+                                kind='stable').reset_index(drop=True)
@@ -0,0 +1,200 @@
+# This function reads SERP records one at a time from a saved API file, so large exports never sit in memory whole
+
+import gzip
+import io
+import json
+import os
+import re
+
+# configure read size and the SERP item types kept for analysis
+CHUNK_SIZE = 1 << 16
+KEEP_ITEM_TYPES = {'ai_overview'}
+
+_WHITESPACE = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+
+
+def _open_text(source):
+    # path or uploaded file object, gzip/zstd detected from the magic bytes
+    if isinstance(source, (str, os.PathLike)):
+        raw = open(source, 'rb')
+    elif hasattr(source, 'getvalue'):
+        # in-memory uploads: a fresh reader over the same bytes, so the upload itself isn't consumed or closed
+        raw = io.BytesIO(source.getvalue())
+    else:
+        raw = source
+    raw = raw if hasattr(raw, 'peek') else io.BufferedReader(raw)
+    magic = raw.peek(4)[:4]
+
+    if magic[:2] == b'\x1f\x8b':
+        raw = gzip.GzipFile(fileobj=raw)
+    elif magic == b'\x28\xb5\x2f\xfd':
+        # zstandard is only needed for .zst files
+        import zstandard
+        raw = zstandard.ZstdDecompressor().stream_reader(raw)
+    return io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+
+
+def _slim(record, item_types=()):
+    # keep only what analysis reads: keyword, location/language and the wanted items with their used fields
+    if not isinstance(record, dict):
+        return None
+    items = []
+    for item in record.get('items') or []:
+        if not isinstance(item, dict) or not isinstance(item.get('type'), str):
+            continue
+        # organic / featured snippet items collected for the brand's organic rank
+        if item['type'] in item_types:
+            items.append({'type': item['type'], 'rank_group': item.get('rank_group'), 'domain': item.get('domain'), 'url': item.get('url')})
+            continue
+        if item['type'] not in KEEP_ITEM_TYPES:
+            # other ai_overview* types still mark the keyword as having an overview
+            if 'ai_overview' in item['type']:
+                items.append({'type': item['type']})
+            continue
+        if item['type'] == 'ai_overview':
+            item = {
+                'type': item['type'],
+                'markdown': item.get('markdown'),
+                'references': [
+                    {'domain': ref.get('domain', ''), 'source': ref.get('source', ''), 'url': ref.get('url', '')}
+                    for ref in item.get('references') or []
+                ] or None
+            }
+        items.append(item)
+    return {
+        'keyword': record.get('keyword'),
+        'location_code': record.get('location_code'),
+        'language_code': record.get('language_code'),
+        'items': items
+    }
+
+
+def _unwrap(value):
+    # a value can be a record, the one-element result list of a task, or a checkpoint line
+    if isinstance(value, dict) and 'result' in value and 'key' in value:
+        value = value['result']
+    if isinstance(value, list):
+        for record in value:
+            yield record
+    elif value is not None:
+        yield value
+
+
+def _iter_values(stream, head):
+    """
+    - Incrementally parse '[v, v, ...]' or pandas to_json '{"col": {"row": v, ...}, ...}'
+    - Yield every v, holding at most one value plus one chunk in memory
+    """
+    buffer = head
+    pos = 0
+    exhausted = False
+
+    def fill():
+        nonlocal buffer, pos, exhausted
+        chunk = stream.read(max(CHUNK_SIZE, len(buffer) - pos))
+        exhausted = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return not exhausted
+
+    def peek():
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer) or not fill():
+                return buffer[pos:pos + 1]
+
+    def take(char):
+        nonlocal pos
+        if peek() != char:
+            raise ValueError(f"Expected '{char}' in JSON file")
+        pos += 1
+
+    def value():
+        nonlocal pos
+        while True:
+            peek()
+            try:
+                result, end = _decoder.raw_decode(buffer, pos)
+                # a number cut at the chunk edge would still parse, so only trust values followed by more text
+                if end < len(buffer) or exhausted:
+                    pos = end
+                    return result
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+            fill()
+
+    def members(close):
+        # step through the members of an object or array, consuming the commas between them
+        first = True
+        while peek() != close:
+            if not first:
+                take(',')
+            first = False
+            yield
+
+    opening = peek()
+    if opening == '[':
+        take('[')
+        for _ in members(']'):
+            yield value()
+        take(']')
+    elif opening == '{':
+        take('{')
+        for _ in members('}'):
+            value()
+            take(':')
+            take('{')
+            for _ in members('}'):
+                value()
+                take(':')
+                yield value()
+            take('}')
+        take('}')
+
+
+def streamRecords(source, slim=True, item_types=()):
+    """
+    - Yield SERP records from a to_json file, a JSON array, or NDJSON (checkpoint lines or plain records)
+    - Works on plain, .gz and .zst files, records are slimmed to the fields analysis needs (plus the item_types items)
+    """
+    with _open_text(source) as stream:
+        head = stream.read(CHUNK_SIZE)
+
+        # pandas to_json starts with a column label, NDJSON lines start with a record field
+        if re.match(r'\s*(\[|\{\s*"\d+"\s*:)', head):
+            values = _iter_values(stream, head)
+        else:
+            values = (json.loads(line) for line in _lines(stream, head) if line.strip())
+
+        for value in values:
+            for record in _unwrap(value):
+                record = _slim(record, item_types) if slim else record
+                if record is not None:
+                    yield record
+
+
+def checkpointRecords(checkpoint_file, keywords, item_types=()):
+    """
+    - Records from the checkpoint in the order of keywords (it is written in completion order), duplicates repeated
+    - Records are slimmed while reading, so only the AI overview part of each result is kept in memory
+    """
+    by_keyword = {}
+    for record in streamRecords(checkpoint_file, item_types=item_types):
+        by_keyword.setdefault(record.get('keyword'), record)
+    for keyword in keywords:
+        if keyword in by_keyword:
+            yield by_keyword[keyword]
+    ## keywords the API echoed back differently are kept at the end
+    wanted = set(keywords)
+    for keyword, record in by_keyword.items():
+        if keyword not in wanted:
+            yield record
+
+
+def _lines(stream, head):
+    # lines of the already read head chunk continue into the rest of the stream
+    yield from io.StringIO(head + stream.readline())
+    yield from stream
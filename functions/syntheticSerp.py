@@ -0,0 +1,127 @@
+# This function generates realistic DataForSEO SERP results (organic items + AI overviews) for benchmarks and the mock server
+
+import random
+
+# configure the default shape of the generated data
+AIO_RATE = 0.6
+REFERENCES_PER_OVERVIEW = 6
+VOCABULARY_SIZE = 300
+MARKDOWN_WORDS = 150
+DUPLICATE_RATE = 0.01
+
+WORDS = [
+    'seo', 'marketing', 'ai', 'google', 'website', 'content', 'backlink', 'tìm kiếm', 'dịch vụ', 'công ty',
+    'giá', 'tốt nhất', 'là gì', 'hướng dẫn', 'chi phí', 'doanh nghiệp', 'khách hàng', 'Việt Nam', 'Hà Nội', 'TP.HCM'
+]
+FILLER = [
+    'là', 'của', 'và', 'cho', 'các', 'với', 'một', 'được', 'trong', 'khi', 'the', 'best', 'for', 'how', 'to',
+    'giúp', 'tăng', 'hiệu quả', 'chiến lược', 'công cụ', 'phân tích', 'thứ hạng', 'nội dung', 'người dùng'
+]
+TLDS = ['.com', '.vn', '.com.vn', '.net', '.io']
+
+
+def competitorVocabulary(size=VOCABULARY_SIZE, seed=0):
+    # (source name, domain) pairs, a few multi-word and Vietnamese names like real AI overview sources
+    rnd = random.Random(f"vocabulary:{seed}")
+    vocabulary = []
+    for i in range(size):
+        name = rnd.choice(['Brand', 'Agency', 'Media', 'Digital', 'Tech', 'Việt', 'Sài Gòn', 'Hub']) + f" {i}"
+        if i % 7 == 0:
+            name = name.replace(' ', '')
+        domain = name.lower().replace(' ', '').replace('ệ', 'e').replace('à', 'a').replace('ò', 'o') + rnd.choice(TLDS)
+        vocabulary.append((name, domain))
+    return vocabulary
+
+
+def syntheticRecord(keyword, seed=0, location_code=2704, language_code='vi', aio_rate=AIO_RATE, references_per_overview=REFERENCES_PER_OVERVIEW,
+                    vocabulary_size=VOCABULARY_SIZE, markdown_words=MARKDOWN_WORDS, vocabulary=None):
+    """
+    - One 'live/advanced' result for keyword, the same keyword and seed always give the same result
+    - Competitor popularity is skewed (a few sources are cited a lot, a long tail rarely), like real overviews
+    """
+    rnd = random.Random(f"{seed}:{keyword}")
+    vocabulary = vocabulary or competitorVocabulary(vocabulary_size, seed)
+
+    def competitor():
+        return vocabulary[int(len(vocabulary) * rnd.random() ** 2)]
+
+    items = []
+    for rank in range(1, 11):
+        name, domain = competitor()
+        items.append({
+            'type': 'organic',
+            'rank_group': rank,
+            'rank_absolute': rank + 1,
+            'domain': domain,
+            'title': f"{keyword} - {name}",
+            'url': f"https://{domain}/{rnd.randint(1, 9999)}",
+            'description': ' '.join(rnd.choice(FILLER + WORDS) for _ in range(25))
+        })
+
+    if rnd.random() < aio_rate:
+        references = []
+        for _ in range(rnd.randint(0, 2 * references_per_overview)):
+            name, domain = competitor()
+            host = rnd.choice([domain, 'www.' + domain])
+            references.append({
+                'type': 'ai_overview_reference',
+                'source': name,
+                'domain': host,
+                'url': f"https://{host}/{rnd.randint(1, 9999)}",
+                'title': f"{keyword} - {name}",
+                'text': ' '.join(rnd.choice(FILLER) for _ in range(12))
+            })
+
+        ## markdown with mentions, bullet lines, citation links, plain links and an image, like the API returns
+        lines = []
+        words = 0
+        while words < markdown_words:
+            sentence = [rnd.choice(FILLER + WORDS) for _ in range(rnd.randint(6, 14))]
+            if rnd.random() < 0.4:
+                sentence.insert(rnd.randrange(len(sentence)), competitor()[0])
+            if references and rnd.random() < 0.5:
+                sentence.append(f"[[{rnd.randint(1, len(references))}]]({rnd.choice(references)['url']})")
+            if rnd.random() < 0.1:
+                sentence.insert(0, f"[{rnd.choice(WORDS)}](https://{competitor()[1]}/)")
+            words += len(sentence)
+            lines.append(('- ' if rnd.random() < 0.3 else '') + ' '.join(sentence) + '.')
+        if rnd.random() < 0.2:
+            lines.append(f"![{keyword}](https://{competitor()[1]}/image.png)")
+
+        items.insert(rnd.randint(0, 2), {
+            'type': 'ai_overview',
+            'rank_group': 1,
+            'markdown': '\n'.join(lines),
+            'references': references or None,
+            'items': []
+        })
+
+    return {
+        'keyword': keyword,
+        'type': 'organic',
+        'se_domain': 'google.com.vn',
+        'location_code': location_code,
+        'language_code': language_code,
+        'check_url': f"https://www.google.com.vn/search?q={keyword.replace(' ', '+')}",
+        'datetime': '2025-01-01 00:00:00 +00:00',
+        'spell': None,
+        'refinement_chips': None,
+        'item_types': sorted({item['type'] for item in items}),
+        'se_results_count': rnd.randint(10 ** 5, 10 ** 8),
+        'items_count': len(items),
+        'items': items
+    }
+
+
+def syntheticSerp(n_keywords, seed=0, duplicate_rate=DUPLICATE_RATE, **options):
+    # n_keywords records with distinct keywords (plus a few repeated ones), options are passed to syntheticRecord
+    rnd = random.Random(f"keywords:{seed}")
+    vocabulary = competitorVocabulary(options.pop('vocabulary_size', VOCABULARY_SIZE), seed)
+    records = []
+    for i in range(n_keywords):
+        if records and rnd.random() < duplicate_rate:
+            keyword = rnd.choice(records)['keyword']
+        else:
+            keyword = f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {i}"
+        records.append(syntheticRecord(keyword, seed=seed, vocabulary=vocabulary, **options))
+    return records
@@ -0,0 +1,21 @@
+import pytest
+
+import functions.fetchKeywords as fetch_module
+from functions.mockServer import startMockServer
+
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    # start a mock DataForSEO server with the given options and point fetchKeywords at it, returns the server
+    servers = []
+
+    def start(**options):
+        server, url = startMockServer(latency=0, **options)
+        servers.append(server)
+        monkeypatch.setattr(fetch_module, 'url', url)
+        monkeypatch.setattr(fetch_module, 'headers', {'Authorization': 'Basic bW9jazptb2Nr', 'Content-Type': 'application/json'})
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
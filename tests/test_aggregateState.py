@@ -0,0 +1,87 @@
+import pandas as pd
+
+import functions.aggregateState as aggregate_module
+from functions.aggregateState import createState, loadState, mergeStates, saveState, stateResults, updateState
+from functions.prepareAnalysis import prepareAnalysis
+from functions.syntheticSerp import syntheticSerp
+
+
+def overview_record(keyword, markdown, sources):
+    return {
+        'keyword': keyword,
+        'location_code': 2704,
+        'language_code': 'vi',
+        'items': [{
+            'type': 'ai_overview',
+            'markdown': markdown,
+            'references': [{'source': source, 'domain': f"site{i}.vn", 'url': f"https://site{i}.vn/"} for i, source in enumerate(sources)]
+        }]
+    }
+
+
+def assert_same_as_full_run(state, records):
+    full = prepareAnalysis(pd.DataFrame({'raw_data': records}), workers=1)
+    result = stateResults(state)
+    assert result['keywords_analyzed'] == full['keywords_analyzed']
+    assert result['ai_overviews_found'] == full['ai_overviews_found']
+    pd.testing.assert_frame_equal(result['competitors_df'], full['competitors_df'][list(result['competitors_df'].columns)], check_dtype=False)
+
+
+def test_batches_with_new_names_match_a_full_run():
+    # later batches come from other vocabulary seeds, most of their cited names are new to the state
+    batches = [syntheticSerp(400, seed=1)[:200], syntheticSerp(400, seed=1)[200:], syntheticSerp(300, seed=2), syntheticSerp(300, seed=3)]
+    state = createState()
+    for batch in batches:
+        updateState(state, batch)
+    assert_same_as_full_run(state, [record for batch in batches for record in batch])
+
+
+def test_new_names_are_found_in_earlier_overviews_across_case_folding():
+    ## earlier overviews mention the names only in other cases, including pairs lower() does not map together
+    earlier = [
+        overview_record('a', 'ISTANBUL MEDIA là công ty', ['Other']),
+        overview_record('b', 'dịch vụ của ſeo hub và Kelvin Tech', ['Other']),
+        overview_record('c', 'istanbul và media, không phải cùng một tên', ['Other']),
+        overview_record('d', 'nội dung Việt 12', ['Other']),
+    ]
+    later = [overview_record('e', 'İstanbul Media, SEO Hub, KELVIN tech, VIỆT 12', ['İstanbul Media', 'SEO Hub', 'Kelvin Tech', 'việt 12'])]
+    state = updateState(createState(), earlier)
+    updateState(state, later)
+    assert_same_as_full_run(state, earlier + later)
+    mentioned = dict(zip(stateResults(state)['competitors_df']['brand'], stateResults(state)['competitors_df']['mentioned']))
+    assert mentioned == {'Other': 0, 'İstanbul Media': 2, 'SEO Hub': 2, 'Kelvin Tech': 2, 'việt 12': 2}
+
+
+def test_replace_merge_and_reload(tmp_path):
+    first, second = syntheticSerp(300, seed=4), syntheticSerp(300, seed=5)
+    state = updateState(createState(), first)
+    updateState(state, first[:100], replace=True)
+    mergeStates(state, updateState(createState(), second))
+
+    path = str(tmp_path / 'state.json.gz')
+    saveState(state, path)
+    reloaded = loadState(path)
+    updateState(reloaded, syntheticSerp(100, seed=6))
+    ## replace drops every earlier row of the refetched keywords, duplicates included
+    replaced = {record['keyword'] for record in first[:100]}
+    kept = [record for record in first if record['keyword'] not in replaced]
+    assert_same_as_full_run(reloaded, kept + first[:100] + second + syntheticSerp(100, seed=6))
+
+
+def test_full_vocabulary_matcher_is_kept_between_updates(monkeypatch, tmp_path):
+    builds = []
+    build = aggregate_module.buildMentionScanner
+    monkeypatch.setattr(aggregate_module, 'buildMentionScanner', lambda names: builds.append(len(names)) or build(names))
+    records = syntheticSerp(600, seed=1)
+    state = updateState(createState(), records[:300])
+    assert len(builds) == 1
+
+    ## batches citing only known names reuse the kept matcher, new names rebuild it once plus a matcher over just them
+    updateState(state, [record for record in records[300:] if all(
+        ref['source'] in state['competitors'] for item in record['items'] if item['type'] == 'ai_overview' for ref in item['references'] or [])])
+    assert len(builds) == 1
+    names = len(state['competitors'])
+    updateState(state, syntheticSerp(50, seed=9))
+    assert len(builds) == 3 and builds[1] > names and builds[2] == len(state['competitors']) - names
+    saveState(state, str(tmp_path / 'state.json.gz'))
+    assert '_scanner' not in loadState(str(tmp_path / 'state.json.gz'))
@@ -0,0 +1,63 @@
+import pandas as pd
+
+from functions.prepareAnalysis import prepareAnalysis
+from functions.syntheticSerp import syntheticSerp
+
+COLUMNS = ['cited_count', 'unique_domains', 'average_rank', 'cited_probability', 'cited_in_prompts', 'prompt_cited_rate']
+
+
+def per_brand_loop(records):
+    # the competitor aggregation as it was before the grouped pass: one filter over every citation per brand
+    df_aio = pd.DataFrame([
+        {'keyword': record['keyword'], 'items': record['items']}
+        for record in records if any('ai_overview' in item['type'] for item in record['items'])
+    ]).drop_duplicates('keyword')
+
+    def references(items):
+        overview = [item for item in items if item['type'] == 'ai_overview']
+        refs = overview[0]['references'] if overview else None
+        return [{'rank': rank, 'domain': ref.get('domain', ''), 'source': ref.get('source', ''), 'url': ref.get('url', '')}
+                for rank, ref in enumerate(refs, start=1)] if refs else None
+
+    df_aio['aio_references'] = df_aio['items'].apply(references)
+    extracted_ref = pd.DataFrame(df_aio['aio_references'].explode().reset_index(drop=True))
+    extracted_ref['domain'] = extracted_ref['aio_references'].apply(lambda x: x['domain'] if x else None)
+    extracted_ref['name'] = extracted_ref['aio_references'].apply(lambda x: x['source'] if x else None)
+    extracted_ref['rank'] = extracted_ref['aio_references'].apply(lambda x: x['rank'] if x else None)
+
+    brand_list = []
+    for brand in filter(None, extracted_ref['name'].drop_duplicates().dropna().tolist()):
+        cited = extracted_ref[extracted_ref['name'] == brand]
+        cited_in_prompts = df_aio[df_aio['aio_references'].apply(lambda refs: any(ref and ref.get('source') == brand for ref in refs) if refs else False)].shape[0]
+        brand_list.append({
+            'brand': brand,
+            'cited_count': cited.shape[0],
+            'unique_domains': cited['domain'].unique().tolist(),
+            'average_rank': cited['rank'].mean(),
+            'cited_probability': cited.shape[0] / extracted_ref.shape[0],
+            'cited_in_prompts': cited_in_prompts,
+            'prompt_cited_rate': cited_in_prompts / df_aio.shape[0]
+        })
+    return pd.DataFrame(brand_list).set_index('brand')
+
+
+def test_competitor_columns_match_per_brand_loop():
+    records = syntheticSerp(3000, seed=7)
+    expected = per_brand_loop(records)
+    competitors = prepareAnalysis(records, workers=1)['competitors_df'].set_index('brand')
+
+    assert sorted(competitors.index) == sorted(expected.index)
+    competitors = competitors.loc[expected.index, COLUMNS]
+    assert competitors['unique_domains'].tolist() == expected['unique_domains'].tolist()
+    pd.testing.assert_frame_equal(competitors.drop(columns=['unique_domains']), expected[COLUMNS].drop(columns=['unique_domains']),
+                                  check_dtype=False, check_names=False)
+
+
+def test_worker_shards_match_the_serial_run():
+    # every shard is cleaned, scanned and grouped by its own worker, the added-up totals must not depend on the split
+    records = syntheticSerp(3000, seed=8, duplicate_rate=0.05)
+    serial = prepareAnalysis(records, workers=1)
+    sharded = prepareAnalysis(records, workers=3)
+    pd.testing.assert_frame_equal(sharded['competitors_df'], serial['competitors_df'])
+    pd.testing.assert_frame_equal(sharded['keywords_df'], serial['keywords_df'])
+    assert sharded['aio_markdown'] == serial['aio_markdown']
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+
+import pytest
+
+import functions.fetchKeywords as fetch_module
+from functions.fetchKeywords import fetchKeywords
+from functions.serpCache import cacheKey
+
+KEYWORDS = [f"keyword {i}" for i in range(40)] + ['keyword 3']
+
+
+def fetch(checkpoint_file, **options):
+    # no cache and no rate limit, so only the server decides what comes back
+    return fetchKeywords(KEYWORDS, 2704, 'vi', use_cache=False, rate_limit=10 ** 6, checkpoint_file=str(checkpoint_file), load_result=False, **options)
+
+
+def checkpoint_results(path):
+    results = {}
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            entry = json.loads(line)
+            results[entry['keyword']] = entry['result']
+    return results
+
+
+def test_queued_backend_matches_live(mock_api, tmp_path):
+    mock_api(queue_delay=0.05)
+    live = fetch(tmp_path / 'live.ndjson', engine='async')
+    queued = fetch(tmp_path / 'queued.ndjson', backend='queued', poll_interval=0.05)
+
+    assert live['failed'] == [] and queued['failed'] == []
+    live_results = checkpoint_results(tmp_path / 'live.ndjson')
+    assert sorted(live_results) == sorted(set(KEYWORDS))
+    assert checkpoint_results(tmp_path / 'queued.ndjson') == live_results
+
+
+def test_faults_are_reported_as_failed(mock_api, monkeypatch, tmp_path):
+    # no retries, so every 429 and truncated body ends up in failed
+    monkeypatch.setattr(fetch_module, 'MAX_RETRIES', 0)
+    monkeypatch.setattr(fetch_module, 'backoffDelay', lambda attempt, retry_after=None: 0)
+    server = mock_api(error_rate=0.2, truncate_rate=0.2, seed=1)
+
+    for options in ({'engine': 'threads'}, {'engine': 'async'}, {'engine': 'async', 'batch_size': 5}):
+        checkpoint_file = tmp_path / 'faults.ndjson'
+        summary = fetch(checkpoint_file, **options)
+        failed = {entry['keyword'] for entry in summary['failed']}
+        stored = checkpoint_results(checkpoint_file)
+
+        assert failed, options
+        assert all(entry['status_code'] in (429, None) for entry in summary['failed'])
+        assert failed.isdisjoint(stored)
+        assert failed | set(stored) == set(KEYWORDS)
+        assert summary['cache']['fetched'] == len(set(KEYWORDS)) - len(summary['failed'])
+    assert server.stats['rate_limited'] and server.stats['truncated']
+
+
+def test_queued_tasks_never_ready_time_out(mock_api, monkeypatch, tmp_path):
+    monkeypatch.setattr(fetch_module, 'QUEUE_TIMEOUT', 0.3)
+    mock_api(queue_delay=60)
+    summary = fetch(tmp_path / 'queued.ndjson', backend='queued', poll_interval=0.05)
+
+    assert sorted(entry['keyword'] for entry in summary['failed']) == sorted(set(KEYWORDS))
+    assert all('not ready' in entry['status_message'] for entry in summary['failed'])
+    assert checkpoint_results(tmp_path / 'queued.ndjson') == {}
+
+
+def test_progress_callbacks_with_and_without_cached(mock_api, tmp_path):
+    # a resumed run reports every keyword as skipped, two-argument callbacks must not get the count
+    mock_api()
+    checkpoint_file = tmp_path / 'progress.ndjson'
+    fetch(checkpoint_file)
+    plain, counted = [], []
+    fetch(checkpoint_file, resume=True, progress_callback=lambda completed, total: plain.append((completed, total)))
+    fetch(checkpoint_file, resume=True, progress_callback=lambda completed, total, cached=0: counted.append((completed, total, cached)))
+
+    assert plain == [(len(KEYWORDS), len(KEYWORDS))]
+    assert counted == [(len(KEYWORDS), len(KEYWORDS), len(KEYWORDS))]
+
+
+def test_location_code_text_and_number_share_a_cache_key():
+    task = {'keyword': 'seo', 'location_code': 2740, 'language_code': 'vi', 'depth': 10}
+    assert cacheKey('SEO ', dict(task, location_code='2740')) == cacheKey('seo', task)
+
+
+def test_cache_is_written_off_the_event_loop(mock_api, monkeypatch, tmp_path):
+    # every cache batch goes to the writer thread, the event loop (main thread) never compresses or writes them
+    writes = []
+    monkeypatch.setattr(fetch_module, 'CACHE_FLUSH_SIZE', 8)
+    monkeypatch.setattr(fetch_module, 'readCache', lambda keys, ttl=None: {})
+    monkeypatch.setattr(fetch_module, 'writeCache', lambda entries: writes.append((threading.get_ident(), len(entries))))
+    mock_api()
+    summary = fetchKeywords(KEYWORDS, 2704, 'vi', engine='async', rate_limit=10 ** 6, checkpoint_file=str(tmp_path / 'cache.ndjson'), load_result=False)
+
+    assert summary['failed'] == []
+    assert sum(count for _, count in writes) == len(set(KEYWORDS))
+    assert len(writes) > 1 and threading.main_thread().ident not in {thread for thread, _ in writes}
+
+
+def test_every_run_gets_its_own_checkpoint(mock_api, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    mock_api()
+    first = fetchKeywords(KEYWORDS, 2704, 'vi', use_cache=False, rate_limit=10 ** 6, load_result=False)
+    second = fetchKeywords(KEYWORDS, 2704, 'vi', use_cache=False, rate_limit=10 ** 6, load_result=False)
+
+    assert first['checkpoint_file'] != second['checkpoint_file']
+    assert checkpoint_results(first['checkpoint_file']) == checkpoint_results(second['checkpoint_file'])
+    with pytest.raises(ValueError):
+        fetchKeywords(KEYWORDS, 2704, 'vi', resume=True)
+
+    ## a loaded run removes the checkpoint it created, the two kept above belong to their callers
+    loaded = fetchKeywords(KEYWORDS, 2704, 'vi', use_cache=False, rate_limit=10 ** 6)
+    assert len(loaded) == len(KEYWORDS) and loaded.attrs['checkpoint_file'] is None
+    assert sorted(path.name for path in tmp_path.glob('api-result-*.ndjson')) == sorted(
+        os.path.basename(summary['checkpoint_file']) for summary in (first, second))
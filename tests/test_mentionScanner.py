@@ -0,0 +1,24 @@
+import re
+
+from functions.mentionScanner import buildMentionScanner
+from functions.syntheticSerp import competitorVocabulary, syntheticSerp
+
+
+def per_name(names, text):
+    # one whole-word search per name, what the combined matcher replaces
+    return {name for name in names if re.search(r'\b' + re.escape(name) + r'\b', text, re.IGNORECASE)}
+
+
+def test_prefix_names_match_like_one_search_per_name():
+    names = ['Hub', 'Hub 1', 'Hub 12', 'hub 123', 'Việt', 'Việt Nam', 'SEO', 'SEO Hub']
+    scan = buildMentionScanner(names)
+    for text in ['hub 12 và Hub 123', 'VIỆT NAM, seo hub', 'Hub 1234 hub12', 'Việt']:
+        assert scan(text) == per_name(names, text), text
+
+
+def test_large_vocabulary_matches_one_search_per_name():
+    names = [name for name, _ in competitorVocabulary(2000)]
+    scan = buildMentionScanner(names)
+    for record in syntheticSerp(30, seed=2, vocabulary_size=2000, aio_rate=1):
+        markdown = next(item['markdown'] for item in record['items'] if item['type'] == 'ai_overview')
+        assert scan(markdown) == per_name(names, markdown)
@@ -0,0 +1,43 @@
+import pytest
+
+from functions.registrableDomain import domainIndex, matchDomain, normalizeHost, registrableDomain
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('blog.seongon.com.vn', 'seongon.com.vn'),
+    ('https://user@WWW.Seongon.com:443/path?q=1', 'seongon.com'),
+    ('seongon.com.', 'seongon.com'),
+    ## *.ck makes every second level a suffix, !www.ck takes www.ck back out of it
+    ('a.b.ck', 'a.b.ck'),
+    ('www.ck', 'www.ck'),
+    ('blog.www.ck', 'www.ck'),
+    ('x.city.kawasaki.jp', 'city.kawasaki.jp'),
+    ('a.b.kawasaki.jp', 'a.b.kawasaki.jp'),
+    ## IDN rules match in unicode and in punycode
+    ('shop.bücher.公司.cn', 'bücher.公司.cn'),
+    ('shop.xn--bcher-kva.xn--55qx5d.cn', 'xn--bcher-kva.xn--55qx5d.cn'),
+])
+def test_registrable_domain(value, expected):
+    assert registrableDomain(value) == expected
+
+
+@pytest.mark.parametrize('value', ['10.0.0.1', 'localhost', 'com.vn', 'b.ck', 'ck', 'kawasaki.jp'])
+def test_hosts_without_registrable_domain_come_back_normalized(value):
+    assert registrableDomain(value) == value
+    assert registrableDomain(f"http://{value}:8080/path") == value
+
+
+def test_www_is_kept_before_the_suffix_lookup():
+    assert normalizeHost('https://www.ck/') == 'www.ck'
+    assert registrableDomain('www.com.vn') == 'www.com.vn'
+    assert registrableDomain('www.seongon.com.vn') == 'seongon.com.vn'
+
+
+def test_match_domain():
+    index = domainIndex(['seongon.com.vn', 'blog.seongon.com.vn', 'seongon.com', 'notseongon.com', 'other.com', 'www.ck', 'a.www.ck'])
+    assert matchDomain(index, 'https://www.seongon.com.vn/').tolist() == [True, True, False, False, False, False, False]
+    assert matchDomain(index, 'www.ck').tolist() == [False, False, False, False, False, True, True]
+    assert matchDomain(index, 'unknown.com').tolist() == [False] * 7
+    assert matchDomain(index, '').tolist() == [False] * 7
+    ## no suffix: a substring test over the registrable domains
+    assert matchDomain(index, 'SEONGON').tolist() == [True, True, True, True, False, False, False]
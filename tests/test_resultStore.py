@@ -0,0 +1,40 @@
+import os
+import time
+
+import functions.resultStore as store_module
+from functions.prepareAnalysis import prepareAnalysis
+from functions.resultStore import isResultStore, writeResultStore, writeStoreOnce
+from functions.syntheticSerp import syntheticSerp
+
+
+def test_content_named_stores_are_capped(monkeypatch, tmp_path):
+    monkeypatch.setattr(store_module, 'MAX_STORES', 2)
+    records = syntheticSerp(20, seed=1)
+    paths = [str(tmp_path / name) for name in ('a', 'b', 'c')]
+
+    writeStoreOnce(records, paths[0])
+    time.sleep(0.01)
+    writeStoreOnce(records, paths[1])
+    time.sleep(0.01)
+    ## reusing the first store makes it the most recent one, the second is the oldest when the third arrives
+    assert writeStoreOnce(iter(()), paths[0]) == paths[0]
+    time.sleep(0.01)
+    writeStoreOnce(records, paths[2])
+
+    assert [isResultStore(path) for path in paths] == [True, False, True]
+    assert sorted(os.listdir(tmp_path)) == ['a', 'c']
+
+
+def test_prepare_analysis_filters_location_and_language(tmp_path):
+    vietnam = syntheticSerp(60, seed=2)
+    ## the same keywords fetched for a second market, a mixed file like the CLI's --input can get
+    us = syntheticSerp(60, seed=3, location_code=2840, language_code='en')
+    records = vietnam + us
+    path = writeResultStore(records, str(tmp_path / 'store'))
+
+    expected = prepareAnalysis(vietnam)
+    for dataframe in (records, path):
+        prepared = prepareAnalysis(dataframe, location_code='2704', language_code='vi')
+        assert prepared['keywords_analyzed'] == expected['keywords_analyzed']
+        assert prepared['ai_overviews_found'] == expected['ai_overviews_found']
+        assert prepared['competitors_df'].equals(expected['competitors_df'])